@@ -19,12 +19,20 @@ import torch
 import transformers
 import copy
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Optional, Union
 from transformers import set_seed
 from torch import autocast
 from tqdm import tqdm
 import accelerate
 from packaging import version
+from .checkpoint import BlockCheckpoint, get_config_hash, set_rng_state
+from .compile_cache import BlockCompileCache, synchronize
+from .memory_planner import MemoryPlanner, parse_memory_budget
+from .telemetry import Telemetry
+from .convergence import ConvergencePolicy, get_convergence_policy
+from .data_type import get_quant_func
 from .quantizer import WrapperMultiblock, wrapper_block, unwrapper_block, WrapperLinear, unwrapper_layer
 from .special_model_handler import (
     shareable_keywords,
@@ -33,11 +41,12 @@ from .special_model_handler import (
     check_skippable_keywords
 )
 from .utils import (
+    BatchPrefetcher,
     CpuInfo,
     block_forward,
     check_is_cpu,
     check_to_quantized,
-    collect_best_params,
+    BestParamsStore,
     convert_dtype_str2torch,
     detect_device,
     get_block_names,
@@ -50,12 +59,19 @@ from .utils import (
     to_dtype,
     get_layer_names_in_block,
     mv_module_from_gpu,
-    unsupport_meta_device, clear_memory,
+    unsupport_meta_device, clear_memory, is_oom_error,
     compile_func,
     find_matching_blocks, is_debug_mode,
+    gather_samples,
+    get_data_parallel_info,
+    shard_indices,
+    all_reduce_value,
+    all_reduce_grads,
+    broadcast_module,
     TORCH_VERSION_AT_LEAST_2_6
 )
 from .low_cpu_mem.utils import get_layers_before_block
+from .tensor_cache import DiskTensorList, ContiguousTensorList
 
 
 class AutoRound(object):
@@ -117,8 +133,49 @@ class AutoRound(object):
         to_quant_block_names (str|list): A string or list whose elements are list of
                             block's layer names to be quantized.
         enable_norm_bias_tuning (bool): Whether to enable fast norm/layer_bias tuning
-        enable_torch_compile (bool): Whether to enable torch compile to optimize quant_block/layer, torch>=2.6 True.
+        enable_torch_compile (bool): Whether to enable torch compile to optimize quant_block/layer, the block forward
+                                     is compiled once and reused for the blocks of the same architecture.
         device_map (str|dict): device map for each block
+        pipeline_device (str): The device used to compute the unquantized outputs of the next block while the
+                               current block is being tuned, e.g. "cuda:1" or "cpu" (default is None, disabled).
+        disk_cache_dir (str): The directory to spill the cached block inputs and outputs to as memory-mapped files,
+                              which keeps the host memory usage independent of nsamples (default is None, disabled).
+        enable_prefetch (bool): Whether to stage the next mini-batch on the tuning device while the current one is
+                                being processed, useful with low_gpu_mem_usage (default is False).
+        enable_fused_qdq (bool): Whether to quantize-dequantize the weights with the fused kernels, which recompute
+                                 the rounding in the backward instead of saving it (default is False).
+        convergence_policy (str|ConvergencePolicy): The policy to stop the tuning of a block or layer once its loss
+                                                   has converged, "ema", "rel_improve" or "init_loss_budget"
+                                                   (default is None, always run iters).
+        adaptive_iters (bool): Whether to redistribute the total iterations of all blocks by their sensitivity,
+                               probed with the error of RTN quantization before tuning (default is False).
+        enable_data_parallel (bool): Whether to split the mini-batches of block tuning across the processes of the
+                                     initialized torch.distributed group, e.g. launched by torchrun with gloo on CPU
+                                     or nccl on GPUs. Each process tunes on batch_size * gradient_accumulate_steps
+                                     samples and the gradients are all-reduced, so all processes get the same
+                                     model (default is False).
+        enable_layer_parallel (bool): Whether to tune the linears of a block one by one against their own outputs
+                                      instead of the block output, where independent linears, e.g. q/k/v, gate/up
+                                      or the experts of MoE, are tuned concurrently (default is False).
+        enable_block_parallel (bool): Whether to distribute the blocks across the processes of the initialized
+                                      torch.distributed group when enable_quanted_input is False. The inputs of
+                                      all blocks are cached in one calibration pass, each process tunes its share
+                                      of the blocks and the tuned blocks are broadcast to all processes. The
+                                      cache grows with the number of blocks, consider setting disk_cache_dir
+                                      (default is False).
+        checkpoint_dir (str): The directory to save a checkpoint to after each tuned block, a restarted run with the
+                              same configuration skips the blocks finished before and resumes from the last one
+                              (default is None, disabled).
+        memory_budget (float|str): The memory budget in GB of the tuning device, or "auto" for its free memory. The
+                                   peak memory is estimated from the shapes of the model before running, and
+                                   batch_size, gradient_accumulate_steps, infer_bs_coeff and low_gpu_mem_usage are
+                                   picked to fit it (default is None, disabled).
+        telemetry_dir (str): The directory to write the time of the tuning phases, the peak memory and the throughput
+                             of each block to, as telemetry.jsonl and the Chrome trace trace.json (default is None,
+                             disabled).
+        calib_cache_dir (str): The directory to cache the tokenized calibration samples in, keyed by the tokenizer,
+                               the dataset, the seed, seqlen, nsamples and batch_size, so the runs with the same
+                               settings skip loading and tokenizing the dataset (default is None, disabled).
     Returns:
         The quantized model.
     """
@@ -162,6 +219,19 @@ class AutoRound(object):
             enable_norm_bias_tuning: bool = False,
             enable_torch_compile: bool = False,
             device_map: Union[str, dict] = None,
+            pipeline_device: str = None,
+            disk_cache_dir: str = None,
+            enable_prefetch: bool = False,
+            enable_fused_qdq: bool = False,
+            convergence_policy: Union[str, ConvergencePolicy] = None,
+            adaptive_iters: bool = False,
+            enable_data_parallel: bool = False,
+            enable_layer_parallel: bool = False,
+            enable_block_parallel: bool = False,
+            checkpoint_dir: str = None,
+            memory_budget: Union[float, str] = None,
+            telemetry_dir: str = None,
+            calib_cache_dir: str = None,
             process_batch=1000,
             task=None,
             **kwargs,
@@ -209,6 +279,12 @@ class AutoRound(object):
             all_blocks = get_block_names(model)
             self.quant_block_list = find_matching_blocks(model, all_blocks, self.to_quant_block_names)
         self.cache_device = torch.device("cpu") if self.low_gpu_mem_usage else self.device
+        self.disk_cache_dir = disk_cache_dir
+        self.enable_prefetch = enable_prefetch
+        self.enable_fused_qdq = enable_fused_qdq
+        if self.disk_cache_dir is not None and torch.device(self.cache_device).type != "cpu":
+            self.cache_device = torch.device("cpu")
+            logger.info("cache block inputs on cpu as disk_cache_dir is set")
 
         ##activation
         self.act_group_size = act_group_size if not (act_group_size is None) else self.group_size
@@ -220,12 +296,37 @@ class AutoRound(object):
         self.sampler = sampler
         self.not_use_best_mse = not_use_best_mse
         self.dynamic_max_gap = dynamic_max_gap
+        self.convergence_policy = get_convergence_policy(convergence_policy, self.iters)
+        self.adaptive_iters = adaptive_iters
+        self.block_iters = {}
+        self.data_parallel_info = get_data_parallel_info() if enable_data_parallel else None
+        if enable_data_parallel and self.data_parallel_info is None:
+            logger.warning("enable_data_parallel requires an initialized torch.distributed process group, "
+                           "tune in a single process")
+        self.enable_layer_parallel = enable_layer_parallel
+        if self.enable_layer_parallel and (self.nblocks > 1 or self.low_cpu_mem_usage):
+            logger.warning("enable_layer_parallel does not support nblocks > 1 or low_cpu_mem_usage, disable it")
+            self.enable_layer_parallel = False
+        self.block_parallel_info = get_data_parallel_info() if enable_block_parallel else None
+        if enable_block_parallel and (self.enable_quanted_input or self.low_cpu_mem_usage):
+            logger.warning("enable_block_parallel requires enable_quanted_input to be False and does not support "
+                           "low_cpu_mem_usage, disable it")
+            self.block_parallel_info = None
+        elif enable_block_parallel and self.block_parallel_info is None:
+            logger.warning("enable_block_parallel requires an initialized torch.distributed process group, "
+                           "tune in a single process")
+        if self.block_parallel_info is not None and self.data_parallel_info is not None:
+            logger.warning("enable_data_parallel could not be used with enable_block_parallel, disable it")
+            self.data_parallel_info = None
         self.lr_scheduler = lr_scheduler
         self.optimizer = self.get_optimizer(None)
         self.batch_dim = None
         self.infer_bs_coeff = 1
+        self.oom_adjustments = []
+        self.telemetry = Telemetry(telemetry_dir, self.device) if telemetry_dir is not None else None
 
         self.process_batch = process_batch
+        self.calib_cache_dir = calib_cache_dir
         self.task = task
 
         torch.set_printoptions(precision=3, sci_mode=True)
@@ -258,6 +359,8 @@ class AutoRound(object):
         if ("fp8" in self.data_type or "fp8" in self.act_data_type) and self.enable_torch_compile:
             self.enable_torch_compile = False
             logger.warning("reset enable_torch_compile to `False` as fp8 is enabled")
+        ## the block forward is compiled once and reused for all the blocks of the same architecture
+        self.compile_cache = BlockCompileCache(self.device) if self.enable_torch_compile else None
 
         if is_optimum_habana_available():
             logger.info("Optimum Habana is available, import htcore explicitly.")
@@ -267,8 +370,56 @@ class AutoRound(object):
 
         self.set_device_map_in_blocks(self.device_map)
 
+        self.pipeline_device = detect_device(pipeline_device) if pipeline_device is not None else None
+        if self.pipeline_device is not None and self.low_cpu_mem_usage:
+            self.pipeline_device = None
+            logger.warning("reset pipeline_device to `None` as low_cpu_mem_usage is enabled")
+        if self.pipeline_device is not None and self.device_map is not None:
+            self.pipeline_device = None
+            logger.warning("reset pipeline_device to `None` as device_map is set")
+
+        self.memory_plan = None
+        if memory_budget is not None:
+            self.plan_memory(memory_budget)
+        ## after the memory plan, which could change the batch size the blocks are tuned with
+        self.checkpoint = BlockCheckpoint(checkpoint_dir, get_config_hash(self.get_tuning_config())) \
+            if checkpoint_dir is not None else None
+        if self.checkpoint is not None and (self.act_bits <= 8 or self.low_cpu_mem_usage):
+            logger.warning("checkpoint_dir does not support activation quantization or low_cpu_mem_usage, disable it")
+            self.checkpoint = None
+
         self.set_layerwise_config(self.layer_config)  ##better place in the end
 
+    def trace(self, name, **kwargs):
+        """Returns the context timing the phase name when the telemetry is enabled."""
+        return self.telemetry.span(name, **kwargs) if self.telemetry is not None else nullcontext()
+
+    def trace_block(self, block_name):
+        """Returns the context collecting the statistics of a block when the telemetry is enabled."""
+        return self.telemetry.block(block_name) if self.telemetry is not None else nullcontext()
+
+    def plan_memory(self, memory_budget):
+        """Picks batch_size, gradient_accumulate_steps, infer_bs_coeff and where to cache the block inputs so that
+        the estimated peak memory of the tuning fits the budget, and prints the plan.
+
+        Args:
+            memory_budget (float|str): The memory budget in GB of the tuning device, or of the host when tuning on
+                                       cpu, "auto" for the free memory of the device.
+        """
+        planner = MemoryPlanner(
+            self.model, self.quant_block_list, self.seqlen, self.nsamples, self.amp_dtype, self.enable_quanted_input,
+            self.device, nblocks=self.nblocks, supported_types=self.supported_types)
+        plan = planner.plan(
+            parse_memory_budget(memory_budget, self.device), self.batch_size, self.gradient_accumulate_steps,
+            low_gpu_mem_usage=self.low_gpu_mem_usage, cache_on_disk=self.disk_cache_dir is not None)
+        planner.log_plan(plan)
+        self.batch_size = plan["batch_size"]
+        self.gradient_accumulate_steps = plan["gradient_accumulate_steps"]
+        self.infer_bs_coeff = plan["infer_bs_coeff"]
+        self.low_gpu_mem_usage = plan["low_gpu_mem_usage"]
+        self.cache_device = torch.device(plan["cache_device"])
+        self.memory_plan = plan
+
     def set_device_map_in_blocks(self, device_map):
         """Sets the device map for specific blocks in the model.
 
@@ -385,31 +536,26 @@ class AutoRound(object):
 
         layer_names = self.get_quantized_layer_names_outside_blocks()
         self.start_time = time.time()
-        all_first_block_names = [block[0] for block in all_blocks]
+        if self.block_parallel_info is not None:
+            ## the inputs of every group of blocks are cached, as the blocks do not depend on each other
+            all_first_block_names = [n for block in all_blocks for n in block[::self.nblocks]]
+        else:
+            all_first_block_names = [block[0] for block in all_blocks]
         logger.info("start to cache block inputs")
-        all_inputs = self.try_cache_inter_data_gpucpu(all_first_block_names, self.nsamples, layer_names=layer_names)
+        with self.trace("caching"):
+            all_inputs = self.try_cache_inter_data_gpucpu(all_first_block_names, self.nsamples,
+                                                          layer_names=layer_names)
         if hasattr(self.model, "hf_device_map") and len(self.model.hf_device_map) > 1:
             accelerate.hooks.remove_hook_from_submodules(self.model)  ##self.model.hf_device_map has not been changed
         self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
         logger.info("caching done")
         pbar = tqdm(range(0, sum([len(i) for i in all_blocks]), self.nblocks))
         for block_names in all_blocks:
-            inputs = all_inputs[block_names[0]]
-            all_inputs.pop(block_names[0])
-            keys = inputs.keys()
-            input_id_str = [key for key in keys if key.startswith('hidden_state')]
-            if len(input_id_str) != 1:
-                raise RuntimeError(f"hidden_states arg mismatch error,"
-                                   "please raise an issue in https://github.com/intel/auto-round/issues")
-            inputs["input_ids"] = inputs.pop(input_id_str[0], None)
-            clear_memory(self.inputs)
-
-            if "input_ids" in inputs.keys():
-                total_samples = len(inputs["input_ids"])
-                self.n_samples = total_samples
-                if total_samples < self.batch_size:
-                    self.batch_size = total_samples
-                    logger.warning(f"force the train batch size to {total_samples}")
+            if self.block_parallel_info is not None:
+                self.quant_blocks_parallel(self.model, all_inputs, block_names, nblocks=self.nblocks,
+                                           device=self.device, pbar=pbar)
+                continue
+            inputs = self.get_block_inputs(all_inputs, block_names[0])
 
             self.quant_blocks(
                 self.model,
@@ -421,6 +567,10 @@ class AutoRound(object):
             )
 
         self.quant_layers(layer_names, all_inputs)
+        if self.compile_cache is not None:
+            self.compile_cache.report()
+        if self.telemetry is not None:
+            self.telemetry.dump_trace()
 
         self.dump_qinfo_to_layer_config(dump_scale=dump_scale)
 
@@ -448,6 +598,57 @@ class AutoRound(object):
         ##self.model = self.model.to(self.model_orig_dtype)##keep it as amp dtype
         return self.model, self.layer_config
 
+    def get_block_inputs(self, all_inputs, block_name):
+        """Pops the cached inputs of a block and renames its hidden states to input_ids."""
+        inputs = all_inputs.pop(block_name)
+        keys = inputs.keys()
+        input_id_str = [key for key in keys if key.startswith('hidden_state')]
+        if len(input_id_str) != 1:
+            raise RuntimeError(f"hidden_states arg mismatch error,"
+                               "please raise an issue in https://github.com/intel/auto-round/issues")
+        inputs["input_ids"] = inputs.pop(input_id_str[0], None)
+        clear_memory(self.inputs)
+
+        if "input_ids" in inputs.keys():
+            total_samples = len(inputs["input_ids"])
+            self.n_samples = total_samples
+            if total_samples < self.batch_size:
+                self.batch_size = total_samples
+                logger.warning(f"force the train batch size to {total_samples}")
+        return inputs
+
+    def quant_blocks_parallel(self, model, all_inputs, block_names, nblocks=1, device=torch.device("cpu"),
+                              pbar=None):
+        """Quantizes the groups of nblocks blocks distributed across the processes, then merges them.
+
+        Every group is tuned from its own cached inputs, so the groups are assigned to the processes round-robin.
+        The RNG is seeded per group, the result therefore does not depend on the number of processes.
+
+        Args:
+        model: The PyTorch model to be quantized.
+        all_inputs: The cached inputs of the first block of every group.
+        block_names: The names of the blocks to be quantized.
+        nblocks: The number of blocks to quantize together.
+        device: The device for quantization.
+
+        Returns:
+        None
+        """
+        rank, world_size = self.block_parallel_info
+        groups = [block_names[i: i + nblocks] for i in range(0, len(block_names), nblocks)]
+        for index, names in enumerate(groups):
+            inputs = self.get_block_inputs(all_inputs, names[0])
+            if index % world_size != rank:
+                clear_memory(inputs)
+                pbar.update(1)
+                continue
+            set_seed(self.seed + index)
+            self.quant_blocks(model, inputs, names, nblocks=nblocks, device=device, pbar=pbar)
+        for index, names in enumerate(groups):
+            for n in names:
+                broadcast_module(get_module(model, n), src=index % world_size)
+        set_seed(self.seed)
+
     def dump_qinfo_to_layer_config(self, dump_scale=False):
         """
         dump quantization scale and zp to layer configuration
@@ -511,7 +712,8 @@ class AutoRound(object):
             layer_input = to_device(layer_input, self.cache_device)
             q_layer_input = q_layer_inputs[layer_name] if enable_quanted_input else None
             q_layer_input = to_device(q_layer_input, self.cache_device)
-            quant_layer(layer_name, layer_input, q_layer_input, device=self.device)
+            with self.trace_block(layer_name):
+                quant_layer(layer_name, layer_input, q_layer_input, device=self.device)
             del layer_input
             clear_memory(q_layer_input)
 
@@ -555,6 +757,39 @@ class AutoRound(object):
             for key in keys:
                 setattr(m, key, layer_config[n][key])
 
+    def new_cache_list(self, prefix="cache", dim=0, capacity=None):
+        """Creates an empty list to cache calibration samples.
+
+        Args:
+            prefix (str): The prefix of the backing file if disk_cache_dir is set.
+            dim (int): The dimension the samples are concatenated along in a mini-batch.
+            capacity (int): The expected number of samples.
+
+        Returns:
+            A DiskTensorList if disk_cache_dir is set, else a ContiguousTensorList.
+        """
+        if self.disk_cache_dir is not None:
+            return DiskTensorList(self.disk_cache_dir, prefix)
+        pin_memory = torch.device(self.cache_device).type == "cpu" and str(self.device).startswith("cuda")
+        return ContiguousTensorList(dim, capacity, pin_memory=pin_memory)
+
+    def record_oom_backoff(self, stage, batch_size, gradient_accumulate_steps=None, block_name=None):
+        """Records a batch size reduced after an out-of-memory error.
+
+        Args:
+            stage (str): "tuning" or "inference".
+            batch_size (int): The reduced batch size.
+            gradient_accumulate_steps (int): The increased gradient accumulation steps of the tuning.
+            block_name (str): The name of the tuned block.
+        """
+        adjustment = {"stage": stage, "batch_size": batch_size}
+        if gradient_accumulate_steps is not None:
+            adjustment["gradient_accumulate_steps"] = gradient_accumulate_steps
+        if block_name is not None:
+            adjustment["block"] = block_name
+        self.oom_adjustments.append(adjustment)
+        logger.warning(f"out of memory, retry with {', '.join(f'{k}={v}' for k, v in adjustment.items())}")
+
     @torch.no_grad()
     def get_block_outputs(self, block, input_ids, input_others, bs, device, cache_device, save_output=True):
         """Compute the output of a given block of the model for a given input.
@@ -570,28 +805,41 @@ class AutoRound(object):
 
         Returns:
         The output tensor of the block.
+
+        The batch is halved and the current batch is retried on out-of-memory errors.
         """
 
-        output = []
+        output = self.new_cache_list("output", dim=self.batch_dim, capacity=len(input_ids)) if save_output else []
         nsamples = len(input_ids)
-        for i in range(0, nsamples, bs):
-            end_index = min(nsamples, i + bs)
-            indices = torch.arange(i, end_index).to(torch.long)
-            tmp_input_ids, tmp_input_others = sampling_inputs(
-                input_ids,
-                input_others,
-                indices,
-                self.seqlen,
-                self.batch_dim
-            )
-            tmp_output = block_forward(block, tmp_input_ids, tmp_input_others, self.amp, self.amp_dtype, device).to(
-                cache_device
-            )
-            if save_output:
-                if self.batch_size == 1:
-                    output.append(tmp_output)
-                else:
-                    output.extend(list(torch.split(tmp_output, 1, dim=self.batch_dim)))
+        with self.trace("get_block_outputs"):
+            i = 0
+            while i < nsamples:
+                end_index = min(nsamples, i + bs)
+                indices = torch.arange(i, end_index).to(torch.long)
+                tmp_input_ids, tmp_input_others = sampling_inputs(
+                    input_ids,
+                    input_others,
+                    indices,
+                    self.seqlen,
+                    self.batch_dim
+                )
+                try:
+                    tmp_output = block_forward(block, tmp_input_ids, tmp_input_others, self.amp, self.amp_dtype,
+                                               device).to(cache_device)
+                except RuntimeError as e:
+                    if not is_oom_error(e) or end_index - i == 1:
+                        raise
+                    del tmp_input_ids, tmp_input_others
+                    clear_memory()
+                    bs = (end_index - i + 1) // 2
+                    self.record_oom_backoff("inference", bs)
+                    continue
+                if save_output:
+                    if end_index - i == 1:
+                        output.append(tmp_output)
+                    else:
+                        output.extend(list(torch.split(tmp_output, 1, dim=self.batch_dim)))
+                i = end_index
         if self.low_gpu_mem_usage:
             clear_memory()
 
@@ -614,7 +862,6 @@ class AutoRound(object):
         if isinstance(self.dataset, str):
             dataset = self.dataset.replace(" ", "")  ##remove all whitespaces
 
-            # slow here
             self.dataloader = get_dataloader(
                 self.tokenizer,
                 self.seqlen,
@@ -622,7 +869,8 @@ class AutoRound(object):
                 self.seed,
                 bs,
                 self.nsamples,
-                self.process_batch
+                self.process_batch,
+                cache_dir=self.calib_cache_dir,
             )
         else:
             self.dataloader = self.dataset
@@ -715,6 +963,12 @@ class AutoRound(object):
         """
         if layer_names is None:
             layer_names = []
+        if self.memory_plan is not None and not self.memory_plan["calib_on_device"]:
+            logger.info("cache block inputs on cpu as the model does not fit the memory budget")
+            self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
+            return self.cache_inter_data(
+                block_names, nsamples, layer_names=layer_names, last_cache_name=last_cache_name
+            )
         try:
             if not self.model.device.type == "meta":
                 if hasattr(self.model, "hf_device_map") and len(self.model.hf_device_map) > 1:
@@ -727,7 +981,7 @@ class AutoRound(object):
             self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
             clear_memory()
         except RuntimeError as e:
-            if "CUDA out of memory" in str(e) or "MODULE:PT_DEVMEM" in str(e):
+            if is_oom_error(e):
                 logger.info("switch to cpu to cache block inputs")
                 if (("lm_head" in self.layer_config and self.layer_config["lm_head"]["bits"] < 16) or
                         self.__class__.__name__ == "AutoRoundMLLM"):
@@ -780,7 +1034,8 @@ class AutoRound(object):
         calib_bs = self.batch_size
         self.hook_handles = []
         self._replace_forward()
-        self.calib(nsamples, calib_bs)
+        with self.trace("calibration"):
+            self.calib(nsamples, calib_bs)
         self._recover_forward()
         res = self.inputs
         del self.last_cache_name
@@ -863,11 +1118,16 @@ class AutoRound(object):
                         if data is None or (self.batch_size > 1 and key in shareable_keywords):
                             self.inputs[name][key] = data
                             continue
+                        if key in shareable_keywords:
+                            self.inputs[name][key] = []
+                        else:
+                            self.inputs[name][key] = self.new_cache_list(
+                                key, dim=self.batch_dim if key == "hidden_states" else 0, capacity=self.nsamples)
                         if self.batch_size <= 1:
-                            self.inputs[name][key] = [data]
+                            self.inputs[name][key].append(data)
                         else:
                             data = post_process_cache_data(self.batch_size, data, key)
-                            self.inputs[name][key] = list(torch.split(data, 1, dim=self.batch_dim))
+                            self.inputs[name][key].extend(list(torch.split(data, 1, dim=self.batch_dim)))
                     else:  # append cache inputs
                         new_data = post_process_cache_data(self.batch_size, kwargs[key], key)
                         if new_data is None:  # shareable args or NoneType
@@ -908,10 +1168,9 @@ class AutoRound(object):
             input = inputs
             if isinstance(inputs, tuple) or isinstance(input, list):
                 input = inputs[0]
-            if name in self.inputs:
-                self.inputs[name].extend(list(torch.split(input.to("cpu"), 1, dim=0)))
-            else:
-                self.inputs[name] = list(torch.split(input.to("cpu"), 1, dim=0))
+            if name not in self.inputs:
+                self.inputs[name] = self.new_cache_list("layer_input", capacity=self.nsamples)
+            self.inputs[name].extend(list(torch.split(input.to("cpu"), 1, dim=0)))
 
         return cache_input_hook
 
@@ -919,7 +1178,12 @@ class AutoRound(object):
         """Recovers the forward function."""
         for n, m in self.model.named_modules():
             if hasattr(m, "orig_forward"):
-                m.forward = m.orig_forward
+                if getattr(m.orig_forward, "__func__", None) is type(m).forward:
+                    ## drop the instance attribute, so the block stays identical to the blocks never replaced,
+                    ## e.g. for the guards of the compiled block forward
+                    delattr(m, "forward")
+                else:
+                    m.forward = m.orig_forward
                 delattr(m, "orig_forward")
         for hook_handle in self.hook_handles:
             hook_handle.remove()
@@ -938,7 +1202,8 @@ class AutoRound(object):
                 hook_handle = m.register_forward_hook(hook_func)
                 self.hook_handles.append(hook_handle)
 
-    def quant_layer(self, layer_name, inputs, q_inputs=None, device=torch.device("cpu")):
+    def quant_layer(self, layer_name, inputs, q_inputs=None, device=torch.device("cpu"), generator=None,
+                    convergence_policy=None):
         """Quantize a specific layer of the model using the provided inputs.
 
         Args:
@@ -946,6 +1211,9 @@ class AutoRound(object):
             inputs (torch.Tensor): Input data for quantization.
             q_inputs (torch.Tensor, optional): Quantized input data. Defaults to None.
             device (torch.device, optional): The device to use for quantization. Defaults to torch.device("cpu").
+            generator (torch.Generator, optional): The generator to sample with. Defaults to the global one.
+            convergence_policy (ConvergencePolicy, optional): The fork of the convergence policy to tune the layer
+                with, which the caller joins. Defaults to a fork joined here.
 
         Returns:
             None
@@ -956,13 +1224,12 @@ class AutoRound(object):
             device = layer.tuning_device
 
         layer = layer.to(device)
-        for i in range(len(inputs)):
-            inputs[i] = inputs[i].to(layer.weight.dtype)
-            if q_inputs is not None:
-                q_inputs[i] = q_inputs[i].to(layer.weight.dtype)
+        inputs = to_dtype(inputs, layer.weight.dtype)
+        if q_inputs is not None:
+            q_inputs = to_dtype(q_inputs, layer.weight.dtype)
 
-        wrapper_linear = WrapperLinear(layer, enable_minmax_tuning=self.enable_minmax_tuning, device=device).to(
-            device)
+        wrapper_linear = WrapperLinear(layer, enable_minmax_tuning=self.enable_minmax_tuning, device=device,
+                                       enable_fused_qdq=self.enable_fused_qdq).to(device)
         round_params = []
         minmax_params = []
         for key in wrapper_linear.params.keys():
@@ -984,8 +1251,9 @@ class AutoRound(object):
         else:
             lr_schedule = copy.deepcopy(self.lr_scheduler)
         nsamples = len(inputs)
-        last_best_iter = 0
-        best_loss = torch.finfo(torch.float).max
+        last_best_iter = torch.tensor(0, device=device)
+        best_loss = torch.tensor(torch.finfo(torch.float).max, device=device)
+        best_params = BestParamsStore(wrapper_linear, device="cpu" if self.low_gpu_mem_usage else None)
         mse_loss = torch.nn.MSELoss().to(device)
         scaler = self.get_scaler()  # pylint: disable=assignment-from-none
         init_loss = None
@@ -995,18 +1263,29 @@ class AutoRound(object):
         pick_samples = batch_size * gradient_accumulate_steps
         pick_samples = min(nsamples, pick_samples)
         if self.sampler != "rand":
-            whole_indices = torch.randperm(nsamples)[:pick_samples]
+            whole_indices = torch.randperm(nsamples, generator=generator)[:pick_samples]
         total_loss = 0
         num_elm = 1
         mse_reduction = "mean"
         if gradient_accumulate_steps != 1:
             mse_reduction = "sum"
         mse_loss = torch.nn.MSELoss(reduction=mse_reduction).to(device)
+        ## layers may be tuned concurrently, so each one uses its own fork of the policy
+        join_policy = convergence_policy is None and self.convergence_policy is not None
+        if join_policy:
+            convergence_policy = self.convergence_policy.fork()
+        if convergence_policy is not None:
+            loss_scale = None
+            if convergence_policy.requires_loss_scale:
+                loss_scale = self.get_output_scale(
+                    layer(gather_samples(inputs, range(i, min(i + batch_size, nsamples)), dim=0).to(device))
+                    for i in range(0, nsamples, batch_size))
+            convergence_policy.reset(self.iters, loss_scale)
 
         for i in range(self.iters):
-            total_loss = 0
+            total_loss = torch.zeros((), dtype=torch.float32, device=device)
             if self.sampler == "rand":
-                whole_indices = torch.randperm(nsamples)[:pick_samples]
+                whole_indices = torch.randperm(nsamples, generator=generator)[:pick_samples]
                 if gradient_accumulate_steps != 1:
                     if q_inputs is not None:
                         current_input = [q_inputs[i] for i in whole_indices]
@@ -1015,14 +1294,13 @@ class AutoRound(object):
                     num_elm = sum(id.numel() for id in current_input)
             for tmp_step in range(gradient_accumulate_steps):
                 indices = whole_indices[tmp_step * batch_size: (tmp_step + 1) * batch_size]
+                if len(indices) == 0:
+                    continue
                 if q_inputs is not None:
-                    current_input = [q_inputs[i] for i in indices]
-                    current_input = torch.cat(current_input, dim=0).to(device)
-                    org_input = [inputs[i] for i in indices]
-                    org_input = torch.cat(org_input, dim=0).to(device)
+                    current_input = gather_samples(q_inputs, indices, dim=0).to(device)
+                    org_input = gather_samples(inputs, indices, dim=0).to(device)
                 else:
-                    current_input = [inputs[i] for i in indices]
-                    current_input = torch.cat(current_input, dim=0).to(device)
+                    current_input = gather_samples(inputs, indices, dim=0).to(device)
                     org_input = current_input
                 with torch.no_grad():
                     current_output = layer(org_input)
@@ -1036,7 +1314,7 @@ class AutoRound(object):
                     loss = mse_loss(  # pylint: disable=not-callable
                         output_q.to(torch.float32), current_output.to(torch.float32)
                     )
-                total_loss += loss.item() / num_elm
+                total_loss += loss.detach().to(torch.float32) / num_elm
 
                 self.scale_loss_and_backward(scaler, loss)
 
@@ -1044,35 +1322,43 @@ class AutoRound(object):
                 self.task.get_logger().report_scalar(
                     title='Layer Quantization Loss',
                     series=layer_name,
-                    value=total_loss,
+                    value=total_loss.item(),
                     iteration=i,
                 )
                 
             if i == 0:
                 init_loss = total_loss
+            converged = convergence_policy is not None and convergence_policy.update(total_loss.item())
 
-            if total_loss < best_loss:
-                best_loss = total_loss
-                if not self.not_use_best_mse:
-                    best_params = collect_best_params(wrapper_linear)
-                    last_best_iter = i
-            if self.not_use_best_mse and i == self.iters - 1:
-                best_params = collect_best_params(wrapper_linear)
+            improved = total_loss < best_loss
+            best_loss = torch.minimum(best_loss, total_loss)
+            if not self.not_use_best_mse:
+                best_params.update(improved)
+                last_best_iter = torch.where(improved, i, last_best_iter)
+            if self.not_use_best_mse and (i == self.iters - 1 or converged):
+                best_params.update()
 
             if not self.not_use_best_mse:
-                if 0 < self.dynamic_max_gap <= i - last_best_iter:
-                    break
+                if 0 < self.dynamic_max_gap <= i - last_best_iter.item():
+                    converged = True
+            if converged:
+                break
             self.step(scaler, optimizer, lr_schedule)
+        if join_policy:
+            self.convergence_policy.join([convergence_policy])
 
         last_loss = total_loss
+        used_iters = i + 1
         best_iter = self.iters
         if not self.not_use_best_mse:
             last_loss = best_loss
-            best_iter = last_best_iter
+            best_iter = last_best_iter.item()
         with torch.no_grad():
-            unwrapper_layer(self.model, wrapper_linear, layer_name, best_params)
+            ## the params are collected by module name, and the wrapper itself is named ""
+            unwrapper_layer(self.model, wrapper_linear, layer_name, best_params.get("", None))
         mv_module_from_gpu(layer, self.low_cpu_mem_usage)
-        dump_info = f"quantized {layer_name},  loss iter 0: {init_loss:.6f} -> iter {best_iter}: {last_loss:.6f}"
+        dump_info = (f"quantized {layer_name},  loss iter 0: {init_loss.item():.6f} -> iter {best_iter}: "
+                     f"{last_loss.item():.6f}, tuned {used_iters}/{self.iters} iters")
         logger.info(dump_info)
 
     def register_act_max_hook(self, model):
@@ -1092,7 +1378,8 @@ class AutoRound(object):
                 hook_handles.append(hook)
         return hook_handles
 
-    def quant_block(self, block_name, block, input_ids, input_others, q_input=None, device=torch.device("cpu")):
+    def quant_block(self, block_name, block, input_ids, input_others, q_input=None, device=torch.device("cpu"),
+                    output=None):
         """Quantize the weights of a given block of the model.
 
         Args:
@@ -1101,6 +1388,7 @@ class AutoRound(object):
         input_others: A dictionary containing additional input data.
         q_input: The quantized input tensor.
         device: The device for quantization.
+        output: The precomputed unquantized outputs of the block, computed here if None.
 
         Returns:
         Tuple: (q_outputs, output) if self.enable_quanted_input is True, else (None, output)
@@ -1114,19 +1402,9 @@ class AutoRound(object):
                 hook = AlignDevicesHook(m.tuning_device, io_same_device=True)
                 add_hook_to_module(m, hook, True)
 
-        if q_input is None:
-            hook_handles = self.register_act_max_hook(block)
-
-            output = self.get_block_outputs(block, input_ids, input_others, self.batch_size * self.infer_bs_coeff,
-                                            device,
-                                            self.cache_device)
-
-            for handle in hook_handles:
-                handle.remove()
-        else:
-            output = self.get_block_outputs(block, input_ids, input_others, self.batch_size * self.infer_bs_coeff,
-                                            device,
-                                            self.cache_device)
+        if output is None:
+            output = self.get_fp_block_outputs(block, input_ids, input_others, device, record_act_max=q_input is None)
+        if q_input is not None:
             hook_handles = self.register_act_max_hook(block)
             self.get_block_outputs(block, q_input, input_others, self.batch_size * self.infer_bs_coeff,
                                    device, self.cache_device, save_output=False)
@@ -1141,8 +1419,10 @@ class AutoRound(object):
                 clear_memory()
             input_ids = q_input
 
-        quantized_layer_names, unquantized_layer_names = wrapper_block(
-            block, self.enable_minmax_tuning, self.enable_norm_bias_tuning, device=self.device)
+        with self.trace("wrap"):
+            quantized_layer_names, unquantized_layer_names = wrapper_block(
+                block, self.enable_minmax_tuning, self.enable_norm_bias_tuning, device=self.device,
+                enable_fused_qdq=self.enable_fused_qdq)
 
         round_params = []
         minmax_params = []
@@ -1169,20 +1449,24 @@ class AutoRound(object):
             logger.info(dump_info)
             return output, output
 
+        iters = self.block_iters.get(block_name, self.iters)
         if self.lr_scheduler is None:
             lr_schedule = torch.optim.lr_scheduler.LinearLR(
-                optimizer, start_factor=1.0, end_factor=0.0, total_iters=self.iters, verbose=False
+                optimizer, start_factor=1.0, end_factor=0.0, total_iters=iters, verbose=False
             )
         else:
             lr_schedule = copy.deepcopy(self.lr_scheduler)
 
         nsamples = len(input_ids)
         pick_samples = self.batch_size * self.gradient_accumulate_steps
+        if self.data_parallel_info is not None:
+            pick_samples *= self.data_parallel_info[1]
         pick_samples = min(nsamples, pick_samples)
         if self.sampler != "rand":
             whole_indices = torch.randperm(nsamples)[:pick_samples]
-        last_best_iter = 0
-        best_loss = torch.finfo(torch.float).max
+        ## the losses are kept on the device and only read on the host when needed, to avoid a sync per step
+        last_best_iter = torch.tensor(0, device=device)
+        best_loss = torch.tensor(torch.finfo(torch.float).max, device=device)
         num_elm = 1
         mse_reduction = "mean"
         if self.gradient_accumulate_steps != 1:
@@ -1190,85 +1474,178 @@ class AutoRound(object):
         mse_loss = torch.nn.MSELoss(reduction=mse_reduction).to(device)
         scaler = self.get_scaler()  # pylint: disable=assignment-from-none
         init_loss = None
-        best_params = {}
+        ## the micro-batch is halved and the gradient accumulation increased on out-of-memory errors
+        batch_size, gradient_accumulate_steps = self.batch_size, self.gradient_accumulate_steps
+        ## with low_gpu_mem_usage, the snapshot is kept in pinned host memory
+        best_params = BestParamsStore(block, device="cpu" if self.low_gpu_mem_usage else None)
         total_loss = 0
 
-        for i in range(self.iters):
-            total_loss = 0
+        prefetcher = None
+        if self.enable_prefetch:
+            def load_batch(indices, slot):
+                current_input_ids, current_input_others = sampling_inputs(
+                    input_ids, input_others, indices, seqlen=self.seqlen, batch_dim=self.batch_dim, slot=slot)
+                current_output = gather_samples(output, indices, dim=self.batch_dim, slot=slot)
+                return current_input_ids, current_input_others, current_output
+
+            prefetcher = BatchPrefetcher(load_batch, device)
+        next_whole_indices, rng_state = None, None
+        if self.convergence_policy is not None:
+            loss_scale = self.get_output_scale(output) if self.convergence_policy.requires_loss_scale else None
+            self.convergence_policy.reset(iters, loss_scale)
+
+        forward_func, compile_key = block_forward, None
+        if self.compile_cache is not None:
+            forward_func = self.compile_cache
+            compile_key = self.compile_cache.get_key(block, input_ids[0])
+            tuning_start_time, first_iter_end_time = time.time(), None
+
+        for i in range(iters):
+            if i == 1 and compile_key is not None:
+                synchronize(device)
+                first_iter_end_time = time.time()
             if self.sampler == "rand":
-                whole_indices = torch.randperm(nsamples)[:pick_samples]
+                if next_whole_indices is not None:
+                    whole_indices, next_whole_indices = next_whole_indices, None
+                else:
+                    whole_indices = torch.randperm(nsamples)[:pick_samples]
                 ##we assume the block input and output shape is same
                 if self.gradient_accumulate_steps != 1:
                     current_input_ids = [input_ids[i] for i in whole_indices]
                     num_elm = sum(id.numel() for id in current_input_ids)
-            for tmp_step in range(self.gradient_accumulate_steps):
-                indices = whole_indices[tmp_step * self.batch_size: (tmp_step + 1) * self.batch_size]
-                current_input_ids, current_input_others = sampling_inputs(
-                    input_ids,
-                    input_others,
-                    indices,
-                    seqlen=self.seqlen,
-                    batch_dim=self.batch_dim,
-                )
-
-                current_output = [output[x] for x in indices]
-                current_output = torch.cat(current_output, dim=self.batch_dim)
-
-                current_output = to_device(current_output, device)
-
-                output_q = block_forward(
-                    block, current_input_ids, current_input_others, self.amp, self.amp_dtype, device
-                )
-                if self.amp:
-                    with autocast(device_type=device.split(":")[0], dtype=self.amp_dtype):
-                        loss = mse_loss(output_q, current_output)  # pylint: disable=not-callable
-                else:
-                    loss = mse_loss(  # pylint: disable=not-callable
-                        output_q.to(torch.float32), current_output.to(torch.float32)
-                    )
-
-                total_loss += loss.item() / num_elm
-                self.scale_loss_and_backward(scaler, loss)
+            local_indices = self._get_local_indices(whole_indices)
+            if self.gradient_accumulate_steps == 1 and gradient_accumulate_steps != 1:
+                ## the sum over the micro-batches normalized by the elements of the batch equals the mean of the batch
+                num_elm = sum(input_ids[index].numel() for index in local_indices)
+            while True:
+                total_loss = torch.zeros((), dtype=torch.float32, device=device)
+                try:
+                    for tmp_step in range(gradient_accumulate_steps):
+                        indices = local_indices[tmp_step * batch_size: (tmp_step + 1) * batch_size]
+                        if len(indices) == 0:
+                            continue
+                        if prefetcher is not None:
+                            current_input_ids, current_input_others, current_output = prefetcher.get(indices)
+                            ## stage the next mini-batch, the indices of the next iteration are drawn in advance and
+                            ## the rng state is restored if the tuning stops early
+                            if tmp_step + 1 < gradient_accumulate_steps:
+                                prefetcher.prefetch(local_indices[(tmp_step + 1) * batch_size:
+                                                                  (tmp_step + 2) * batch_size])
+                            elif i + 1 < iters:
+                                if self.sampler == "rand":
+                                    rng_state = torch.get_rng_state()
+                                    next_whole_indices = torch.randperm(nsamples)[:pick_samples]
+                                    prefetcher.prefetch(self._get_local_indices(next_whole_indices)[:batch_size])
+                                else:
+                                    prefetcher.prefetch(local_indices[:batch_size])
+                        else:
+                            current_input_ids, current_input_others = sampling_inputs(
+                                input_ids,
+                                input_others,
+                                indices,
+                                seqlen=self.seqlen,
+                                batch_dim=self.batch_dim,
+                            )
+
+                            current_output = gather_samples(output, indices, dim=self.batch_dim)
+
+                            current_output = to_device(current_output, device)
+
+                        with self.trace("forward"):
+                            output_q = forward_func(
+                                block, current_input_ids, current_input_others, self.amp, self.amp_dtype, device
+                            )
+                            if self.amp:
+                                with autocast(device_type=device.split(":")[0], dtype=self.amp_dtype):
+                                    loss = mse_loss(output_q, current_output)  # pylint: disable=not-callable
+                            else:
+                                loss = mse_loss(  # pylint: disable=not-callable
+                                    output_q.to(torch.float32), current_output.to(torch.float32)
+                                )
+
+                        total_loss += loss.detach().to(torch.float32) / num_elm
+                        with self.trace("backward"):
+                            self.scale_loss_and_backward(scaler, loss)
+                        if self.telemetry is not None:
+                            self.telemetry.add_samples(len(indices))
+                    break
+                except RuntimeError as e:
+                    if not is_oom_error(e) or batch_size == 1:
+                        raise
+                    ## drop the partial gradients and retry the step with the halved micro-batch
+                    optimizer.zero_grad()
+                    if next_whole_indices is not None:
+                        torch.set_rng_state(rng_state)
+                        next_whole_indices = None
+                    output_q = loss = current_input_ids = current_input_others = current_output = None
+                    clear_memory()
+                    batch_size = (batch_size + 1) // 2
+                    gradient_accumulate_steps = (len(local_indices) + batch_size - 1) // batch_size
+                    if self.gradient_accumulate_steps == 1:
+                        mse_loss = torch.nn.MSELoss(reduction="sum").to(device)
+                        num_elm = sum(input_ids[index].numel() for index in local_indices)
+                    self.record_oom_backoff("tuning", batch_size, gradient_accumulate_steps, block_name)
+
+            if self.data_parallel_info is not None:
+                ## the losses are means of the mini-batches without gradient accumulation, or normalized sums of all
+                ## the samples with it
+                average = self.gradient_accumulate_steps == 1
+                world_size = self.data_parallel_info[1]
+                total_loss = all_reduce_value(total_loss, world_size, average, device)
+                all_reduce_grads(round_params + minmax_params, world_size, average)
 
             if self.task is not None:
                 self.task.get_logger().report_scalar(
                     title='Block Quantization Loss',
                     series=block_name,
-                    value=total_loss,
+                    value=total_loss.item(),
                     iteration=i,
                 )
 
             if i == 0:
                 init_loss = total_loss
+            converged = self.convergence_policy is not None and self.convergence_policy.update(total_loss.item())
 
-            if total_loss < best_loss:
-                best_loss = total_loss
-                if not self.not_use_best_mse:
-                    best_params = collect_best_params(block)
-                    # print(f"get better result at iter {i}, the loss is {total_loss}", flush=True)
-
-                    last_best_iter = i
-            if self.not_use_best_mse and i == self.iters - 1:
-                best_params = collect_best_params(block)
+            improved = total_loss < best_loss
+            best_loss = torch.minimum(best_loss, total_loss)
+            if not self.not_use_best_mse:
+                best_params.update(improved)
+                last_best_iter = torch.where(improved, i, last_best_iter)
+            if self.not_use_best_mse and (i == iters - 1 or converged):
+                best_params.update()
 
             if not self.not_use_best_mse:
-                if 0 < self.dynamic_max_gap <= i - last_best_iter:
-                    break
-            self.step(scaler, optimizer, lr_schedule)
+                if 0 < self.dynamic_max_gap <= i - last_best_iter.item():
+                    converged = True
+            if converged:
+                if next_whole_indices is not None:
+                    torch.set_rng_state(rng_state)
+                break
+            with self.trace("step"):
+                self.step(scaler, optimizer, lr_schedule)
 
         last_loss = total_loss
-        best_iter = self.iters
+        used_iters = i + 1
+        best_iter = iters
+        if compile_key is not None:
+            synchronize(device)
+            tuning_end_time = time.time()
+            if first_iter_end_time is None:
+                first_iter_end_time = tuning_end_time
+            self.compile_cache.record(compile_key, first_iter_end_time - tuning_start_time,
+                                      tuning_end_time - first_iter_end_time, used_iters - 1)
         if not self.not_use_best_mse:
             last_loss = best_loss
-            best_iter = last_best_iter
+            best_iter = last_best_iter.item()
         dump_info = (
             f"quantized {len(quantized_layer_names)}/{(len(quantized_layer_names) + len(unquantized_layer_names))} "
-            f"layers in the block, loss iter 0: {init_loss:.6f} -> iter {best_iter}: {last_loss:.6f}"
+            f"layers in the block, loss iter 0: {init_loss.item():.6f} -> iter {best_iter}: {last_loss.item():.6f}, "
+            f"tuned {used_iters}/{iters} iters"
         )
         logger.info(dump_info)
         if len(unquantized_layer_names) != 0:
             logger.info(f"{unquantized_layer_names} have not been quantized")
-        with torch.no_grad():
+        with torch.no_grad(), self.trace("unwrap"):
             unwrapper_block(block, best_params)
         if self.enable_quanted_input:
             if self.low_cpu_mem_usage:
@@ -1294,6 +1671,373 @@ class AutoRound(object):
             clear_memory(input_ids)
             return None, output
 
+    @torch.no_grad()
+    def get_independent_layer_groups(self, block, input_ids, input_others, device):
+        """Groups the quantized linears of a block into sets of layers which could be tuned independently.
+
+        The layers are traced with a forward of one mini-batch. Layers consuming the same input tensor, e.g. q/k/v or
+        gate/up, and layers of the same role in a list of modules, e.g. the experts of a MoE block, are grouped
+        together, and the groups are returned in the order of execution.
+
+        Args:
+        block: The block of the model.
+        input_ids: The inputs of the block.
+        input_others: A dictionary containing additional input data.
+        device: The device for computation.
+
+        Returns:
+        list: The groups of layer names relative to the block.
+        """
+        layer_names = [n for n, m in block.named_modules()
+                       if isinstance(m, tuple(self.supported_types)) and check_to_quantized(m)]
+        call_order, last_input = [], [None, None]
+        parents = {n: n for n in layer_names}
+
+        def find(n):
+            while parents[n] != n:
+                n = parents[n]
+            return n
+
+        def get_trace_hook(name):
+            def trace_hook(module, inputs, outputs):
+                if name not in call_order:
+                    call_order.append(name)
+                if last_input[0] is inputs[0]:
+                    parents[find(name)] = find(last_input[1])
+                last_input[0], last_input[1] = inputs[0], name
+
+            return trace_hook
+
+        hook_handles = [get_module(block, n).register_forward_hook(get_trace_hook(n)) for n in layer_names]
+        self.get_block_outputs(block, input_ids[:self.batch_size], input_others, self.batch_size, device,
+                               self.cache_device, save_output=False)
+        for handle in hook_handles:
+            handle.remove()
+        last_input[0] = None
+        roles = {}
+        for n in layer_names:
+            role = re.sub(r"\.\d+\.", ".*.", n)
+            if role in roles:
+                parents[find(n)] = find(roles[role])
+            roles.setdefault(role, n)
+
+        groups = {}
+        for n in call_order + [n for n in layer_names if n not in call_order]:
+            groups.setdefault(find(n), []).append(n)
+        return list(groups.values())
+
+    @torch.no_grad()
+    def get_layer_inputs(self, block, layer_names, input_ids, input_others, device):
+        """Caches the inputs of the given layers of a block, a layer input of several samples is split by sample.
+
+        Layers consuming the same input tensor share the cached samples.
+        """
+        layer_inputs = {n: [] for n in layer_names}
+        last_input = [None, None]
+
+        def get_cache_hook(name):
+            def cache_hook(module, inputs, outputs):
+                if last_input[0] is not inputs[0]:
+                    input = inputs[0].detach().to(self.cache_device)
+                    samples = list(torch.split(input, 1, dim=0)) if input.dim() > 2 else [input]
+                    last_input[0], last_input[1] = inputs[0], [x for x in samples if x.numel() > 0]
+                layer_inputs[name].extend(last_input[1])
+
+            return cache_hook
+
+        hook_handles = [get_module(block, n).register_forward_hook(get_cache_hook(n)) for n in layer_names]
+        hook_handles.extend(self.register_act_max_hook(block))
+        self.get_block_outputs(block, input_ids, input_others, self.batch_size * self.infer_bs_coeff, device,
+                               self.cache_device, save_output=False)
+        for handle in hook_handles:
+            handle.remove()
+        return layer_inputs
+
+    def quant_block_layer_parallel(self, block_name, block, input_ids, input_others, q_input=None,
+                                   device=torch.device("cpu"), output=None):
+        """Quantize the weights of a given block layer by layer, tuning the independent layers concurrently.
+
+        Each linear is tuned like quant_layer against its own outputs, on the inputs produced by the block whose
+        earlier layers have already been quantized. The groups of independent layers are tuned one after another,
+        and the layers of a group run in a thread pool, each on its own CUDA stream on GPUs.
+
+        Args:
+        block_name: The name of the block.
+        block: The block of the model to be quantized.
+        input_ids: The input tensor containing tokenized input ids.
+        input_others: A dictionary containing additional input data.
+        q_input: The quantized input tensor.
+        device: The device for quantization.
+        output: The precomputed unquantized outputs of the block, computed here if None.
+
+        Returns:
+        Tuple: (q_outputs, output) if self.enable_quanted_input is True, else (None, output)
+        """
+        if output is None:
+            output = self.get_fp_block_outputs(block, input_ids, input_others, device)
+        if q_input is not None:
+            if input_ids is not q_input:
+                clear_memory(input_ids)
+            else:
+                clear_memory()
+            input_ids = q_input
+
+        ## the spans of the worker threads are counted in the block being tuned
+        block_stats = self.telemetry.current_block() if self.telemetry is not None else None
+
+        def quant_layer_on_stream(layer_name, layer_input, generator, convergence_policy):
+            with self.telemetry.attach(block_stats) if self.telemetry is not None else nullcontext():
+                if torch.device(device).type != "cuda":
+                    return self.quant_layer(layer_name, layer_input, device=device, generator=generator,
+                                            convergence_policy=convergence_policy)
+                stream = torch.cuda.Stream(device)
+                stream.wait_stream(torch.cuda.current_stream(device))
+                with torch.cuda.stream(stream):
+                    self.quant_layer(layer_name, layer_input, device=device, generator=generator,
+                                     convergence_policy=convergence_policy)
+                stream.synchronize()
+
+        for group in self.get_independent_layer_groups(block, input_ids, input_others, device):
+            layer_inputs = self.get_layer_inputs(block, group, input_ids, input_others, device)
+            with ThreadPoolExecutor(max_workers=len(group)) as executor:
+                futures, policies = [], []
+                for n in group:
+                    layer_name = f"{block_name}.{n}"
+                    if len(layer_inputs[n]) == 0:
+                        ## e.g. an expert which is not routed any calibration token
+                        unwrapper_layer(self.model, WrapperLinear(get_module(block, n), device=device), layer_name,
+                                        None)
+                        continue
+                    ## each layer samples with its own generator to keep the results independent of the scheduling
+                    generator = torch.Generator().manual_seed(int(torch.randint(2 ** 31, (1,))))
+                    policy = self.convergence_policy.fork() if self.convergence_policy is not None else None
+                    policies.append(policy)
+                    futures.append(executor.submit(quant_layer_on_stream, layer_name, layer_inputs[n], generator,
+                                                   policy))
+                for future in futures:
+                    future.result()
+            if self.convergence_policy is not None:
+                ## joined in the order of the layers, so the shared state does not depend on the scheduling
+                self.convergence_policy.join(policies)
+            del layer_inputs
+            block = block.to(device)
+            clear_memory()
+
+        q_outputs = None
+        if self.enable_quanted_input:
+            q_outputs = self.get_block_outputs(
+                block, input_ids, input_others, self.batch_size * self.infer_bs_coeff, device,
+                cache_device=self.cache_device
+            )
+        mv_module_from_gpu(block, self.low_cpu_mem_usage)
+        clear_memory(input_ids)
+        return q_outputs, output
+
+    @torch.no_grad()
+    def get_output_scale(self, outputs):
+        """Returns the mean square of the outputs, the scale of the loss of the block or layer tuned to them."""
+        total, numel = 0.0, 0
+        for output in outputs:
+            total += output.to(torch.float32).pow(2).sum().item()
+            numel += output.numel()
+        return total / max(numel, 1)
+
+    def get_fp_block_outputs(self, block, input_ids, input_others, device, record_act_max=False):
+        """Computes the unquantized outputs of a block, which are the tuning targets of the block.
+
+        Args:
+        block: The block of the model.
+        input_ids: The unquantized inputs of the block.
+        input_others: A dictionary containing additional input data.
+        device: The device for computation.
+        record_act_max (bool): Whether to record the activation max of the layers for static activation quantization.
+
+        Returns:
+        The outputs of the block.
+        """
+        hook_handles = self.register_act_max_hook(block) if record_act_max else []
+        output = self.get_block_outputs(block, input_ids, input_others, self.batch_size * self.infer_bs_coeff,
+                                        device, self.cache_device)
+        for handle in hook_handles:
+            handle.remove()
+        return output
+
+    @torch.no_grad()
+    def get_block_rtn_loss(self, block, input_ids, input_others, device):
+        """Computes the error of RTN (round-to-nearest) quantization of a block, used to probe its sensitivity.
+
+        Args:
+        block: The block of the model.
+        input_ids: The unquantized inputs of the block, which are all used as one batch.
+        input_others: A dictionary containing additional input data.
+        device: The device for computation.
+
+        Returns:
+        Tuple: (the MSE between the unquantized and RTN outputs relative to the mean square of the unquantized
+        outputs, the unquantized outputs as a list of samples)
+        """
+        indices = torch.arange(len(input_ids))
+        current_input_ids, current_input_others = sampling_inputs(
+            input_ids, input_others, indices, seqlen=self.seqlen, batch_dim=self.batch_dim)
+        output = block_forward(block, current_input_ids, copy.copy(current_input_others), self.amp, self.amp_dtype,
+                               device)
+        ## quantize the weights in place with the default parameters, and restore them after the forward
+        orig_weights = {}
+        for n, m in block.named_modules():
+            if not isinstance(m, tuple(self.supported_types)) or not check_to_quantized(m) \
+                    or m.weight.device.type == "meta":
+                continue
+            weight = m.weight.t() if isinstance(m, transformers.modeling_utils.Conv1D) else m.weight
+            quant_func, data_type = get_quant_func(m.data_type, m.bits, m.sym)
+            qdq_weight, _, _ = quant_func(weight.data, bits=m.bits, group_size=m.group_size,
+                                          scale_dtype=m.scale_dtype, data_type=data_type)
+            if isinstance(m, transformers.modeling_utils.Conv1D):
+                qdq_weight = qdq_weight.t()
+            orig_weights[n] = m.weight.data.clone()
+            m.weight.data.copy_(qdq_weight)
+        q_output = block_forward(block, current_input_ids, copy.copy(current_input_others), self.amp,
+                                 self.amp_dtype, device)
+        for n, m in block.named_modules():
+            if n in orig_weights:
+                m.weight.data.copy_(orig_weights[n])
+        fp_output, q_output = output.to(torch.float32), q_output.to(torch.float32)
+        loss = torch.mean((q_output - fp_output) ** 2) / torch.clamp(torch.mean(fp_output ** 2), min=1e-12)
+        return loss.item(), list(torch.split(output, 1, dim=self.batch_dim))
+
+    def allocate_block_iters(self, blocks, input_ids, input_others, device):
+        """Redistributes the iterations of all blocks by their sensitivity to quantization.
+
+        The sensitivity of each block is probed with the RTN error on a mini-batch of the unquantized inputs, and
+        each block keeps half of its iterations while the other half of the total budget is shared in proportion
+        to the sensitivity, so harder blocks are tuned longer at the same total cost.
+
+        Args:
+        blocks: A list of (block_name, block) to be quantized.
+        input_ids: The inputs of the first block.
+        input_others: A dictionary containing additional input data.
+        device: The device for computation.
+
+        Returns:
+        dict: The number of iterations of each block name.
+        """
+        probe_input = input_ids[:min(len(input_ids), self.batch_size * self.gradient_accumulate_steps)]
+        losses = []
+        for n, m in blocks:
+            if not self.model.device.type == "meta" or self.low_cpu_mem_usage:
+                m = m.to(device)
+            loss, probe_input = self.get_block_rtn_loss(m, probe_input, input_others, device)
+            losses.append(loss)
+            mv_module_from_gpu(m, self.low_cpu_mem_usage)
+        clear_memory()
+        total_iters = self.iters * len(blocks)
+        total_loss = sum(losses)
+        block_iters = {}
+        for (n, _), loss in zip(blocks, losses):
+            ratio = loss / total_loss if total_loss > 0 else 1.0 / len(blocks)
+            block_iters[n] = max(1, int(round(total_iters * (0.5 / len(blocks) + 0.5 * ratio))))
+        logger.info(f"iterations of the blocks: {list(block_iters.values())}")
+        return block_iters
+
+    def _get_local_indices(self, indices):
+        """Returns the shard of the sample indices processed by this process in data-parallel tuning."""
+        if self.data_parallel_info is None:
+            return indices
+        return shard_indices(indices, *self.data_parallel_info)
+
+    def _get_pipeline_fp_outputs(self, block_name, block, input_ids, input_others):
+        """Computes the unquantized outputs of an upcoming block on the pipeline device.
+
+        The block is moved back to its original device afterward, so it can be tuned as usual. The worker thread is
+        not attached to the block being tuned, its spans are recorded as phases tagged with block_name.
+        """
+        with self.trace("pipeline_outputs", pipeline_block=block_name):
+            orig_device = next(block.parameters()).device
+            block = block.to(self.pipeline_device)
+            output = self.get_fp_block_outputs(block, input_ids, input_others, self.pipeline_device,
+                                               record_act_max=not self.enable_quanted_input)
+            block.to(orig_device)
+        return output
+
+    def get_tuning_config(self):
+        """Returns the settings which the tuned blocks depend on, the checkpoint is only resumed with the same ones."""
+        return {
+            "bits": self.bits,
+            "group_size": self.group_size,
+            "sym": self.sym,
+            "data_type": self.data_type,
+            "act_bits": self.act_bits,
+            "iters": self.iters,
+            "lr": self.lr,
+            "minmax_lr": self.minmax_lr,
+            "seed": self.seed,
+            "nsamples": self.nsamples,
+            "seqlen": self.seqlen,
+            "batch_size": self.batch_size,
+            "gradient_accumulate_steps": self.gradient_accumulate_steps,
+            "infer_bs_coeff": self.infer_bs_coeff,
+            ## a dataloader could not be hashed, only its type is
+            "dataset": self.dataset if isinstance(self.dataset, str) else type(self.dataset).__name__,
+            "layer_config": self.layer_config,
+        }
+
+    def resume_blocks(self, model, block_names, input_ids, q_input):
+        """Restores the blocks finished in the checkpoint and the cached inputs of the next block.
+
+        Args:
+        model: The PyTorch model to be quantized.
+        block_names: The names of the blocks to be quantized.
+        input_ids: The cached inputs of the first block, returned if nothing could be resumed.
+        q_input: The quantized inputs of the first block.
+
+        Returns:
+        Tuple: (finished block names, input_ids, q_input)
+        """
+        state = self.checkpoint.load_state(block_names[0])
+        if state is None or len(state["finished"]) == 0:
+            return [], input_ids, q_input
+        finished = state["finished"]
+        if state.get("config_hash") != self.checkpoint.config_hash:
+            logger.warning(f"the checkpoint in {self.checkpoint.checkpoint_dir} was saved with other tuning "
+                           f"settings, start from scratch")
+            return [], input_ids, q_input
+        if finished != block_names[:len(finished)] or (
+                len(finished) % self.nblocks != 0 and len(finished) != len(block_names)):
+            logger.warning(f"the checkpoint in {self.checkpoint.checkpoint_dir} does not match the blocks to be "
+                           f"quantized, start from scratch")
+            return [], input_ids, q_input
+        for n in finished:
+            self.checkpoint.load_block(n, get_module(model, n), self.layer_config)
+        if len(finished) < len(block_names):
+            nsamples = len(input_ids)
+            clear_memory(input_ids)
+            input_ids = self.checkpoint.load_samples(
+                state["input_ids"], self.new_cache_list("input_ids", dim=self.batch_dim, capacity=nsamples))
+            if state["q_input"] is not None:
+                q_input = self.checkpoint.load_samples(
+                    state["q_input"], self.new_cache_list("q_input", dim=self.batch_dim, capacity=nsamples))
+            input_ids = to_device(input_ids, self.cache_device)
+            q_input = to_device(q_input, self.cache_device)
+        self.block_iters = state["extra"].get("block_iters", self.block_iters)
+        if "convergence_policy" in state["extra"]:
+            self.convergence_policy = state["extra"]["convergence_policy"]
+        set_rng_state(state["rng"])
+        logger.info(f"resume from the checkpoint in {self.checkpoint.checkpoint_dir}, "
+                    f"{len(finished)}/{len(block_names)} blocks have been quantized")
+        return finished, input_ids, q_input
+
+    def save_blocks_checkpoint(self, model, block_names, finished, input_ids, q_input):
+        """Saves the newly finished blocks and the cached inputs of the next block to the checkpoint."""
+        if self.data_parallel_info is not None and self.data_parallel_info[0] != 0:
+            return  ## all processes hold the same model, so only the first one writes
+        for n in finished:
+            if n not in self._checkpointed_blocks:
+                self.checkpoint.save_block(n, get_module(model, n), self.layer_config)
+                self._checkpointed_blocks.add(n)
+        if len(finished) == len(block_names):
+            input_ids, q_input = None, None  ## no block left to feed
+        extra = {"block_iters": self.block_iters, "convergence_policy": self.convergence_policy}
+        self.checkpoint.save_state(block_names[0], finished, input_ids, q_input, extra=extra)
+
     def quant_blocks(
             self,
             model: torch.nn.Module,
@@ -1327,8 +2071,7 @@ class AutoRound(object):
         input_others = to_device(input_others, self.cache_device)
         ## as in calibration phase, we may use bf16 for calibration due to low_gpu_memory usage
         tmp_dtype = self.amp_dtype if self.amp else torch.float32
-        for i in range(len(input_ids)):
-            input_ids[i] = input_ids[i].to(tmp_dtype)
+        input_ids = to_dtype(input_ids, tmp_dtype)
 
         for key in input_others.keys():
             if isinstance(input_others[key], torch.Tensor) and (
@@ -1338,38 +2081,79 @@ class AutoRound(object):
             elif isinstance(input_others[key], list):
                 for i in range(len(input_others[key])):
                     to_dtype(input_others[key][i], tmp_dtype)
-        if self.enable_torch_compile:
-            quant_block = compile_func(self.quant_block, device)
+        if self.enable_layer_parallel:
+            quant_block = self.quant_block_layer_parallel
         else:
             quant_block = self.quant_block
 
         if pbar is None:
             pbar = tqdm(range(0, len(block_names), nblocks))
 
-        for i in range(0, len(block_names), nblocks):
+        def get_blocks(start):
             if nblocks == 1:
-                n = block_names[i]
-                pbar.set_description(f"Quantizing {n}")
-                m = get_module(model, n)
-            else:
-                n = f"[{i + 1}-{min(i + nblocks, len(block_names))}]"
-                names = block_names[i: min(i + nblocks, len(block_names))]
-                pbar.set_description(f"Quantizing {n}/{len(block_names)}")
-                modules = [get_module(model, n) for n in names]
-                m = WrapperMultiblock(modules)
-
-            if not self.model.device.type == "meta" or self.low_cpu_mem_usage:
-                m = m.to(device)
-
-            q_input, input_ids = quant_block(
-                n,
-                m,
-                input_ids,
-                input_others,
-                q_input=q_input,
-                device=device,
-            )
-            pbar.update(1)
+                n = block_names[start]
+                return n, get_module(model, n)
+            n = f"[{start + 1}-{min(start + nblocks, len(block_names))}]"
+            names = block_names[start: min(start + nblocks, len(block_names))]
+            modules = [get_module(model, n) for n in names]
+            return n, WrapperMultiblock(modules)
+
+        finished = []
+        if self.checkpoint is not None:
+            finished, input_ids, q_input = self.resume_blocks(model, block_names, input_ids, q_input)
+            self._checkpointed_blocks = set(finished)
+            pbar.update(len(range(0, len(finished), nblocks)))
+
+        if self.adaptive_iters and len(finished) == 0:
+            blocks = [get_blocks(i) for i in range(0, len(block_names), nblocks)]
+            self.block_iters = self.allocate_block_iters(blocks, input_ids, input_others, device)
+
+        ## the unquantized outputs of the next block only depend on the unquantized outputs of the current block,
+        ## so they could be computed on the pipeline device while the current block is being tuned
+        executor = ThreadPoolExecutor(max_workers=1) if self.pipeline_device is not None else None
+        output, next_output = None, None
+        try:
+            for i in range(len(finished), len(block_names), nblocks):
+                n, m = get_blocks(i)
+                if nblocks == 1:
+                    pbar.set_description(f"Quantizing {n}")
+                else:
+                    pbar.set_description(f"Quantizing {n}/{len(block_names)}")
+
+                if next_output is not None:
+                    output = next_output.result()
+                    next_output = None
+
+                if not self.model.device.type == "meta" or self.low_cpu_mem_usage:
+                    m = m.to(device)
+
+                if executor is not None and i + nblocks < len(block_names):
+                    if output is None:
+                        output = self.get_fp_block_outputs(m, input_ids, input_others, device,
+                                                           record_act_max=q_input is None)
+                    next_n, next_m = get_blocks(i + nblocks)
+                    next_output = executor.submit(self._get_pipeline_fp_outputs, next_n, next_m, output,
+                                                  input_others)
+
+                with self.trace_block(n):
+                    q_input, input_ids = quant_block(
+                        n,
+                        m,
+                        input_ids,
+                        input_others,
+                        q_input=q_input,
+                        device=device,
+                        output=output,
+                    )
+                output = None
+                if self.checkpoint is not None:
+                    finished.extend(block_names[i: i + nblocks])
+                    self.save_blocks_checkpoint(model, block_names, finished, input_ids, q_input)
+                pbar.update(1)
+        finally:
+            ## also when the tuning raises, e.g. on interruption, so the worker and its pending outputs are released
+            if executor is not None:
+                executor.shutdown()
 
         self.model = mv_module_from_gpu(self.model, self.low_cpu_mem_usage)
 
@@ -1465,29 +2249,32 @@ class AutoRound(object):
         if "scale_dtype" in serialization_dict.keys():
             serialization_dict["scale_dtype"] = str(serialization_dict["scale_dtype"])
 
-        compressed_model = save_quantized_as_format(  ##TODO refine the code
-            output_dir,
-            model=self.model,
-            layer_config=self.layer_config,
-            inplace=inplace,
-            bits=self.bits,
-            group_size=self.group_size,
-            sym=self.sym,
-            iters=self.iters,
-            lr=self.lr,
-            minmax_lr=self.minmax_lr,
-            enable_minmax_tuning=self.enable_minmax_tuning,
-            enable_quanted_input=self.enable_quanted_input,
-            scale_dtype=self.scale_dtype,
-            tokenizer=self.tokenizer,
-            supported_types=self.supported_types,
-            data_type=self.data_type,
-            serialization_dict=serialization_dict,
-            backend=backend,
-            to_quant_block_names=self.to_quant_block_names,
-            quant_block_list=self.quant_block_list,
-            **kwargs
-        )
+        with self.trace("packing", format=backend):
+            compressed_model = save_quantized_as_format(  ##TODO refine the code
+                output_dir,
+                model=self.model,
+                layer_config=self.layer_config,
+                inplace=inplace,
+                bits=self.bits,
+                group_size=self.group_size,
+                sym=self.sym,
+                iters=self.iters,
+                lr=self.lr,
+                minmax_lr=self.minmax_lr,
+                enable_minmax_tuning=self.enable_minmax_tuning,
+                enable_quanted_input=self.enable_quanted_input,
+                scale_dtype=self.scale_dtype,
+                tokenizer=self.tokenizer,
+                supported_types=self.supported_types,
+                data_type=self.data_type,
+                serialization_dict=serialization_dict,
+                backend=backend,
+                to_quant_block_names=self.to_quant_block_names,
+                quant_block_list=self.quant_block_list,
+                **kwargs
+            )
+        if self.telemetry is not None:
+            self.telemetry.dump_trace()
         return compressed_model
 
     def get_quantized_layer_names_outside_blocks(self):
@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import hashlib
+import itertools
 import json
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import torch
 from datasets import IterableDataset
 from torch.utils.data import DataLoader
@@ -110,7 +116,8 @@ def get_pile_dataset(tokenizer, seqlen, dataset_name="NeelNanda/pile-10k", split
                      " and set '--dataset swift/pile-val-backup' in AutoRound API.")
         sys.exit(1)
     calib_dataset = calib_dataset.shuffle(seed=seed)
-    calib_dataset = calib_dataset.map(tokenizer_function, batched=True)
+    ## tokenized lazily, only the samples consumed by the calibration
+    calib_dataset = calib_dataset.to_iterable_dataset().map(tokenizer_function, batched=True)
 
     return calib_dataset
 
@@ -278,7 +285,7 @@ def get_new_chinese_title_dataset(
 
     calib_dataset = load_dataset(dataset_name, split=split)
     calib_dataset = calib_dataset.shuffle(seed=seed)
-    calib_dataset = calib_dataset.map(tokenizer_function, batched=True)
+    calib_dataset = calib_dataset.to_iterable_dataset().map(tokenizer_function, batched=True)
 
     return calib_dataset
 
@@ -317,7 +324,7 @@ def get_mbpp_dataset(tokenizer, seqlen, dataset_name="mbpp", split=None, seed=42
     import datasets
 
     calib_dataset = datasets.Dataset.from_list(samples)
-    calib_dataset = calib_dataset.map(tokenizer_function, batched=True)
+    calib_dataset = calib_dataset.to_iterable_dataset().map(tokenizer_function, batched=True)
 
     return calib_dataset
 
@@ -325,12 +332,13 @@ def get_mbpp_dataset(tokenizer, seqlen, dataset_name="mbpp", split=None, seed=42
 @register_dataset("local")
 def get_local_dataset(tokenizer, seqlen, dataset_name="./tmp.json", split=None, seed=42, apply_chat_template=False):
     """Returns a dataloader for a custom dataset and split.
-    We allow the input of a json or text file containing a processed text sample each line.
+    We allow the input of a json file, or a jsonl or text file containing a processed text sample each line. The
+    samples are read and tokenized lazily, so large files are not loaded to memory.
 
     Args:
     tokenizer: The tokenizer to be used for tokenization.
     seqlen: The maximum sequence length.
-    data_name: The name or path of the dataset, which is a json or jsonl file.
+    data_name: The name or path of the dataset, which is a json, jsonl or txt file.
     split: The data split to be used (e.g., "train", "test").
     seed: The random seed for shuffling the dataset.
     apply_chat_template: Whether to apply chat template in tokenization.
@@ -340,29 +348,7 @@ def get_local_dataset(tokenizer, seqlen, dataset_name="./tmp.json", split=None,
     """
     tokenizer_function = get_tokenizer_function(tokenizer, seqlen, apply_chat_template=apply_chat_template)
 
-    def load_local_data(data_path):
-        if data_path.endswith(".json"):
-            with open(data_path, "r") as f:
-                data = json.load(f)
-            return data
-        elif data_path.endswith(".jsonl"):
-            data = []
-            with open(data_path) as f:
-                for line in f:
-                    sample = json.loads(line)
-                    data.append(sample)
-            return data
-        else:
-            logger.error("invalid local file type, for now only support json/jsonl format data file.")
-
-    samples = []
-    dataset = load_local_data(dataset_name)
-    if isinstance(dataset, dict):
-        new_dataset = []
-        for key in dataset.keys():
-            new_dataset.append(dataset[key])
-        dataset = new_dataset
-    for data in dataset:
+    def get_text(data):
         text = data
         if isinstance(text, str):
             pass
@@ -376,11 +362,41 @@ def get_local_dataset(tokenizer, seqlen, dataset_name="./tmp.json", split=None,
         assert isinstance(text, str), "data must be string"
         text = text.rstrip()
         text = text.rstrip("\n")
-        samples.append({"text": text})
-    random.Random(seed).shuffle(samples)
-    import datasets
+        return text
+
+    def generate_json_samples(data_path):
+        with open(data_path, "r") as f:
+            dataset = json.load(f)
+        if isinstance(dataset, dict):
+            dataset = list(dataset.values())
+        indices = list(range(len(dataset)))
+        random.Random(seed).shuffle(indices)
+        for index in indices:
+            yield {"text": get_text(dataset[index])}
+
+    def generate_line_samples(data_path):
+        ## only the offsets of the lines are kept in memory, the lines are read in the shuffled order
+        offsets, offset = [], 0
+        with open(data_path, "rb") as f:
+            for line in f:
+                offsets.append(offset)
+                offset += len(line)
+        random.Random(seed).shuffle(offsets)
+        with open(data_path, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                line = f.readline().decode("utf-8")
+                yield {"text": get_text(json.loads(line) if data_path.endswith(".jsonl") else line)}
+
+    if dataset_name.endswith(".json"):
+        generator = generate_json_samples
+    elif dataset_name.endswith(".jsonl") or dataset_name.endswith(".txt"):
+        generator = generate_line_samples
+    else:
+        logger.error("invalid local file type, for now only support json/jsonl/txt format data file.")
+        sys.exit(1)
 
-    calib_dataset = datasets.Dataset.from_list(samples)
+    calib_dataset = IterableDataset.from_generator(generator, gen_kwargs={"data_path": dataset_name})
     calib_dataset = calib_dataset.map(tokenizer_function, batched=True)
     return calib_dataset
 
@@ -407,6 +423,42 @@ def get_dataset_len(dataset):
         return cnt
 
 
+class StreamingDataset(torch.utils.data.IterableDataset):
+    """An iterable dataset of the samples generated by a function, which is called again for each iteration.
+
+    Args:
+        generate: The function returning an iterator of the samples.
+        *args: The arguments of the function.
+    """
+
+    def __init__(self, generate, *args):
+        self.generate = generate
+        self.args = args
+
+    def __iter__(self):
+        return iter(self.generate(*self.args))
+
+
+def interleave_samples(datasets):
+    """Merges the samples of datasets, spreading the samples of each dataset evenly, so that the first samples have
+    the same mix of the datasets as all of them.
+
+    Args:
+        datasets: The lists of the samples of the datasets.
+
+    Returns:
+        list: The merged samples.
+    """
+    total = sum([len(dataset) for dataset in datasets])
+    taken, samples = [0] * len(datasets), []
+    for step in range(1, total + 1):
+        ## the dataset furthest behind its share of the first step samples
+        index = max(range(len(datasets)), key=lambda i: len(datasets[i]) * step / total - taken[i])
+        samples.append(datasets[index][taken[index]])
+        taken[index] += 1
+    return samples
+
+
 def select(dataset, indices):
     """Selects specific elements from a dataset based on given indices.
 
@@ -446,6 +498,111 @@ def select_dataset(dataset, indices):
         return select(dataset, indices)
 
 
+def get_calib_cache_key(tokenizer, dataset_name, seed, seqlen, nsamples, bs):
+    """Returns the key of the tokenized calibration samples in the cache.
+
+    The key hashes the tokenizer, its vocab, normalizer and chat template, the dataset spec including the options
+    such as `:num=`, `:concat=` and `:apply_chat_template`, the size and modification time of local files, and the
+    seed, seqlen, nsamples and batch size.
+    """
+    h = hashlib.sha256()
+    if hasattr(tokenizer, "backend_tokenizer"):  ## the serialized fast tokenizer includes its vocab and normalizer
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        ## truncation and padding are set by the calls of the tokenizer
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        h.update(json.dumps(state, sort_keys=True, ensure_ascii=False).encode())
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode())
+    chat_template = getattr(tokenizer, "chat_template", None)
+    for value in [type(tokenizer).__name__, chat_template, tokenizer.bos_token_id, tokenizer.eos_token_id,
+                  dataset_name, seed, seqlen, nsamples, bs]:
+        h.update(repr(value).encode() + b"\0")
+    for name in dataset_name.split(","):
+        path = name.split(":")[0]
+        if is_local_path(path) and os.path.exists(path):
+            stat = os.stat(path)
+            h.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:32]
+
+
+class CachedCalibDataLoader:
+    """Yields the batches of tokenized calibration samples stored in the cache.
+
+    The samples are stored as flat arrays of shape [n, seqlen] which are memory-mapped, and the sizes of the batches
+    yielded by the dataloader they were collected from, so the batches are the same.
+
+    Args:
+        input_ids (np.ndarray): The token ids of the samples.
+        attention_mask (np.ndarray): The attention masks of the samples.
+        batch_sizes (np.ndarray): The number of samples of each batch.
+    """
+
+    def __init__(self, input_ids, attention_mask, batch_sizes):
+        self.input_ids = input_ids
+        self.attention_mask = attention_mask
+        self.batch_sizes = batch_sizes
+        self.batch_size = int(batch_sizes.max()) if len(batch_sizes) > 0 else 1
+
+    def __len__(self):
+        return len(self.batch_sizes)
+
+    def __iter__(self):
+        start = 0
+        for batch_size in self.batch_sizes.tolist():
+            end = start + batch_size
+            yield {
+                "input_ids": torch.from_numpy(self.input_ids[start:end].astype(np.int64)),
+                "attention_mask": torch.from_numpy(self.attention_mask[start:end].astype(np.int64)),
+            }
+            start = end
+
+
+CALIB_CACHE_FILES = ["input_ids.npy", "attention_mask.npy", "batch_sizes.npy"]
+
+
+def load_calib_cache(cache_dir, key):
+    """Returns the CachedCalibDataLoader of the key, or None if it is not in the cache."""
+    path = os.path.join(cache_dir, key)
+    if not all(os.path.exists(os.path.join(path, file)) for file in CALIB_CACHE_FILES):
+        return None
+    arrays = [np.load(os.path.join(path, file), mmap_mode="r") for file in CALIB_CACHE_FILES]
+    logger.info(f"load the tokenized calibration dataset from {path}")
+    return CachedCalibDataLoader(*arrays)
+
+
+def save_calib_cache(cache_dir, key, dataloader, nsamples):
+    """Collects the batches of the dataloader consumed by the calibration of nsamples samples, saves them to the
+    cache and returns their CachedCalibDataLoader."""
+    input_ids, attention_mask, batch_sizes, cnt = [], [], [], 0
+    for batch in dataloader:
+        if batch is None:
+            continue
+        input_ids.append(batch["input_ids"])
+        attention_mask.append(batch["attention_mask"])
+        batch_sizes.append(batch["input_ids"].shape[0])
+        cnt += batch_sizes[-1]
+        if cnt >= nsamples:
+            break
+    if cnt == 0:
+        return dataloader
+    ## token ids fit in int32, and attention masks in int8
+    arrays = [torch.cat(input_ids).numpy().astype(np.int32), torch.cat(attention_mask).numpy().astype(np.int8),
+              np.array(batch_sizes, dtype=np.int64)]
+    path = os.path.join(cache_dir, key)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for file, array in zip(CALIB_CACHE_FILES, arrays):
+        np.save(os.path.join(tmp_path, file), array)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:  ## saved by another process in the meantime
+        import shutil
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    logger.info(f"saved the tokenized calibration dataset to {path}")
+    return CachedCalibDataLoader(*arrays)
+
+
 def get_dataloader(
         tokenizer,
         seqlen,
@@ -453,7 +610,8 @@ def get_dataloader(
         seed=42,
         bs=8,
         nsamples=512,
-        process_batch=1000
+        process_batch=1000,
+        cache_dir=None,
 ):
     """Generate a DataLoader for calibration using specified parameters.
 
@@ -468,68 +626,107 @@ def get_dataloader(
         bs (int, optional): The batch size. Defaults to 4.
         nsamples (int, optional): The total number of samples to include. Defaults to 512.
         apply_chat_template: Whether to apply chat template in tokenization.
+        cache_dir (str, optional): The directory to cache the tokenized samples in, the samples are loaded from it
+                                   if the same tokenizer, dataset and settings were used before. Defaults to None.
 
     Returns:
         DataLoader: The DataLoader for the calibrated dataset.
     """
+    if cache_dir is not None:
+        key = get_calib_cache_key(tokenizer, dataset_name, seed, seqlen, nsamples, bs)
+        dataloader = load_calib_cache(cache_dir, key)
+        if dataloader is not None:
+            return dataloader
 
     dataset_names = dataset_name.split(",")
 
-    def filter_func(example):
-        if isinstance(example["input_ids"], list):
-            example["input_ids"] = torch.tensor(example["input_ids"])
-        if example["input_ids"].shape[-1] < seqlen:
-            return False
-        input_ids = example["input_ids"][:seqlen]
-        input_ids_list = input_ids.tolist()
-        if len(input_ids_list) > 1 and seqlen > 2 and input_ids_list.count(input_ids_list[-1]) > seqlen // 2:
-            return False
-        return True
-
-    def concat_dataset_element(dataset):
-        input_ids, concat_input_ids = [eg['input_ids'] for eg in dataset], []
-        attention_mask_list, attention_mask = [], torch.ones([1, seqlen]).to(torch.int64)
-        buffer_input_id = torch.Tensor().to(torch.int64)
+    def filter_samples(samples):
+        """Drops the samples shorter than seqlen, and the degenerate ones whose first seqlen tokens are more than
+        half the last of them, checked on process_batch samples at a time with tensor ops."""
+        samples = iter(samples)
+        while True:
+            batch = list(itertools.islice(samples, process_batch))
+            if len(batch) == 0:
+                break
+            for sample in batch:
+                if isinstance(sample["input_ids"], list):
+                    sample["input_ids"] = torch.tensor(sample["input_ids"])
+            batch = [sample for sample in batch if sample["input_ids"].shape[-1] >= seqlen]
+            if len(batch) > 0 and seqlen > 2:
+                input_ids = torch.stack([sample["input_ids"][:seqlen] for sample in batch])
+                repeats = (input_ids == input_ids[:, -1:]).sum(dim=-1)
+                batch = [sample for sample, keep in zip(batch, (repeats <= seqlen // 2).tolist()) if keep]
+            yield from batch
+
+    def concat_dataset_element(samples):
+        """Packs the token streams of the samples into samples of seqlen tokens.
+
+        The streams of process_batch samples at a time are concatenated without the BOS/EOS tokens of each sample,
+        cut into rows of seqlen tokens less the special tokens, and the BOS/EOS tokens are reinserted at the start/end
+        of each row. The tokens which don't fill a row are carried over to the next samples.
+        """
         bos_token_id, eos_token_id = tokenizer.bos_token_id, tokenizer.eos_token_id
-        os_cnt, have_bos, have_eos = 0, False, False
-
-        for input_id in input_ids:
-            if input_id[0] == bos_token_id:
-                input_id = input_id[1:]
-                os_cnt, have_bos = os_cnt + 1, True
-            if input_id[-1] == eos_token_id:
-                input_id = input_id[:-1]
-                os_cnt, have_eos = os_cnt + 1, True
-
-            if buffer_input_id.shape[-1] + input_id.shape[-1] + os_cnt > seqlen:
-                idx_keep = seqlen - buffer_input_id.shape[-1] - os_cnt
-                input_id_to_append = [buffer_input_id, input_id[:idx_keep]]
-                if have_bos:
-                    input_id_to_append = [torch.tensor([bos_token_id])] + input_id_to_append
-                if have_eos:
-                    input_id_to_append.append(torch.tensor([eos_token_id]))
-
-                concat_input_ids.append(torch.cat(input_id_to_append).to(torch.int64))
-                attention_mask_list.append(attention_mask)
-                buffer_input_id = input_id[idx_keep:]
-            else:
-                buffer_input_id = torch.cat([buffer_input_id, input_id])
-
-            if buffer_input_id.shape[-1] + os_cnt == seqlen:
-                input_id_to_append = [buffer_input_id]
-                if have_bos:
-                    input_id_to_append = [torch.tensor([bos_token_id])] + input_id_to_append
-                if have_eos:
-                    input_id_to_append.append(torch.tensor([eos_token_id]))
-                concat_input_ids.append(torch.cat(input_id_to_append).to(torch.int64))
-                attention_mask_list.append(attention_mask)
-                buffer_input_id = torch.Tensor().to(torch.int64)
-        data = [{'input_ids': a, 'attention_mask': b} for a, b in zip(concat_input_ids, attention_mask_list)]
-        import datasets
-        dataset_new = datasets.Dataset.from_list(data)
-        return dataset_new
-
-    datasets, data_lens = [], {}
+        have_bos, have_eos, rest = None, None, torch.tensor([], dtype=torch.int64)
+        samples = iter(samples)
+        while True:
+            input_ids = [eg["input_ids"] for eg in itertools.islice(samples, process_batch)]
+            if len(input_ids) == 0:
+                break
+            input_ids = [x if isinstance(x, torch.Tensor) else torch.tensor(x, dtype=torch.int64) for x in input_ids]
+            input_ids = [x.reshape(-1) for x in input_ids if x.numel() > 0]
+            if len(input_ids) == 0:
+                continue
+            stream = torch.cat(input_ids).to(torch.int64)
+            lengths = torch.tensor([x.shape[-1] for x in input_ids], dtype=torch.int64)
+            ends = lengths.cumsum(0)
+            starts = ends - lengths
+            keep = torch.ones_like(stream, dtype=torch.bool)
+            is_bos, is_eos = torch.zeros_like(starts, dtype=torch.bool), torch.zeros_like(ends, dtype=torch.bool)
+            if bos_token_id is not None:
+                is_bos = stream[starts] == bos_token_id
+                keep[starts[is_bos]] = False
+            if eos_token_id is not None:
+                is_eos = (stream[ends - 1] == eos_token_id) & (ends - 1 > starts)  ## don't strip a lone BOS twice
+                keep[ends[is_eos] - 1] = False
+            if have_bos is None:
+                have_bos, have_eos = bool(is_bos.any()), bool(is_eos.any())
+            stream = torch.cat([rest, stream[keep]])
+
+            body_len = seqlen - int(have_bos) - int(have_eos)
+            if body_len <= 0:
+                return
+            num = stream.shape[-1] // body_len
+            columns = [stream[:num * body_len].view(num, body_len)]
+            rest = stream[num * body_len:]
+            if have_bos:
+                columns.insert(0, torch.full((num, 1), bos_token_id, dtype=torch.int64))
+            if have_eos:
+                columns.append(torch.full((num, 1), eos_token_id, dtype=torch.int64))
+            for input_id in torch.cat(columns, dim=1):
+                yield {"input_ids": input_id, "attention_mask": torch.ones_like(input_id)}
+
+    def generate_samples(dataset, do_concat=False, num=None):
+        """Streams the samples of the tokenized dataset, packed if do_concat, which are kept by filter_samples, and
+        stops after num samples, so only the samples consumed are tokenized."""
+        samples = iter(dataset)
+        if do_concat:
+            samples = concat_dataset_element(samples)
+        return itertools.islice(filter_samples(samples), num)
+
+    def get_samples(get_dataset, tokenizer, name, split, apply_chat_template, do_concat, num):
+        dataset = get_dataset(
+            tokenizer,
+            seqlen,
+            seed=seed,
+            split=split,
+            dataset_name=name,
+            apply_chat_template=apply_chat_template,
+        )
+        if not isinstance(dataset, IterableDataset):
+            dataset.set_format(type="torch", columns=["input_ids", "attention_mask"])
+        return StreamingDataset(generate_samples, dataset, do_concat, num)
+
+    sources, data_lens = [], {}
     for name in dataset_names:
         split = None
         do_concat = False
@@ -558,65 +755,51 @@ def get_dataloader(
                         calib_name = key
                         break
             get_dataset = CALIB_DATASETS.get(calib_name)
-        dataset = get_dataset(
-            tokenizer,
-            seqlen,
-            seed=seed,
-            split=split,
-            dataset_name=name,
-            apply_chat_template=apply_chat_template,
-        )
-        if not isinstance(dataset, IterableDataset):
-            dataset.set_format(type="torch", columns=["input_ids", "attention_mask"])
-        if do_concat:
-            dataset = concat_dataset_element(dataset)
-        dataset = dataset.filter(filter_func, batch_size=process_batch)
-        if name in data_lens:
-            dataset = select_dataset(dataset, range(data_lens[name]))
-        datasets.append(dataset)
-    if len(datasets) == 1:
-        dataset_final = datasets[0]
+        sources.append((get_dataset, name, split, apply_chat_template, do_concat))
+
+    if len(sources) == 1:
+        get_dataset, name, split, apply_chat_template, do_concat = sources[0]
+        dataset_final = get_samples(get_dataset, tokenizer, name, split, apply_chat_template, do_concat,
+                                    data_lens.get(name, nsamples))
     else:
-        indices = range(len(datasets))
-        lens = []
-        for i in range(len(datasets)):
-            cnt = get_dataset_len(datasets[i])
-            lens.append(cnt)
-        res = sorted(zip(indices, lens), key=lambda x: x[1])
-
-        # res = sorted(zip(indices, datasets), key=lambda x: len(x[1]))
-        indices = [item[0] for item in res]
-        datasets = [datasets[item[0]] for item in res]
-        dataset_names = [dataset_names[index] for index in indices]
         cnt = 0 if not data_lens else sum(data_lens.values())
-        dataset_cnt_info = {}
         if cnt > nsamples:
             cnt = 0
 
-        for i in range(len(datasets)):
-            name = dataset_names[i].split(':')[0]
+        def load_samples(source):
+            ## each thread tokenizes with its own copy, the calls of a fast tokenizer set its truncation
+            get_dataset, name, split, apply_chat_template, do_concat = source
+            return list(get_samples(get_dataset, copy.deepcopy(tokenizer), name, split, apply_chat_template,
+                                    do_concat, data_lens.get(name, nsamples - cnt)))
+
+        ## the datasets are loaded and tokenized concurrently, at most the samples which may be selected from each
+        with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+            datasets = list(executor.map(load_samples, sources))
+        lens = [len(dataset) for dataset in datasets]
+        res = sorted(zip(range(len(datasets)), lens), key=lambda x: x[1])
+
+        indices = [item[0] for item in res]
+        target_cnts = [0] * len(datasets)
+        dataset_cnt_info = {}
+        for i, index in enumerate(indices):
+            name = sources[index][1]
             if name not in data_lens:
                 target_cnt = (nsamples - cnt) // (len(datasets) - len(data_lens)) if data_lens \
                     else (nsamples - cnt) // (len(datasets) - i)
-                target_cnt = min(target_cnt, lens[i])
+                target_cnt = min(target_cnt, lens[index])
                 cnt += target_cnt
             else:
-                target_cnt = data_lens[name]
-            datasets[i] = select_dataset(dataset, range(target_cnt))
+                target_cnt = min(data_lens[name], lens[index])
+            target_cnts[index] = target_cnt
             dataset_cnt_info[name] = target_cnt
-        if len(datasets) > 1:
-            from datasets import concatenate_datasets
-
-            dataset_final = concatenate_datasets(datasets)
-            dataset_final = dataset_final.shuffle(seed=seed)
-            logger.info(dataset_cnt_info)
-        else:
-            dataset_final = datasets[0]
+        datasets = [dataset[:target_cnt] for dataset, target_cnt in zip(datasets, target_cnts)]
+        dataset_final = interleave_samples(datasets)
+        logger.info(dataset_cnt_info)
 
-    # dataset_final = datasets[0]
 
     @torch.no_grad()
     def collate_batch(batch):
+        ## the samples were checked by filter_samples
         input_ids_new = []
         attention_mask_new = []
         for text in batch:
@@ -625,13 +808,8 @@ def get_dataloader(
                 input_ids = torch.tensor(input_ids)
             if isinstance(attention_mask, list):
                 attention_mask = torch.tensor(attention_mask)
-            input_ids = input_ids[:seqlen]
-            input_ids_list = input_ids.tolist()
-            if input_ids_list.count(input_ids_list[-1]) > seqlen // 2:
-                continue
-            attention_mask = attention_mask[:seqlen]
-            attention_mask_new.append(attention_mask)
-            input_ids_new.append(input_ids)
+            attention_mask_new.append(attention_mask[:seqlen])
+            input_ids_new.append(input_ids[:seqlen])
         if len(input_ids_new) == 0:
             return None
         input_ids_new = torch.vstack(input_ids_new)
@@ -640,5 +818,7 @@ def get_dataloader(
         return res
 
     calib_dataloader = DataLoader(dataset_final, batch_size=bs, shuffle=False, collate_fn=collate_batch)
+    if cache_dir is not None:
+        calib_dataloader = save_calib_cache(cache_dir, key, calib_dataloader, nsamples)
     return calib_dataloader
 
@@ -0,0 +1,171 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-block checkpoints which let an interrupted quantization resume from the last tuned block."""
+
+import hashlib
+import json
+import os
+import random
+import re
+
+import numpy as np
+import torch
+
+from .tensor_cache import ContiguousTensorList
+from .utils import logger
+
+QINFO_KEYS = ["scale", "zp", "q_scale_thresh"]
+
+
+def _file_name(name):
+    return re.sub(r"[^0-9A-Za-z_.-]", "_", name)
+
+
+def _save(obj, path):
+    """Saves obj to path atomically, so an interrupted write never leaves a partial checkpoint behind."""
+    tmp_path = path + ".tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _load(path):
+    """Loads a checkpoint file, memory-mapping its tensors if supported."""
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except (TypeError, RuntimeError):  ## mmap requires torch>=2.1 and the zipfile format
+        return torch.load(path, map_location="cpu")
+
+
+def _dump_samples(samples):
+    """Converts a cache list of samples to a picklable object without copying the contiguous store."""
+    if samples is None:
+        return None
+    if isinstance(samples, ContiguousTensorList) and samples.data is not None:
+        return {"data": samples.data.narrow(samples.dim, 0, len(samples)), "dim": samples.dim}
+    return [sample.contiguous() if isinstance(sample, torch.Tensor) else sample for sample in samples]
+
+
+def _load_samples(dumped, cache_list):
+    """Fills cache_list with the samples dumped by _dump_samples and returns it."""
+    if dumped is None:
+        return None
+    if isinstance(dumped, dict):
+        cache_list.extend(torch.split(dumped["data"], 1, dim=dumped["dim"]))
+    else:
+        cache_list.extend(dumped)
+    return cache_list
+
+
+def get_config_hash(config):
+    """Returns the hash of the tuning config, the values which are not json types are hashed by their str."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_rng_state():
+    state = {"torch": torch.get_rng_state(), "random": random.getstate(), "numpy": np.random.get_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class BlockCheckpoint(object):
+    """Saves the state of the quantization after each tuned block and restores it in a restarted run.
+
+    Each block is saved to its own file with the quantize-dequantized weights, the scale/zp of its layers and their
+    layer_config entries. The cached inputs of the next block, the RNG states and the names of the finished blocks
+    are saved to one state file per list of blocks, which is replaced atomically after the block file is written,
+    so the checkpoint is always consistent whenever the run is interrupted. Tensors are loaded memory-mapped.
+    The state file also holds the hash of the tuning config, so a run with other settings does not resume from it.
+
+    Args:
+        checkpoint_dir (str): The directory of the checkpoint, created if it does not exist.
+        config_hash (str): The hash of the tuning config of the run, see get_config_hash.
+    """
+
+    def __init__(self, checkpoint_dir, config_hash=None):
+        self.checkpoint_dir = checkpoint_dir
+        self.config_hash = config_hash
+        os.makedirs(os.path.join(self.checkpoint_dir, "blocks"), exist_ok=True)
+
+    def _block_path(self, block_name):
+        return os.path.join(self.checkpoint_dir, "blocks", _file_name(block_name) + ".pt")
+
+    def _state_path(self, key):
+        return os.path.join(self.checkpoint_dir, f"state_{_file_name(key)}.pt")
+
+    def load_state(self, key):
+        """Returns the state saved for the list of blocks starting at block key, or None."""
+        path = self._state_path(key)
+        if not os.path.exists(path):
+            return None
+        return _load(path)
+
+    @torch.no_grad()
+    def save_block(self, block_name, block, layer_config):
+        """Saves a tuned block, with the wrappers removed, and the layer_config entries of its layers."""
+        qinfo, config = {}, {}
+        for n, m in block.named_modules():
+            info = {key: getattr(m, key) for key in QINFO_KEYS if hasattr(m, key)}
+            if len(info) > 0:
+                qinfo[n] = info
+        for n, cfg in layer_config.items():
+            if n.startswith(block_name + "."):
+                config[n] = {k: v for k, v in cfg.items() if k not in ("scale", "zp")}
+        state_dict = {k: v.to("cpu") for k, v in block.state_dict().items()}
+        _save({"state_dict": state_dict, "qinfo": qinfo, "layer_config": config}, self._block_path(block_name))
+
+    def save_state(self, key, finished, input_ids, q_input, extra=None):
+        """Saves the state to resume the tuning after the last finished block, which must have been saved before.
+
+        Args:
+            key (str): The name of the first block of the list of blocks being tuned.
+            finished (list): The names of the tuned blocks of the list.
+            input_ids: The cached unquantized inputs of the next block.
+            q_input: The cached quantized inputs of the next block, or None.
+            extra (dict): Other states to restore, e.g. the iterations allocated to the blocks.
+        """
+        state = {
+            "finished": list(finished),
+            "input_ids": _dump_samples(input_ids),
+            "q_input": _dump_samples(q_input),
+            "rng": get_rng_state(),
+            "extra": extra or {},
+            "config_hash": self.config_hash,
+        }
+        _save(state, self._state_path(key))
+        logger.info(f"saved the checkpoint of {finished[-1]} to {self.checkpoint_dir}")
+
+    @torch.no_grad()
+    def load_block(self, block_name, block, layer_config):
+        """Restores a tuned block saved by save_block in place."""
+        checkpoint = _load(self._block_path(block_name))
+        block.load_state_dict(checkpoint["state_dict"])
+        modules = dict(block.named_modules())
+        for n, info in checkpoint["qinfo"].items():
+            for key, value in info.items():
+                setattr(modules[n], key, value)
+        for n, cfg in checkpoint["layer_config"].items():
+            layer_config.setdefault(n, {}).update(cfg)
+
+    @staticmethod
+    def load_samples(dumped, cache_list):
+        return _load_samples(dumped, cache_list)
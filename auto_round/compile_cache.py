@@ -0,0 +1,99 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compiles the forward of the wrapped blocks once and reuses it for the structurally identical blocks."""
+
+import time
+
+import torch
+
+from .utils import block_forward, compile_func, logger
+
+
+def synchronize(device):
+    """Waits for the pending work of the device, so that wall-clock timings are accurate."""
+    device = str(device)
+    if device.startswith("cuda"):
+        torch.cuda.synchronize(device)
+    elif device.startswith("hpu") and hasattr(torch, "hpu"):
+        torch.hpu.synchronize()
+
+
+class BlockCompileCache(object):
+    """Runs the forward of the wrapped blocks, including the qdq of the weights, through one compiled function.
+
+    Dynamo guards on the identity of the nn.Module instances by default, so compiling the tuning of every block
+    recompiles for each new block and falls back to eager once torch._dynamo.config.cache_size_limit is hit. The
+    forward is compiled here with the modules inlined, which turns their parameters and tensor attributes into graph
+    inputs, so the graphs compiled for the first block are reused with the parameters of the next blocks as long as
+    their architecture, shapes and dtypes match.
+
+    The blocks are keyed by their architecture, parameter shapes and input shape, and the compile overhead and the
+    steady-state iteration time of each key are recorded for `report`.
+
+    Args:
+        device: The device of the tuning.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.forward = compile_func(block_forward, device)
+        self.inline_modules = hasattr(torch._dynamo.config, "inline_inbuilt_nn_modules")
+        self.stats = {}
+
+    @staticmethod
+    def get_key(block, input_ids):
+        """Returns the key of the block architecture, parameter shapes and dtypes and the input shape."""
+        structure = tuple((n, type(m).__name__) for n, m in block.named_modules())
+        params = tuple((n, tuple(p.shape), p.dtype) for n, p in block.named_parameters())
+        input_shape = tuple(input_ids.shape) if isinstance(input_ids, torch.Tensor) else None
+        return type(block).__name__, hash((structure, params)), input_shape
+
+    def __call__(self, block, input_ids, input_others, amp=False, amp_dtype=torch.float16, device=torch.device("cpu")):
+        """Same as block_forward, through the compiled function."""
+        if not self.inline_modules:  # pragma: no cover
+            return self.forward(block, input_ids, input_others, amp, amp_dtype, device)
+        with torch._dynamo.config.patch(inline_inbuilt_nn_modules=True):
+            return self.forward(block, input_ids, input_others, amp, amp_dtype, device)
+
+    def record(self, key, first_iter_time, steady_time, steady_iters):
+        """Records the tuning time of a block.
+
+        Args:
+            key: The key of the block from get_key.
+            first_iter_time (float): The time of the first iteration, which compiles the graphs for a new key.
+            steady_time (float): The time of the remaining iterations.
+            steady_iters (int): The number of the remaining iterations.
+        """
+        if key not in self.stats:
+            self.stats[key] = {"blocks": 0, "compile_iter_time": first_iter_time, "first_iter_time": 0.0,
+                               "steady_time": 0.0, "steady_iters": 0}
+        else:
+            self.stats[key]["first_iter_time"] += first_iter_time
+        stats = self.stats[key]
+        stats["blocks"] += 1
+        stats["steady_time"] += steady_time
+        stats["steady_iters"] += steady_iters
+
+    def report(self):
+        """Logs the compile time versus the steady-state iteration time of every block architecture."""
+        for (name, _, input_shape), stats in self.stats.items():
+            if stats["steady_iters"] == 0:
+                continue
+            steady_iter_time = stats["steady_time"] / stats["steady_iters"]
+            reused_iter_time = stats["first_iter_time"] / max(stats["blocks"] - 1, 1)
+            logger.info(
+                f"torch.compile of {name} with inputs {input_shape}: compiled once in "
+                f"{stats['compile_iter_time'] - steady_iter_time:.2f}s and reused for {stats['blocks'] - 1} "
+                f"blocks, steady-state iteration {steady_iter_time * 1000:.2f}ms, first iteration of the reused "
+                f"blocks {reused_iter_time * 1000:.2f}ms")
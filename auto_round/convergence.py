@@ -0,0 +1,218 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Policies which stop the tuning of a block or layer once its loss has converged."""
+
+import copy
+
+CONVERGENCE_POLICIES = {}
+
+
+def register_convergence_policy(name):
+    """Class decorator to register a ConvergencePolicy subclass to the registry.
+
+    Args:
+        name: A string. Define the policy name used by the `convergence_policy` option.
+
+    Returns:
+        cls: The class of register.
+    """
+
+    def register(policy):
+        CONVERGENCE_POLICIES[name] = policy
+        return policy
+
+    return register
+
+
+class ConvergencePolicy(object):
+    """Base class of the convergence policies.
+
+    A policy is created once per tuning run and `reset` before each block or layer, then `update` is called with
+    the loss of every iteration and returns True when the tuning should stop. State which is not cleared by `reset`
+    is shared across blocks. Layers which are tuned concurrently use a `fork` of the policy each, which are `join`ed
+    back in the order of the layers.
+
+    Args:
+        iters (int): The maximum number of iterations of a block.
+        min_iters (int): The number of iterations always run before stopping early.
+    """
+
+    ## whether reset should be given the loss_scale of the block or layer
+    requires_loss_scale = False
+
+    def __init__(self, iters, min_iters=10):
+        self.iters = iters
+        self.min_iters = min(min_iters, iters)
+        self.reset()
+
+    def reset(self, iters=None, loss_scale=None):
+        """Clears the state of the previous block, iters is the maximum number of iterations of the next one and
+        loss_scale the mean square of the outputs it is tuned to."""
+        if iters is not None:
+            self.iters = iters
+        self.loss_scale = loss_scale
+        self.step = 0
+        self.init_loss = None
+        self.best_loss = float("inf")
+
+    def update(self, loss):
+        """Records the loss of one iteration and returns whether to stop the tuning."""
+        if self.init_loss is None:
+            self.init_loss = loss
+        self.best_loss = min(self.best_loss, loss)
+        self.step += 1
+        if self.step < self.min_iters:
+            return False
+        return self.converged(loss)
+
+    def converged(self, loss):
+        raise NotImplementedError
+
+    def fork(self):
+        """Returns a copy of the policy to tune one of the layers which are tuned concurrently."""
+        return copy.deepcopy(self)
+
+    def join(self, forks):
+        """Merges the state shared across blocks of the forks which have finished tuning, in the given order."""
+
+
+@register_convergence_policy("ema")
+class EMASlopePolicy(ConvergencePolicy):
+    """Stops when the slope of the exponential moving average of the loss flattens.
+
+    Args:
+        iters (int): The maximum number of iterations of a block.
+        min_iters (int): The number of iterations always run before stopping early.
+        decay (float): The decay of the moving average.
+        tol (float): The relative decrease of the moving average per iteration below which the loss is flat.
+        patience (int): The number of consecutive flat iterations to stop.
+    """
+
+    def __init__(self, iters, min_iters=10, decay=0.9, tol=1e-3, patience=10):
+        self.decay = decay
+        self.tol = tol
+        self.patience = patience
+        super(EMASlopePolicy, self).__init__(iters, min_iters)
+
+    def reset(self, iters=None, loss_scale=None):
+        super(EMASlopePolicy, self).reset(iters, loss_scale)
+        self.ema = None
+        self.flat_steps = 0
+
+    def update(self, loss):
+        prev_ema = self.ema
+        self.ema = loss if prev_ema is None else self.decay * prev_ema + (1 - self.decay) * loss
+        if prev_ema is not None and prev_ema > 0:
+            slope = (prev_ema - self.ema) / prev_ema
+            self.flat_steps = self.flat_steps + 1 if slope < self.tol else 0
+        return super(EMASlopePolicy, self).update(loss)
+
+    def converged(self, loss):
+        return self.flat_steps >= self.patience
+
+
+@register_convergence_policy("rel_improve")
+class RelativeImprovementPolicy(ConvergencePolicy):
+    """Stops when the best loss has not improved by a relative threshold within a window of iterations.
+
+    Args:
+        iters (int): The maximum number of iterations of a block.
+        min_iters (int): The number of iterations always run before stopping early.
+        tol (float): The relative improvement of the best loss that resets the window.
+        window (int): The number of iterations without such an improvement to stop.
+    """
+
+    def __init__(self, iters, min_iters=10, tol=1e-2, window=20):
+        self.tol = tol
+        self.window = window
+        super(RelativeImprovementPolicy, self).__init__(iters, min_iters)
+
+    def reset(self, iters=None, loss_scale=None):
+        super(RelativeImprovementPolicy, self).reset(iters, loss_scale)
+        self.ref_loss = None
+        self.ref_step = 0
+
+    def update(self, loss):
+        if self.ref_loss is None or loss < self.ref_loss * (1 - self.tol):
+            self.ref_loss = loss
+            self.ref_step = self.step
+        return super(RelativeImprovementPolicy, self).update(loss)
+
+    def converged(self, loss):
+        return self.step - self.ref_step > self.window
+
+
+@register_convergence_policy("init_loss_budget")
+class InitLossBudgetPolicy(ConvergencePolicy):
+    """Gives each block an iteration budget proportional to its relative initial loss.
+
+    The relative initial loss is the loss of the first iteration, i.e. of the rounding to nearest, divided by the
+    loss_scale, the mean square of the outputs of the block. Unlike the loss itself, it does not grow with the depth
+    of the block as its outputs do. The budget is `iters * relative_init_loss / max_relative_init_loss`, clamped to
+    [min_iters, iters], where the max is over the blocks tuned so far including this one, so the first block and the
+    blocks which are harder than all the earlier ones run all iterations.
+
+    Args:
+        iters (int): The maximum number of iterations of a block.
+        min_iters (int): The minimum budget of a block.
+    """
+
+    requires_loss_scale = True
+
+    def __init__(self, iters, min_iters=20):
+        self.init_losses = []
+        self.num_joined = 0
+        super(InitLossBudgetPolicy, self).__init__(iters, min_iters)
+
+    def reset(self, iters=None, loss_scale=None):
+        super(InitLossBudgetPolicy, self).reset(iters, loss_scale)
+        self.budget = self.iters
+
+    def update(self, loss):
+        if self.init_loss is None and loss > 0:
+            init_loss = loss / self.loss_scale if self.loss_scale else loss
+            budget = int(round(self.iters * init_loss / max(self.init_losses + [init_loss])))
+            self.budget = max(self.min_iters, min(self.iters, budget))
+            self.init_losses.append(init_loss)
+        return super(InitLossBudgetPolicy, self).update(loss)
+
+    def converged(self, loss):
+        return self.step >= self.budget
+
+    def fork(self):
+        policy = super(InitLossBudgetPolicy, self).fork()
+        policy.num_joined = len(self.init_losses)
+        return policy
+
+    def join(self, forks):
+        for policy in forks:
+            self.init_losses.extend(policy.init_losses[policy.num_joined:])
+
+
+def get_convergence_policy(policy, iters):
+    """Creates the convergence policy for the tuning.
+
+    Args:
+        policy (str|ConvergencePolicy): The name of a registered policy, or a policy instance which is used as is.
+        iters (int): The maximum number of iterations of a block.
+
+    Returns:
+        ConvergencePolicy: The policy, or None if policy is None.
+    """
+    if policy is None or isinstance(policy, ConvergencePolicy):
+        return policy
+    if policy not in CONVERGENCE_POLICIES:
+        raise ValueError(f"convergence_policy {policy} is not supported, "
+                         f"please choose from {list(CONVERGENCE_POLICIES.keys())}")
+    return CONVERGENCE_POLICIES[policy](iters)
@@ -0,0 +1,192 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fused quantize-dequantize of int weights with a hand-written straight-through-estimator backward.
+
+The forward matches `quant_tensor_asym`/`quant_tensor_sym` in int.py, but runs without building an autograd graph
+and only keeps the tuning parameters for the backward, which recomputes the rounding masks instead of storing every
+weight-sized intermediate tensor. The kernels use in-place ops to avoid temporaries in eager mode, and are traced into
+fused kernels by torch.compile when the tuning is compiled.
+"""
+
+import torch
+from .utils import reshape_pad_tensor_by_group_size, revert_tensor_by_pad
+
+
+def _reduce_to(grad, like):
+    """Sums the per-group gradient to the shape of the scale parameter, or returns None if it is not tunable."""
+    if not isinstance(like, torch.Tensor) or not like.requires_grad:
+        return None
+    return grad.reshape(like.shape).to(like.dtype) if like.dim() > 0 else grad.sum().to(like.dtype)
+
+
+def _round_and_clamp(tensor, v, scale, zp, maxq):
+    """Computes clamp(round(tensor / scale + v) + zp, 0, maxq) with in-place ops, and the mask of the clamp."""
+    dtype = torch.promote_types(torch.result_type(tensor, scale), v.dtype)
+    q = torch.empty(tensor.shape, dtype=dtype, device=tensor.device)
+    torch.div(tensor, scale, out=q)
+    q.add_(v).round_().add_(zp)
+    in_range = (q >= 0) & (q <= maxq)
+    return q.clamp_(0, maxq), in_range
+
+
+def _rowwise_dot(x, y):
+    return torch.einsum("ij,ij->i", x, y) if x.dtype == y.dtype else (x * y).sum(-1)
+
+
+def _qdq_int_asym_forward(tensor, v, wmin, wmax, bits, scale_dtype, q_scale_thresh):
+    maxq = 2 ** bits - 1
+    scale_before_clamp = ((wmax - wmin) / maxq).to(scale_dtype)
+    scale = torch.clamp(scale_before_clamp, min=q_scale_thresh)
+    zp = torch.round(-wmin / scale)
+    scale = scale.unsqueeze(dim=-1)
+    zp = zp.unsqueeze(dim=-1)
+    q, _ = _round_and_clamp(tensor, v, scale, zp, maxq)
+    qdq_result = q.sub_(zp).mul_(scale).to(tensor.dtype)
+    return qdq_result, scale, zp, scale_before_clamp
+
+
+def _qdq_int_asym_backward(grad, tensor, v, scale, zp, scale_before_clamp, wmin, bits, q_scale_thresh):
+    maxq = 2 ** bits - 1
+    q, in_range = _round_and_clamp(tensor, v, scale, zp, maxq)
+    q.sub_(zp)
+    grad = grad.to(torch.float32)
+    scale_fp32 = scale.to(torch.float32)
+    grad_v = (grad * scale_fp32).mul_(in_range)
+    scale_fp32 = scale_fp32.squeeze(-1)
+    grad_zp = grad_v.sum(-1) - grad.sum(-1) * scale_fp32
+    grad_scale = _rowwise_dot(grad, q) - _rowwise_dot(grad_v, tensor) / (scale_fp32 * scale_fp32)
+    grad_scale = grad_scale + grad_zp * wmin / (scale_fp32 * scale_fp32)
+    grad_scale = grad_scale * (scale_before_clamp >= q_scale_thresh)
+    grad_wmin = -grad_scale / maxq - grad_zp / scale_fp32
+    grad_wmax = grad_scale / maxq
+    return grad_v, grad_wmin, grad_wmax
+
+
+def _qdq_int_sym_forward(tensor, v, wmin_abs, wmax_abs, bits, scale_dtype, q_scale_thresh):
+    maxq = 2 ** (bits - 1)
+    max_v = (2 * (wmax_abs < wmin_abs).int() - 1) * torch.max(wmax_abs, wmin_abs)
+    scale_before_clamp = (max_v / maxq).to(scale_dtype)
+    scale = torch.where(scale_before_clamp < 0, torch.clamp(scale_before_clamp, max=-q_scale_thresh),
+                        torch.clamp(scale_before_clamp, min=q_scale_thresh))
+    zp = torch.full_like(scale, maxq)
+    scale = scale.unsqueeze(dim=-1)
+    zp = zp.unsqueeze(dim=-1)
+    q, _ = _round_and_clamp(tensor, v, scale, zp, 2 ** bits - 1)
+    qdq_result = q.sub_(zp).mul_(scale).to(tensor.dtype)
+    return qdq_result, scale, zp, scale_before_clamp
+
+
+def _qdq_int_sym_backward(grad, tensor, v, scale, zp, scale_before_clamp, wmin_abs, wmax_abs, bits, q_scale_thresh):
+    maxq = 2 ** (bits - 1)
+    q, in_range = _round_and_clamp(tensor, v, scale, zp, 2 ** bits - 1)
+    q.sub_(zp)
+    grad = grad.to(torch.float32)
+    scale_fp32 = scale.to(torch.float32)
+    grad_v = (grad * scale_fp32).mul_(in_range)
+    scale_fp32 = scale_fp32.squeeze(-1)
+    grad_scale = _rowwise_dot(grad, q) - _rowwise_dot(grad_v, tensor) / (scale_fp32 * scale_fp32)
+    grad_scale = grad_scale * torch.where(scale_before_clamp < 0, scale_before_clamp <= -q_scale_thresh,
+                                          scale_before_clamp >= q_scale_thresh)
+    ## the sign of max_v and the gradient of torch.max, which splits the gradient evenly on ties
+    grad_max = grad_scale / maxq * (2 * (wmax_abs < wmin_abs).int() - 1)
+    grad_max = torch.where(wmax_abs == wmin_abs, grad_max / 2, grad_max)
+    grad_wmax_abs = grad_max * (wmax_abs >= wmin_abs)
+    grad_wmin_abs = grad_max * (wmin_abs >= wmax_abs)
+    return grad_v, grad_wmin_abs, grad_wmax_abs
+
+
+class QDQIntAsymFunction(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, bits, scale_dtype, q_scale_thresh):
+        wmin = wmin_tmp * min_scale
+        wmax = wmax_tmp * max_scale
+        qdq_result, scale, zp, scale_before_clamp = _qdq_int_asym_forward(tensor, v, wmin, wmax, bits, scale_dtype,
+                                                                          q_scale_thresh)
+        ctx.save_for_backward(tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, scale, zp, scale_before_clamp)
+        ctx.bits, ctx.q_scale_thresh = bits, q_scale_thresh
+        ctx.mark_non_differentiable(scale, zp)
+        return qdq_result, scale, zp
+
+    @staticmethod
+    def backward(ctx, grad, grad_scale, grad_zp):
+        tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, scale, zp, scale_before_clamp = ctx.saved_tensors
+        grad_v, grad_wmin, grad_wmax = _qdq_int_asym_backward(grad, tensor, v, scale, zp, scale_before_clamp,
+                                                              wmin_tmp * min_scale, ctx.bits, ctx.q_scale_thresh)
+        grad_min_scale = _reduce_to(grad_wmin * wmin_tmp, min_scale) if ctx.needs_input_grad[2] else None
+        grad_max_scale = _reduce_to(grad_wmax * wmax_tmp, max_scale) if ctx.needs_input_grad[3] else None
+        grad_v = grad_v.to(v.dtype) if ctx.needs_input_grad[1] else None
+        return None, grad_v, grad_min_scale, grad_max_scale, None, None, None, None, None
+
+
+class QDQIntSymFunction(torch.autograd.Function):
+
+    @staticmethod
+    def forward(ctx, tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, bits, scale_dtype, q_scale_thresh):
+        wmin_abs = -(wmin_tmp * min_scale)  # pylint: disable=E1130
+        wmax_abs = wmax_tmp * max_scale
+        qdq_result, scale, zp, scale_before_clamp = _qdq_int_sym_forward(tensor, v, wmin_abs, wmax_abs, bits,
+                                                                         scale_dtype, q_scale_thresh)
+        ctx.save_for_backward(tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, scale, zp, scale_before_clamp)
+        ctx.bits, ctx.q_scale_thresh = bits, q_scale_thresh
+        ctx.mark_non_differentiable(scale, zp)
+        return qdq_result, scale, zp
+
+    @staticmethod
+    def backward(ctx, grad, grad_scale, grad_zp):
+        tensor, v, min_scale, max_scale, wmin_tmp, wmax_tmp, scale, zp, scale_before_clamp = ctx.saved_tensors
+        wmin_abs = -(wmin_tmp * min_scale)  # pylint: disable=E1130
+        wmax_abs = wmax_tmp * max_scale
+        grad_v, grad_wmin_abs, grad_wmax_abs = _qdq_int_sym_backward(grad, tensor, v, scale, zp, scale_before_clamp,
+                                                                     wmin_abs, wmax_abs, ctx.bits,
+                                                                     ctx.q_scale_thresh)
+        grad_min_scale = _reduce_to(-grad_wmin_abs * wmin_tmp, min_scale) if ctx.needs_input_grad[2] else None
+        grad_max_scale = _reduce_to(grad_wmax_abs * wmax_tmp, max_scale) if ctx.needs_input_grad[3] else None
+        grad_v = grad_v.to(v.dtype) if ctx.needs_input_grad[1] else None
+        return None, grad_v, grad_min_scale, grad_max_scale, None, None, None, None, None
+
+
+def _fused_quant_func(function):
+    def quant_func(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
+                   tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, reshaped_tensor=None, **kwargs):
+        """Quantize and de-quantize tensor with the fused kernels, see the int data types for the arguments.
+
+        reshaped_tensor is the cached output of reshape_pad_tensor_by_group_size for the tensor, if any.
+        """
+        tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                       reshaped_tensor=reshaped_tensor)
+        if tensor_min is None or tensor_max is None:
+            tensor_min = torch.clamp(tensor.min(-1)[0], max=0)
+            tensor_max = torch.clamp(tensor.max(-1)[0], min=0)
+        device = tensor.device
+        v = v if isinstance(v, torch.Tensor) else torch.tensor(v, device=device, dtype=torch.float32)
+        min_scale = min_scale if isinstance(min_scale, torch.Tensor) else torch.tensor(min_scale, device=device)
+        max_scale = max_scale if isinstance(max_scale, torch.Tensor) else torch.tensor(max_scale, device=device)
+        qdq_result, scale, zp = function.apply(tensor, v, min_scale, max_scale, tensor_min, tensor_max, bits,
+                                               scale_dtype, q_scale_thresh)
+        qdq_result = revert_tensor_by_pad(qdq_result, orig_shape=orig_shape, pad_len=pad_len)
+        return qdq_result, scale, zp
+
+    return quant_func
+
+
+FUSED_QUANT_FUNC_WITH_DTYPE = {
+    "int_asym": _fused_quant_func(QDQIntAsymFunction),
+    "int_sym": _fused_quant_func(QDQIntSymFunction),
+}
+
+
+def get_fused_quant_func(data_type):
+    """Returns the fused quantization function of the data type key, or None if it is not supported."""
+    return FUSED_QUANT_FUNC_WITH_DTYPE.get(data_type, None)
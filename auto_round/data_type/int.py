@@ -20,7 +20,7 @@ from auto_round.data_type.register import register_dtype
 @register_dtype("int_sym")
 def quant_tensor_sym(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
                      tensor_min=None,
-                     tensor_max=None, q_scale_thresh=1e-5, **kwargs):
+                     tensor_max=None, q_scale_thresh=1e-5, reshaped_tensor=None, **kwargs):
     """Quantize and de-quantize tensor asymmetrically. full range, credict goes to llamacpp community
 
     Args:
@@ -34,12 +34,14 @@ def quant_tensor_sym(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scal
         tensor_max (Tensor, optional): Maximum tensor value for quantization. Defaults to None.
         scale_dtype: dtype of the quantized scale,as most kernels only support FP16 or FP32, while this value is import
         q_scale_thresh: clip the quantized scale's magnitude to this value to improve the numerical stability
+        reshaped_tensor: cached output of reshape_pad_tensor_by_group_size for the tensor, e.g. the tuned weight
 
     Returns:
         Quantized and de-quantized tensor, scale, zero-point
     """
 
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                   reshaped_tensor=reshaped_tensor)
     maxq = 2 ** (bits - 1)
     if tensor_min is None or tensor_max is None:
         wmin_tmp = torch.clamp(tensor.min(-1)[0], max=0)
@@ -76,7 +78,7 @@ def double_quant_tensor(tensor, bits, q_scale_thresh):
 @register_dtype("int_asym_dq")
 def quant_tensor_asym_dq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
                          tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, super_group_size=32, super_bits=6,
-                         **kwargs):
+                         reshaped_tensor=None, **kwargs):
     """Quantize and de-quantize tensor asymmetrically.
 
     Args:
@@ -90,11 +92,13 @@ def quant_tensor_asym_dq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_
         tensor_max (Tensor, optional): Maximum tensor value for quantization. Defaults to None.
         scale_dtype: dtype of the quantized scale,as most kernels only support FP16 or FP32, while this value is import
         q_scale_thresh: clip the quantized scale's magnitude to this value to improve the numerical stability
+        reshaped_tensor: cached output of reshape_pad_tensor_by_group_size for the tensor, e.g. the tuned weight
 
     Returns:
         Quantized and de-quantized tensor, scale, zero-point
     """
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                   reshaped_tensor=reshaped_tensor)
 
     maxq = 2 ** bits - 1
     if tensor_min is None or tensor_max is None:
@@ -133,7 +137,7 @@ def quant_tensor_asym_dq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_
 
 @register_dtype("int_asym")
 def quant_tensor_asym(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
-                      tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, **kwargs):
+                      tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, reshaped_tensor=None, **kwargs):
     """Quantize and de-quantize tensor asymmetrically.
 
     Args:
@@ -147,11 +151,13 @@ def quant_tensor_asym(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_sca
         tensor_max (Tensor, optional): Maximum tensor value for quantization. Defaults to None.
         scale_dtype: dtype of the quantized scale,as most kernels only support FP16 or FP32, while this value is import
         q_scale_thresh: clip the quantized scale's magnitude to this value to improve the numerical stability
+        reshaped_tensor: cached output of reshape_pad_tensor_by_group_size for the tensor, e.g. the tuned weight
 
     Returns:
         Quantized and de-quantized tensor, scale, zero-point
     """
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                   reshaped_tensor=reshaped_tensor)
     maxq = 2 ** bits - 1
     if tensor_min is None or tensor_max is None:
         wmin_tmp = torch.clamp(tensor.min(-1)[0], max=0)
@@ -180,7 +186,7 @@ def quant_tensor_asym(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_sca
 @register_dtype("int_sym_gptq")
 def quant_tensor_sym_gptq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0, scale_dtype=torch.float16,
                           tensor_min=None,
-                          tensor_max=None, q_scale_thresh=1e-5, **kwargs):
+                          tensor_max=None, q_scale_thresh=1e-5, reshaped_tensor=None, **kwargs):
     """Quantize and de-quantize tensor asymmetrically.
 
     Args:
@@ -194,11 +200,13 @@ def quant_tensor_sym_gptq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max
         tensor_max (Tensor, optional): Maximum tensor value for quantization. Defaults to None.
         scale_dtype: dtype of the quantized scale,as most kernels only support FP16 or FP32, while this value is import
         q_scale_thresh: clip the quantized scale's magnitude to this value to improve the numerical stability
+        reshaped_tensor: cached output of reshape_pad_tensor_by_group_size for the tensor, e.g. the tuned weight
 
     Returns:
         Quantized and de-quantized tensor, scale, zero-point
     """
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                   reshaped_tensor=reshaped_tensor)
     maxq = 2 ** bits - 1
     if tensor_min is None or tensor_max is None:
         wmin_tmp = torch.clamp(tensor.min(-1)[0], max=0)
@@ -233,7 +241,8 @@ def quant_tensor_sym_gptq(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max
 
 def quant_tensor_asym_wo_round(tensor, bits=4, group_size=-1, v=0, min_scale=1.0, max_scale=1.0,
                                scale_dtype=torch.float16,
-                               tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, **kwargs):
+                               tensor_min=None, tensor_max=None, q_scale_thresh=1e-5, reshaped_tensor=None,
+                               **kwargs):
     """Quantize and de-quantize tensor asymmetrically without rounding, this is mainly for tuning bias, norm.
 
     Args:
@@ -247,11 +256,13 @@ def quant_tensor_asym_wo_round(tensor, bits=4, group_size=-1, v=0, min_scale=1.0
         tensor_max (Tensor, optional): Maximum tensor value for quantization. Defaults to None.
         scale_dtype: dtype of the quantized scale,as most kernels only support FP16 or FP32, while this value is import
         q_scale_thresh: clip the quantized scale's magnitude to this value to improve the numerical stability
+        reshaped_tensor: cached output of reshape_pad_tensor_by_group_size for the tensor, e.g. the tuned weight
 
     Returns:
         Quantized and de-quantize tensor, scale, zero-point
     """
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size,
+                                                                   reshaped_tensor=reshaped_tensor)
     maxq = 2 ** bits - 1
     if tensor_min is None or tensor_max is None:
         wmin_tmp = torch.clamp(tensor.min(-1)[0], max=0)
@@ -75,7 +75,7 @@ def quant_element(tensor, ebits, mbits, max_norm, mantissa_rounding="even"):
 
 
 def quant_mx(tensor, bits=4, group_size=-1, v=0, max_scale=1.0,
-             mantissa_rounding="even", data_type="mx_fp", **kwargs):
+             mantissa_rounding="even", data_type="mx_fp", reshaped_tensor=None, **kwargs):
     """Quantize the given tensor using the specified parameters.
 
     This function performs quantization on the `tensor` tensor according to the
@@ -91,6 +91,7 @@ def quant_mx(tensor, bits=4, group_size=-1, v=0, max_scale=1.0,
         v (float): A value used for adjusting the tensors.
         max_scale (float or torch.Tensor): The maximum scale to be applied to the tensors.
         mantissa_rounding (str): rounding method for mantissa,currently support even,nearest,floor
+        reshaped_tensor (tuple): The cached output of reshape_pad_tensor_by_group_size for the tensor, if any.
 
     Returns:
         tuple: A tuple containing the quantized tensors, shared exponent, and None (reserved for future use).
@@ -98,7 +99,7 @@ def quant_mx(tensor, bits=4, group_size=-1, v=0, max_scale=1.0,
     Raises:
         KeyError: If `data_type` is not found in `MXFP_FORMAT_CACHE`.
     """
-    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size)
+    tensor, orig_shape, pad_len = reshape_pad_tensor_by_group_size(tensor, group_size, reshaped_tensor=reshaped_tensor)
     ebits, mbits, emax, max_norm, min_norm = MXFP_FORMAT_CACHE[data_type]
     orig_dtype = tensor.dtype
     shared_exp, _ = torch.max(torch.abs(tensor), dim=-1, keepdim=True)
@@ -16,7 +16,7 @@ import torch
 from auto_round.data_type.register import QUANT_FUNC_WITH_DTYPE
 
 
-def reshape_pad_tensor_by_group_size(data: torch.Tensor, group_size: int):
+def reshape_pad_tensor_by_group_size(data: torch.Tensor, group_size: int, reshaped_tensor: tuple = None):
     """Reshapes and pads the tensor to ensure that it can be quantized in groups of `group_size`.
 
     This function adjusts t
@@ -28,12 +28,16 @@ def reshape_pad_tensor_by_group_size(data: torch.Tensor, group_size: int):
     Args:
         data (torch.Tensor): The input tensor to be reshaped and padded.
         group_size (int): The size of the groups that the tensor should be reshaped into.
+        reshaped_tensor (tuple): A previous result of this function for the same tensor, e.g. the weight cached
+            across tuning iterations, which is returned as is instead of reshaping the tensor again.
 
     Returns:
         torch.Tensor: The reshaped and padded tensor, if necessary.
         tuple: The original shape of the input tensor.
         int: The padding length applied to the tensor. Returns 0 if no padding is applied.
     """
+    if reshaped_tensor is not None:
+        return reshaped_tensor
     orig_shape = data.shape
     pad_len = 0
     if len(data.shape) > 2:
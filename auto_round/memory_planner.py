@@ -0,0 +1,241 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Estimates the peak memory of the tuning and picks the settings which fit a memory budget before running."""
+
+import psutil
+import torch
+import transformers
+
+from .utils import get_module, logger
+
+GB = 1024 ** 3
+
+## bytes per weight element of a wrapped layer during the tuning besides the weight itself: the fp32 rounding value
+## and its gradient, and the fp32 intermediates of the qdq saved for the backward
+WRAPPER_BYTES_PER_WEIGHT = 4 * 2 + 4 * 3
+## the allocator fragmentation and the temporary buffers which are not modeled
+MARGIN = 1.2
+
+
+def get_free_device_memory(device):
+    """Returns the free memory of the device in bytes, or the available host memory for cpu."""
+    device = str(device)
+    if device.startswith("cuda"):
+        free_memory, _ = torch.cuda.mem_get_info(torch.device(device))
+        return free_memory
+    if device.startswith("hpu"):  # pragma: no cover
+        return torch.hpu.mem_get_info()[0]
+    return psutil.virtual_memory().available
+
+
+def parse_memory_budget(memory_budget, device):
+    """Converts a memory budget in GB, or "auto" for the free memory of the device, to bytes."""
+    if isinstance(memory_budget, str):
+        if memory_budget.lower() == "auto":
+            return get_free_device_memory(device)
+        memory_budget = float(memory_budget.lower().rstrip("gb"))
+    if memory_budget <= 0:
+        raise ValueError(f"memory_budget should be positive, got {memory_budget}")
+    return int(memory_budget * GB)
+
+
+def _nbytes(tensors):
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class MemoryPlanner(object):
+    """Estimates the peak memory of the calibration and the block tuning from the shapes of the model.
+
+    The tuning peak of a block is the sum of the block weights, the tuning parameters of its wrapped layers, the cached
+    block inputs and outputs when they are kept on the device, and the larger of the activations saved for the
+    backward of one batch and the activations of one inference batch. The host peak is the current RSS plus the
+    cached samples when they are kept on the cpu.
+
+    Args:
+        model: The model to quantize.
+        block_names (list): The names of the blocks to tune, as lists of names or names.
+        seqlen (int): The sequence length of the calibration samples.
+        nsamples (int): The number of calibration samples.
+        act_dtype (torch.dtype): The dtype of the activations and of the cached samples.
+        enable_quanted_input (bool): Whether the quantized inputs of the blocks are cached as well.
+        device (str): The device of the tuning.
+        nblocks (int): The number of blocks tuned together.
+        supported_types (list): The types of the layers to be wrapped.
+    """
+
+    def __init__(self, model, block_names, seqlen, nsamples, act_dtype, enable_quanted_input, device, nblocks=1,
+                 supported_types=(torch.nn.Linear, transformers.modeling_utils.Conv1D)):
+        self.model = model
+        self.seqlen = seqlen
+        self.nsamples = nsamples
+        self.act_bytes = torch.finfo(act_dtype).bits // 8
+        self.enable_quanted_input = enable_quanted_input
+        self.device = device
+        self.on_cpu = str(device).startswith("cpu")
+
+        config = getattr(model, "config", None)
+        config = getattr(config, "text_config", config)
+        self.num_heads = getattr(config, "num_attention_heads", 0) or 0
+        self.hidden_size = getattr(config, "hidden_size", 0) or 0
+
+        block_names = [name for names in block_names for name in (names if isinstance(names, list) else [names])]
+        self.block_stats = {"weight_bytes": 0, "layer_numel": 0, "layer_features": 0, "max_features": 0}
+        for name in block_names:
+            block = get_module(model, name)
+            layers = [m for m in block.modules() if isinstance(m, tuple(supported_types))]
+            weights = [m.weight for m in layers]
+            ## the shapes of Conv1D weights are transposed, in+out features are the same either way
+            features = [sum(w.shape[:2]) if w.dim() >= 2 else w.shape[0] for w in weights]
+            stats = {
+                "weight_bytes": _nbytes(block.parameters()),
+                "layer_numel": sum(w.numel() for w in weights),
+                "layer_features": sum(features),
+                "max_features": max([max(w.shape) for w in weights], default=0),
+            }
+            for key, value in stats.items():
+                self.block_stats[key] = max(self.block_stats[key], value * (nblocks if key != "max_features" else 1))
+            if self.hidden_size == 0 and len(weights) > 0:
+                self.hidden_size = min(min(w.shape) for w in weights)
+        self.model_bytes = _nbytes(model.parameters()) + _nbytes(model.buffers())
+
+    def sample_bytes(self):
+        """Returns the bytes of one cached sample of the block inputs."""
+        return self.seqlen * self.hidden_size * self.act_bytes
+
+    def train_activation_bytes(self, batch_size):
+        """Returns the activations of the forward of a wrapped block saved for the backward."""
+        attention = 2 * self.num_heads * self.seqlen * self.seqlen
+        ## the inputs of the layers, their qdq weights and the outputs of the non-linear ops
+        per_sample = self.seqlen * (self.block_stats["layer_features"] + 4 * self.hidden_size) + attention
+        return batch_size * per_sample * self.act_bytes
+
+    def infer_activation_bytes(self, batch_size):
+        """Returns the peak activations of a block forward without gradients."""
+        attention = 2 * self.num_heads * self.seqlen * self.seqlen
+        per_sample = self.seqlen * (2 * self.block_stats["max_features"] + 2 * self.hidden_size) + attention
+        return batch_size * per_sample * self.act_bytes
+
+    def cache_bytes(self):
+        """Returns the cached inputs, quantized inputs and outputs of a block."""
+        num_caches = 3 if self.enable_quanted_input else 2
+        return num_caches * self.nsamples * self.sample_bytes()
+
+    def estimate(self, batch_size, infer_bs_coeff=1, low_gpu_mem_usage=False, cache_on_disk=False):
+        """Estimates the peak memory of tuning a block in bytes.
+
+        Args:
+            batch_size (int): The tuning batch size.
+            infer_bs_coeff (int): The coefficient of the batch size of computing the block outputs.
+            low_gpu_mem_usage (bool): Whether the cached samples and the best parameters are kept on the cpu.
+            cache_on_disk (bool): Whether the cached samples are memory-mapped files on the disk.
+
+        Returns:
+            dict: The peak "device" and "host" memory and their breakdown.
+        """
+        weights = self.block_stats["weight_bytes"]
+        wrappers = self.block_stats["layer_numel"] * WRAPPER_BYTES_PER_WEIGHT
+        best_params = self.block_stats["layer_numel"] * 4
+        activations = max(self.train_activation_bytes(batch_size),
+                          self.infer_activation_bytes(batch_size * infer_bs_coeff))
+        cache = 0 if cache_on_disk else self.cache_bytes()
+        device = weights + wrappers + activations
+        host = wrappers + activations if self.on_cpu else 0
+        if self.on_cpu or low_gpu_mem_usage:
+            host += cache + best_params
+        else:
+            device += cache + best_params
+        return {
+            "weights": weights,
+            "wrappers": wrappers,
+            "activations": activations,
+            "cache": cache,
+            "device": int(device * MARGIN),
+            "host": psutil.Process().memory_info().rss + int(host * MARGIN),
+        }
+
+    def estimate_calibration(self, batch_size):
+        """Estimates the device memory of caching the inputs of the first block with the whole model on the device."""
+        return int((self.model_bytes + self.nsamples * self.sample_bytes() + self.infer_activation_bytes(batch_size))
+                   * MARGIN)
+
+    def plan(self, memory_budget, batch_size, gradient_accumulate_steps, low_gpu_mem_usage=False,
+             cache_on_disk=False, max_infer_bs_coeff=8):
+        """Picks the settings with the largest batches which fit the memory budget.
+
+        The number of samples of each step, batch_size * gradient_accumulate_steps, is kept. The cached samples are
+        kept on the device with the largest fitting batch size first, then offloaded to the cpu, then the batch size is
+        halved until one fits. The batch of computing the block outputs is enlarged as long as it fits.
+
+        Args:
+            memory_budget (int): The budget in bytes of the tuning device, or of the host memory when tuning on cpu.
+            batch_size (int): The requested tuning batch size.
+            gradient_accumulate_steps (int): The requested gradient accumulation steps.
+            low_gpu_mem_usage (bool): Whether the user requested the cached samples to be kept on the cpu.
+            cache_on_disk (bool): Whether the cached samples are memory-mapped files on the disk.
+            max_infer_bs_coeff (int): The upper bound of infer_bs_coeff.
+
+        Returns:
+            dict: The chosen settings, their estimated peak memory and whether they fit the budget.
+        """
+        total_batch_size = batch_size * gradient_accumulate_steps
+        batch_sizes = [bs for bs in range(batch_size, 0, -1) if total_batch_size % bs == 0]
+        ## offloading to the cpu does not save memory when tuning on the cpu
+        offload_options = [low_gpu_mem_usage] if low_gpu_mem_usage or self.on_cpu else [False, True]
+        peak_key = "host" if self.on_cpu else "device"
+
+        plan = None
+        for offload in offload_options:
+            for bs in batch_sizes:
+                estimation = self.estimate(bs, 1, offload, cache_on_disk)
+                if estimation[peak_key] <= memory_budget:
+                    plan = {"batch_size": bs, "low_gpu_mem_usage": offload}
+                    break
+            if plan is not None:
+                break
+        fits = plan is not None
+        if plan is None:
+            plan = {"batch_size": 1, "low_gpu_mem_usage": offload_options[-1]}
+
+        infer_bs_coeff = 1
+        while (infer_bs_coeff * 2 <= max_infer_bs_coeff and plan["batch_size"] * infer_bs_coeff * 2 <= self.nsamples
+               and self.estimate(plan["batch_size"], infer_bs_coeff * 2, plan["low_gpu_mem_usage"],
+                                 cache_on_disk)[peak_key] <= memory_budget):
+            infer_bs_coeff *= 2
+
+        plan["gradient_accumulate_steps"] = total_batch_size // plan["batch_size"]
+        plan["infer_bs_coeff"] = infer_bs_coeff
+        plan["cache_device"] = "cpu" if plan["low_gpu_mem_usage"] or cache_on_disk else str(self.device)
+        plan["calib_on_device"] = self.on_cpu or self.estimate_calibration(batch_size) <= memory_budget
+        plan["estimation"] = self.estimate(plan["batch_size"], infer_bs_coeff, plan["low_gpu_mem_usage"],
+                                           cache_on_disk)
+        plan["memory_budget"] = memory_budget
+        plan["fits"] = fits
+        return plan
+
+    @staticmethod
+    def log_plan(plan):
+        """Prints the plan."""
+        estimation = plan["estimation"]
+        logger.info(
+            f"memory plan for a budget of {plan['memory_budget'] / GB:.2f}GB: batch_size={plan['batch_size']}, "
+            f"gradient_accumulate_steps={plan['gradient_accumulate_steps']}, "
+            f"infer_bs_coeff={plan['infer_bs_coeff']}, cache_device={plan['cache_device']}, "
+            f"low_gpu_mem_usage={plan['low_gpu_mem_usage']}, "
+            f"calibration on {'the tuning device' if plan['calib_on_device'] else 'cpu'}; "
+            f"estimated peak device memory {estimation['device'] / GB:.2f}GB (weights {estimation['weights'] / GB:.2f}GB, "
+            f"tuning parameters {estimation['wrappers'] / GB:.2f}GB, activations {estimation['activations'] / GB:.2f}GB, "
+            f"cached samples {estimation['cache'] / GB:.2f}GB), estimated peak host RSS {estimation['host'] / GB:.2f}GB")
+        if not plan["fits"]:
+            logger.warning("no setting fits the memory budget, use the one with the lowest memory, "
+                           "consider setting disk_cache_dir or a smaller seqlen/nsamples")
@@ -33,6 +33,7 @@ from .template import get_template, Template
 from auto_round.special_model_handler import  SUPPORT_ONLY_TEXT_MODELS
 from .mllm_dataset import get_mllm_dataloader
 from ..low_cpu_mem.utils import get_layers_before_block
+from ..tensor_cache import DiskTensorList, ContiguousTensorList
 
 
 def _only_text_test(model, tokenizer, device, model_type):
@@ -384,8 +385,8 @@ class AutoRoundMLLM(AutoRound):
             max_len = (total_cnt // self.batch_size) * self.batch_size
             for k, v in self.inputs.items():
                 for key in v:
-                    if isinstance(v[key], list) and len(v[key]) == total_cnt:
-                        self.inputs[k][key] = v[key][:max_len]
+                    if isinstance(v[key], (list, DiskTensorList, ContiguousTensorList)) and len(v[key]) == total_cnt:
+                        del self.inputs[k][key][max_len:]
 
         # clean embed weight to save memory
         if self.low_cpu_mem_usage:
@@ -16,6 +16,8 @@ import torch
 from torch.functional import F
 import transformers
 from auto_round.data_type import get_quant_func
+from auto_round.data_type.fused import get_fused_quant_func
+from auto_round.data_type.utils import reshape_pad_tensor_by_group_size
 from .utils import (
     check_to_quantized,
     get_scale_shape,
@@ -56,9 +58,11 @@ class WrapperLinear(torch.nn.Module):
         enable_minmax_tuning (bool): Whether to enable min-max scale tuning.
         enable_norm_bias_tuning (bool): Whether to enable normalization and tuning of the bias term.
         device (str): Device on which to run computations (e.g., 'cpu' or 'cuda').
+        enable_fused_qdq (bool): Whether to use the fused quantize-dequantize kernels if the data type supports them.
     """
 
-    def __init__(self, orig_layer, enable_minmax_tuning=True, enable_norm_bias_tuning=False, device='cpu'):
+    def __init__(self, orig_layer, enable_minmax_tuning=True, enable_norm_bias_tuning=False, device='cpu',
+                 enable_fused_qdq=False):
         """Initializes the WrapperLinear module.
 
         Args:
@@ -66,6 +70,7 @@ class WrapperLinear(torch.nn.Module):
             enable_minmax_tuning (bool): Whether to enable min-max scale tuning.
             enable_norm_bias_tuning (bool): Whether to enable normalization and tuning for the bias term.
             device (str): The computation device, such as 'cpu' or 'cuda'.
+            enable_fused_qdq (bool): Whether to use the fused quantize-dequantize kernels if available.
         """
         super(WrapperLinear, self).__init__()
         self.orig_layer = orig_layer
@@ -75,6 +80,7 @@ class WrapperLinear(torch.nn.Module):
         self.enable_norm_bias_tuning = enable_norm_bias_tuning and (orig_layer.bias is not None)
         self.enable_act_quant = self.orig_layer.act_bits <= 8
         self.q_scale_thresh = 1e-5
+        self.enable_fused_qdq = enable_fused_qdq
         self._init_tuning_params_and_quant_func()
         self.orig_forward = self.linear_forward if isinstance(self.orig_layer, torch.nn.Linear) else self.conv1d_forward
 
@@ -91,7 +97,7 @@ class WrapperLinear(torch.nn.Module):
         orig_weight = getattr(orig_layer, "get_weight", lambda: orig_layer.weight)()
         if isinstance(self.orig_layer, transformers.modeling_utils.Conv1D):
             orig_weight = orig_weight.t()
-        weight_reshape = reshape_and_pad_tensor(orig_weight.data, orig_layer.group_size)
+        weight_reshape, orig_shape, pad_len = reshape_pad_tensor_by_group_size(orig_weight.data, orig_layer.group_size)
         self.weight_min = torch.clamp(weight_reshape.min(1)[0], max=0)
         self.weight_max = torch.clamp(weight_reshape.max(1)[0], min=0)
         self._init_params("value", p_dtype, weight_reshape.shape, 0, True)
@@ -102,6 +108,12 @@ class WrapperLinear(torch.nn.Module):
 
         self.weight_quant_func, self.data_type = get_quant_func(orig_layer.data_type, orig_layer.bits,
                                                                 orig_layer.sym)
+        if self.enable_fused_qdq and get_fused_quant_func(self.data_type) is not None:
+            self.weight_quant_func = get_fused_quant_func(self.data_type)
+        ## the weight never changes during tuning, so it is grouped and padded only once
+        self.reshaped_weight = None
+        if orig_layer.weight.device.type != "meta":
+            self.reshaped_weight = (weight_reshape, orig_shape, pad_len)
 
         if self.enable_act_quant:
             self.act_quant_func, self.act_data_type = get_quant_func(orig_layer.act_data_type,
@@ -158,7 +170,8 @@ class WrapperLinear(torch.nn.Module):
                                                      min_scale=min_scale, max_scale=max_scale,
                                                      scale_dtype=self.orig_layer.scale_dtype,
                                                      tensor_min=self.weight_min, tensor_max=self.weight_max,
-                                                     data_type=self.data_type, q_scale_thresh=self.q_scale_thresh)
+                                                     data_type=self.data_type, q_scale_thresh=self.q_scale_thresh,
+                                                     reshaped_tensor=self.reshaped_weight)
         weight_q = weight_q.to(weight.dtype)
         if isinstance(self.orig_layer, transformers.modeling_utils.Conv1D):
             weight_q = weight_q.t()
@@ -215,6 +228,7 @@ class WrapperLinear(torch.nn.Module):
             self.orig_layer.to(self.device)
         ##unwrapper weight
         qdq_weight, scale, zp = self._qdq_weight(v, min_scale, max_scale)
+        self.reshaped_weight = None  ## it may be a view of the weight, which is overwritten below
         self.orig_layer.weight.data.copy_(qdq_weight)
         self.orig_layer.weight.grad = None
 
@@ -451,12 +465,13 @@ class WrapperMultiblock(torch.nn.Module):
         return hidden_states
 
 
-def wrapper_block(block, enable_minmax_tuning, enable_norm_bias_tuning, device='cpu'):
+def wrapper_block(block, enable_minmax_tuning, enable_norm_bias_tuning, device='cpu', enable_fused_qdq=False):
     """Wraps the layers in the given block with a custom Wrapper module.
 
     Args:
         block: The input block containing linear and conv1d layers to be wrapped.
         enable_minmax_tuning: A boolean indicating whether min-max tuning is enabled.
+        enable_fused_qdq: A boolean indicating whether to use the fused quantize-dequantize kernels.
 
     Returns:
         list: A list of names of the wrapped layers and unwrapped layers.
@@ -469,7 +484,8 @@ def wrapper_block(block, enable_minmax_tuning, enable_norm_bias_tuning, device='
                 unquantized_layers.append(n)
                 continue
             new_m = WrapperLinear(m, enable_minmax_tuning=enable_minmax_tuning,
-                                  enable_norm_bias_tuning=enable_norm_bias_tuning, device=device)
+                                  enable_norm_bias_tuning=enable_norm_bias_tuning, device=device,
+                                  enable_fused_qdq=enable_fused_qdq)
             set_module(block, n, new_m)
             quantized_layers.append(n)
 
@@ -514,9 +530,7 @@ def unwrapper_block(block, best_params):
 
     Args:
     block: The input block containing wrapped modules to be unwrapped.
-    vs: A dictionary of scaling parameters for the wrapped modules.
-    min_scales: A dictionary of minimum scaling values for the wrapped modules.
-    max_scales: A dictionary of maximum scaling values for the wrapped modules.
+    best_params: The best tuning parameters of the wrapped modules by module name, a dict or a BestParamsStore.
     """
     for n, m in block.named_modules():
         if hasattr(m, "orig_layer"):
@@ -186,6 +186,18 @@ class BasicArgumentParser(argparse.ArgumentParser):
 
         self.add_argument("--device_map", default=None, type=str, help="device_map for block in tuning phase")
 
+        self.add_argument("--memory_budget", default=None, type=str,
+                          help="memory budget in GB of the tuning device or 'auto', batch_size, "
+                               "gradient_accumulate_steps and low_gpu_mem_usage are picked to fit it")
+
+        self.add_argument("--telemetry_dir", default=None, type=str,
+                          help="directory to write the time of the tuning phases, the peak memory and the "
+                               "throughput of each block to, as json lines and a chrome trace")
+
+        self.add_argument("--calib_cache_dir", default=None, type=str,
+                          help="directory to cache the tokenized calibration samples in, runs with the same "
+                               "tokenizer, dataset, seed, seqlen, nsamples and batch_size load them from it")
+
 
 class EvalArgumentParser(argparse.ArgumentParser):
 
@@ -535,7 +547,10 @@ def tune(args):
         enable_torch_compile=enable_torch_compile,
         act_data_type=args.act_data_type,
         act_dynamic=not args.disable_act_dynamic,
-        device_map=args.device_map)
+        device_map=args.device_map,
+        memory_budget=args.memory_budget,
+        telemetry_dir=args.telemetry_dir,
+        calib_cache_dir=args.calib_cache_dir)
     model, _ = autoround.quantize()
     model_name = args.model.rstrip("/")
     if args.low_cpu_mem_mode == 1 or args.low_cpu_mem_mode == 2:
@@ -172,7 +172,9 @@ class SignSGD(Optimizer):
         maximize (bool, optional): maximize the params based on the objective, instead of
             minimizing (default: False)
         foreach (bool, optional): whether foreach implementation of optimizer
-            is used (default: None)
+            is used, which updates the params of the same device and dtype with
+            one multi-tensor kernel each step (default: None, use foreach if all
+            the params are on cuda)
 
     Example:
         >>> # xdoctest: +SKIP
@@ -221,7 +223,7 @@ class SignSGD(Optimizer):
         *,
         maximize=False,
         foreach: Optional[bool] = None,
-        differentiable=False
+        differentiable=False,
     ):
         if lr is not required and lr < 0.0:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -320,7 +322,7 @@ def sgd(
     lr: float,
     dampening: float,
     nesterov: bool,
-    maximize: bool
+    maximize: bool,
 ):
     r"""Functional API that performs SGD algorithm computation.
 
@@ -328,16 +330,18 @@ def sgd(
     """
 
     if foreach is None:
-        # Placeholder for more complex foreach logic to be added when value is not set
-        foreach = False
+        # the sign update is elementwise, so foreach gives the same result with fewer kernel launches, while on cpu
+        # the foreach ops fall back to a slower per-tensor loop, as in torch.optim only cuda defaults to foreach
+        foreach = not torch.jit.is_scripting() and not has_sparse_grad and len(params) > 0 \
+                  and all(p.is_cuda for p in params)
 
     if foreach and torch.jit.is_scripting():
         raise RuntimeError("torch.jit.script not supported with foreach optimizers")
 
-    # if foreach and not torch.jit.is_scripting():
-    #     func = _multi_tensor_sgd
-    # else:
-    func = _single_tensor_sgd
+    if foreach and not torch.jit.is_scripting():
+        func = _multi_tensor_sgd
+    else:
+        func = _single_tensor_sgd
 
     func(
         params,
@@ -364,7 +368,7 @@ def _single_tensor_sgd(
     dampening: float,
     nesterov: bool,
     maximize: bool,
-    has_sparse_grad: bool
+    has_sparse_grad: bool,
 ):
     for i, param in enumerate(params):
         d_p = d_p_list[i] if not maximize else -d_p_list[i]
@@ -387,3 +391,60 @@ def _single_tensor_sgd(
                 d_p = buf
 
         param.add_(torch.sign(d_p), alpha=-lr)
+
+
+def _group_tensors_by_device_and_dtype(params, d_p_list):
+    """Groups the indices of the params by their device and dtype, the tensors of a foreach op must match."""
+    groups = {}
+    for i, (param, d_p) in enumerate(zip(params, d_p_list)):
+        groups.setdefault((param.device, param.dtype, d_p.dtype), []).append(i)
+    return groups.values()
+
+
+def _multi_tensor_sgd(
+    params: List[Tensor],
+    d_p_list: List[Tensor],
+    momentum_buffer_list: List[Optional[Tensor]],
+    *,
+    weight_decay: float,
+    momentum: float,
+    lr: float,
+    dampening: float,
+    nesterov: bool,
+    maximize: bool,
+    has_sparse_grad: bool,
+):
+    if len(params) == 0:
+        return
+    if has_sparse_grad:
+        raise RuntimeError("foreach SignSGD does not support sparse gradients")
+
+    for indices in _group_tensors_by_device_and_dtype(params, d_p_list):
+        device_params = [params[i] for i in indices]
+        device_grads = [d_p_list[i] for i in indices]
+
+        if maximize:
+            device_grads = torch._foreach_neg(device_grads)
+
+        if weight_decay != 0:
+            device_grads = torch._foreach_add(device_grads, device_params, alpha=weight_decay)
+
+        if momentum != 0:
+            bufs = [momentum_buffer_list[i] for i in indices]
+            if all(buf is not None for buf in bufs):
+                torch._foreach_mul_(bufs, momentum)
+                torch._foreach_add_(bufs, device_grads, alpha=1 - dampening)
+            else:
+                for j, i in enumerate(indices):
+                    if bufs[j] is None:
+                        bufs[j] = torch.clone(device_grads[j]).detach()
+                        momentum_buffer_list[i] = bufs[j]
+                    else:
+                        bufs[j].mul_(momentum).add_(device_grads[j], alpha=1 - dampening)
+
+            if nesterov:
+                device_grads = torch._foreach_add(device_grads, bufs, alpha=momentum)
+            else:
+                device_grads = bufs
+
+        torch._foreach_add_(device_params, torch._foreach_sign(device_grads), alpha=-lr)
@@ -0,0 +1,199 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Timers and memory statistics of the tuning, exported as JSON lines and as a Chrome trace."""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import psutil
+import torch
+
+from .compile_cache import synchronize
+
+GB = 1024 ** 3
+
+
+def _get_rank():
+    if torch.distributed.is_available() and torch.distributed.is_initialized() \
+            and torch.distributed.get_world_size() > 1:
+        return torch.distributed.get_rank()
+    return None
+
+
+class BlockStats(object):
+    """The phases, samples and peak RSS collected while tuning a block, shared by the threads tuning it."""
+
+    def __init__(self, name, rss):
+        self.name = name
+        self.phases = defaultdict(float)
+        self.samples = 0
+        self.peak_rss = rss
+
+
+class Telemetry(object):
+    """Records the time of the phases of the tuning and the peak memory and throughput of each block.
+
+    Each span is a Chrome trace event, the trace is written to trace.json and could be opened in chrome://tracing or
+    Perfetto. One JSON line is written to telemetry.jsonl per tuned block with the total time of its phases, its peak
+    RSS and device memory and its tuning throughput, and one per phase outside of the blocks, e.g. the calibration.
+    The device is synchronized at the boundaries of the spans to time the device work, which serializes the host and
+    the device, so the telemetry is only enabled on request.
+
+    The current block and the open spans are per thread. The spans of a worker thread are attributed to a block only
+    when the thread is attached to it, e.g. the threads tuning the layers of a block in parallel, so the outputs of
+    the next block computed by the pipeline worker are not counted in the block being tuned.
+
+    Args:
+        output_dir (str): The directory of the files, created if it does not exist. With several processes, the files
+                          are suffixed with the rank.
+        device: The device of the tuning.
+    """
+
+    def __init__(self, output_dir, device):
+        self.output_dir = output_dir
+        self.device = str(device)
+        os.makedirs(output_dir, exist_ok=True)
+        rank = _get_rank()
+        suffix = "" if rank is None else f"_rank{rank}"
+        self.jsonl_path = os.path.join(output_dir, f"telemetry{suffix}.jsonl")
+        self.trace_path = os.path.join(output_dir, f"trace{suffix}.json")
+        ## the records of a previous run in the same directory are dropped
+        open(self.jsonl_path, "w").close()
+        self.process = psutil.Process()
+        self.pid = os.getpid()
+        self.start_time = time.perf_counter()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _now_us(self):
+        return (time.perf_counter() - self.start_time) * 1e6
+
+    def _device_memory_allocated(self, peak=False):
+        if self.device.startswith("cuda"):
+            return torch.cuda.max_memory_allocated(self.device) if peak else torch.cuda.memory_allocated(self.device)
+        if self.device.startswith("hpu") and hasattr(torch, "hpu"):  # pragma: no cover
+            return torch.hpu.max_memory_allocated() if peak else torch.hpu.memory_allocated()
+        return None
+
+    def _reset_peak_device_memory(self):
+        if self.device.startswith("cuda"):
+            torch.cuda.reset_peak_memory_stats(self.device)
+        elif self.device.startswith("hpu") and hasattr(torch, "hpu"):  # pragma: no cover
+            torch.hpu.reset_peak_memory_stats()
+
+    def write(self, record):
+        """Appends a record to the JSON lines file."""
+        with self.lock, open(self.jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def current_block(self):
+        """Returns the BlockStats of the block the calling thread is tuning, or None."""
+        return getattr(self.local, "block", None)
+
+    @contextmanager
+    def attach(self, block_stats):
+        """Attributes the spans of the calling worker thread to the block of block_stats, see current_block."""
+        prev, self.local.block = self.current_block(), block_stats
+        try:
+            yield
+        finally:
+            self.local.block = prev
+
+    @contextmanager
+    def span(self, name, **args):
+        """Times the enclosed code as the phase name.
+
+        Args:
+            name (str): The name of the phase, e.g. "forward".
+            **args: Other fields of the trace event, also given to the spans nested in it on the same thread.
+        """
+        parent_args = getattr(self.local, "args", {})
+        args = self.local.args = dict(parent_args, **args)
+        synchronize(self.device)
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            synchronize(self.device)
+            end = self._now_us()
+            self.local.args = parent_args
+            block_stats = self.current_block()
+            if block_stats is not None:
+                args = dict(args, block=block_stats.name)
+                rss = self.process.memory_info().rss
+                with self.lock:
+                    block_stats.phases[name] += (end - start) / 1e6
+                    block_stats.peak_rss = max(block_stats.peak_rss, rss)
+            else:
+                self.write({"phase": name, "time": (end - start) / 1e6, "rss": self.process.memory_info().rss,
+                            **args})
+            with self.lock:
+                self.events.append({"name": name, "cat": "autoround", "ph": "X", "ts": start, "dur": end - start,
+                                    "pid": self.pid, "tid": threading.get_ident(), "args": args})
+
+    def add_samples(self, num_samples):
+        """Counts the samples processed by the tuning of the current block of the calling thread."""
+        block_stats = self.current_block()
+        if block_stats is not None:
+            with self.lock:
+                block_stats.samples += num_samples
+
+    @contextmanager
+    def block(self, block_name):
+        """Collects the phases, the peak memory and the throughput of tuning a block.
+
+        Args:
+            block_name (str): The name of the block.
+        """
+        self._reset_peak_device_memory()
+        block_stats = BlockStats(block_name, self.process.memory_info().rss)
+        start = self._now_us()
+        try:
+            with self.attach(block_stats):
+                yield
+        finally:
+            synchronize(self.device)
+            end = self._now_us()
+            elapsed = (end - start) / 1e6
+            block_stats.peak_rss = max(block_stats.peak_rss, self.process.memory_info().rss)
+            peak_device_memory = self._device_memory_allocated(peak=True)
+            phases = block_stats.phases
+            tuning_time = phases["forward"] + phases["backward"] + phases["step"]
+            record = {
+                "block": block_name,
+                "time": elapsed,
+                "phases": dict(phases),
+                "peak_rss": block_stats.peak_rss,
+                "peak_device_memory": peak_device_memory,
+                "samples": block_stats.samples,
+                "samples_per_sec": block_stats.samples / tuning_time if tuning_time > 0 else None,
+            }
+            self.write(record)
+            memory = {"rss_gb": block_stats.peak_rss / GB}
+            if peak_device_memory is not None:
+                memory["device_gb"] = peak_device_memory / GB
+            with self.lock:
+                self.events.append({"name": block_name, "cat": "block", "ph": "X", "ts": start, "dur": end - start,
+                                    "pid": self.pid, "tid": threading.get_ident(), "args": {}})
+                self.events.append({"name": "peak memory", "ph": "C", "ts": end, "pid": self.pid, "args": memory})
+
+    def dump_trace(self):
+        """Writes the Chrome trace of the spans recorded so far."""
+        with self.lock, open(self.trace_path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
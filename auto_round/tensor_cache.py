@@ -0,0 +1,257 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Containers for the calibration samples cached for block tuning."""
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+import torch
+
+ALIGNMENT = 64
+
+
+class DiskTensorList(object):
+    """A list-like container which spills the cached tensors to a memory-mapped file.
+
+    Each sample is stored at its own offset of one file, reading a sample returns a zero-copy tensor view of the
+    mapped file, so the host memory is only used by the samples that are really consumed, e.g. a mini-batch.
+    Elements that are not tensors are kept in memory as they are.
+
+    Args:
+        cache_dir (str): The directory to create the backing file in.
+        prefix (str): The prefix of the backing file name.
+    """
+
+    def __init__(self, cache_dir, prefix="cache"):
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=".bin", dir=cache_dir)
+        self._file = os.fdopen(fd, "r+b")
+        self._size = 0
+        self._mmap = None
+        ## each entry is either (offset, nbytes, shape, dtype) for tensors or ("obj", value) for others
+        self._entries = []
+
+    def _write(self, tensor):
+        tensor = tensor.detach().to("cpu").contiguous()
+        data = tensor.reshape(-1).view(torch.uint8).numpy()
+        offset = (self._size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        self._file.seek(offset)
+        self._file.write(data.tobytes())
+        self._size = offset + data.nbytes
+        return (offset, data.nbytes, tuple(tensor.shape), tensor.dtype)
+
+    def _read(self, entry):
+        if entry[0] == "obj":
+            return entry[1]
+        offset, nbytes, shape, dtype = entry
+        if nbytes == 0:
+            return torch.empty(shape, dtype=dtype)
+        if self._mmap is None or self._mmap.shape[0] < offset + nbytes:
+            self._file.flush()
+            self._mmap = np.memmap(self.path, dtype=np.uint8, mode="r+", shape=(self._size,))
+        return torch.from_numpy(self._mmap[offset: offset + nbytes]).view(dtype).reshape(shape)
+
+    def _to_entry(self, value):
+        if isinstance(value, torch.Tensor):
+            return self._write(value)
+        return ("obj", value)
+
+    def append(self, value):
+        self._entries.append(self._to_entry(value))
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._read(entry) for entry in self._entries[index]]
+        return self._read(self._entries[index])
+
+    def __setitem__(self, index, value):
+        entry = self._entries[index]
+        ## rewrite the sample in place if it fits, e.g. casting between float16 and bfloat16
+        if isinstance(value, torch.Tensor) and entry[0] != "obj" and entry[1] == value.numel() * value.element_size():
+            if value.numel() > 0:
+                self._read(entry)  ## make sure the sample has been mapped
+                data = value.detach().to("cpu").contiguous().reshape(-1).view(torch.uint8).numpy()
+                self._mmap[entry[0]: entry[0] + entry[1]] = data
+            self._entries[index] = (entry[0], entry[1], tuple(value.shape), value.dtype)
+        else:
+            self._entries[index] = self._to_entry(value)
+
+    def __delitem__(self, index):
+        del self._entries[index]
+
+    def __iter__(self):
+        for entry in self._entries:
+            yield self._read(entry)
+
+    def gather(self, indices, dim=0):
+        """Concatenates the samples at the given indices along dim."""
+        return torch.cat([self[int(i)] for i in indices], dim=dim)
+
+    def close(self):
+        """Releases the samples and removes the backing file."""
+        self._entries = []
+        self._mmap = None
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:  # pragma: no cover
+            pass
+
+
+class ContiguousTensorList(object):
+    """A list-like container which keeps same-shaped samples in one preallocated contiguous tensor.
+
+    Samples are concatenated along dim, so a mini-batch is built with a single index_select into a buffer which
+    is reused across calls instead of a Python list comprehension and torch.cat. If a sample does not match the
+    shape or dtype of the others, or is not a tensor, the container falls back to a plain list.
+
+    Args:
+        dim (int): The dimension to concatenate the samples along.
+        capacity (int): The number of samples to preallocate, grown on demand (default is None, grown from 1).
+        pin_memory (bool): Whether to pin the gather buffers of CPU samples to speed up host-to-device copies.
+    """
+
+    def __init__(self, dim=0, capacity=None, pin_memory=False):
+        self.dim = dim
+        self.capacity = capacity
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.data = None
+        self._size = 0
+        self._list = None
+        ## the gather buffers are per thread, as outputs may be read concurrently in pipelined tuning
+        self._buffers = threading.local()
+
+    def _fallback(self):
+        self._list = [self[i] for i in range(self._size)]
+        self.data = None
+        self._size = 0
+
+    def _grow(self, sample):
+        capacity = self.data.shape[self.dim] if self.data is not None else self.capacity or 1
+        while capacity < self._size + 1:
+            capacity *= 2
+        shape = list(sample.shape)
+        shape[self.dim] = capacity
+        data = torch.empty(shape, dtype=sample.dtype, device=sample.device)
+        if self._size > 0:
+            data.narrow(self.dim, 0, self._size).copy_(self.data.narrow(self.dim, 0, self._size))
+        self.data = data
+
+    def _fits(self, sample):
+        if not isinstance(sample, torch.Tensor) or sample.dim() <= self.dim or sample.shape[self.dim] != 1:
+            return False
+        if self.data is None:
+            return True
+        return (sample.dtype == self.data.dtype and sample.device == self.data.device
+                and sample.shape[:self.dim] == self.data.shape[:self.dim]
+                and sample.shape[self.dim + 1:] == self.data.shape[self.dim + 1:])
+
+    def append(self, sample):
+        if self._list is None and not self._fits(sample):
+            self._fallback()
+        if self._list is not None:
+            self._list.append(sample)
+            return
+        if self.data is None or self.data.shape[self.dim] < self._size + 1:
+            self._grow(sample)
+        self.data.narrow(self.dim, self._size, 1).copy_(sample)
+        self._size += 1
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def __len__(self):
+        return len(self._list) if self._list is not None else self._size
+
+    def __getitem__(self, index):
+        if self._list is not None:
+            return self._list[index]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._size))]
+        index = int(index)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("index out of range")
+        return self.data.narrow(self.dim, index, 1)
+
+    def __setitem__(self, index, sample):
+        if self._list is None and self._fits(sample):
+            self[index].copy_(sample)
+            return
+        if self._list is None:
+            self._fallback()
+        self._list[index] = sample
+
+    def __delitem__(self, index):
+        if self._list is None:
+            self._fallback()
+        del self._list[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def gather(self, indices, dim=None, slot=0):
+        """Concatenates the samples at the given indices along the dim of the container.
+
+        The result is written into a buffer reused by the next call of the same thread and slot, so it must be
+        consumed or copied before that.
+        """
+        dim = self.dim if dim is None else dim
+        if self._list is not None or dim != self.dim:
+            return torch.cat([self[int(i)] for i in indices], dim=dim)
+        indices = torch.as_tensor(indices, dtype=torch.long, device=self.data.device)
+        shape = list(self.data.shape)
+        shape[self.dim] = len(indices)
+        if not hasattr(self._buffers, "slots"):
+            self._buffers.slots = {}
+        buffer = self._buffers.slots.get(slot, None)
+        if buffer is None or list(buffer.shape) != shape or buffer.dtype != self.data.dtype:
+            pin_memory = self.pin_memory and self.data.device.type == "cpu"
+            buffer = torch.empty(shape, dtype=self.data.dtype, device=self.data.device, pin_memory=pin_memory)
+            self._buffers.slots[slot] = buffer
+        return torch.index_select(self.data, self.dim, indices, out=buffer)
+
+    def to(self, *args, **kwargs):
+        """Casts or moves the samples in place and returns the container itself."""
+        if self._list is not None:
+            self._list = [sample.to(*args, **kwargs) if isinstance(sample, torch.Tensor) else sample
+                          for sample in self._list]
+        elif self.data is not None:
+            self.data = self.data.narrow(self.dim, 0, self._size).to(*args, **kwargs)
+            self._buffers = threading.local()
+        return self
+
+    def clear(self):
+        """Releases the samples and the gather buffers."""
+        self.data = None
+        self._size = 0
+        self._list = None
+        self._buffers = threading.local()
@@ -31,6 +31,7 @@ from functools import lru_cache
 from packaging import version
 import gc
 from .special_model_handler import shareable_keywords, SPECIAL_MULTIMODAL_BLOCK
+from .tensor_cache import DiskTensorList, ContiguousTensorList
 
 
 @lru_cache(None)
@@ -185,12 +186,13 @@ def unsupport_meta_device(model):
     return False
 
 
-def to_device(input, device=torch.device("cpu")):
+def to_device(input, device=torch.device("cpu"), non_blocking=False):
     """Moves input data to the specified device.
 
     Args:
     input: The input data to be moved.
     device: The target device.
+    non_blocking: Whether to copy tensors asynchronously with respect to the host if possible.
 
     Returns:
     The input data on the specified device.
@@ -198,17 +200,21 @@ def to_device(input, device=torch.device("cpu")):
     if input is None:
         return None
     if isinstance(input, torch.Tensor):
+        return input.to(device, non_blocking=non_blocking)
+    if isinstance(input, DiskTensorList) and torch.device(device).type == "cpu":
+        return input
+    if isinstance(input, ContiguousTensorList):
         return input.to(device)
     if isinstance(input, dict) or isinstance(input, UserDict):
         for inp in input.keys():
-            input[inp] = to_device(input[inp], device)
+            input[inp] = to_device(input[inp], device, non_blocking)
 
-    elif isinstance(input, list) or isinstance(input, tuple):
+    elif isinstance(input, (list, tuple, DiskTensorList)):
         if len(input) == 0:
             return input
         input_res = []
         for inp in input:
-            input_res.append(to_device(inp, device))
+            input_res.append(to_device(inp, device, non_blocking))
         if isinstance(input, tuple):
             input_res = tuple(input_res)
         input = input_res
@@ -253,6 +259,12 @@ def to_dtype(input, dtype=torch.float32):
         return None
     if isinstance(input, torch.Tensor):
         return input.to(dtype)
+    if isinstance(input, ContiguousTensorList):
+        return input.to(dtype)
+    if isinstance(input, DiskTensorList):
+        for i in range(len(input)):
+            input[i] = to_dtype(input[i], dtype)
+        return input
     if isinstance(input, dict) or isinstance(input, UserDict):
         for inp in input.keys():
             input[inp] = to_dtype(input[inp], dtype)
@@ -430,24 +442,107 @@ def collect_best_params(block):
     return params
 
 
+class BestParamsStore(object):
+    """Keeps a snapshot of the tuning parameters of the wrapped layers of a block in buffers allocated once.
+
+    `update` copies the parameters into the buffers in place where a device-side condition holds, e.g. the loss
+    improved, so the best parameters are tracked without synchronizing with the host. The store is read like the
+    nested dict of collect_best_params, {layer name: {param name: tensor}}, and is empty before the first snapshot,
+    so it could be passed to unwrapper_block directly.
+
+    Args:
+        block: The block whose wrapped layers are tuned.
+        device: The device of the buffers, e.g. "cpu" to save device memory for blocks with many layers, where the
+                buffers are pinned if CUDA is available (default is None, on the device of each parameter).
+                Updating host buffers synchronizes on the condition and copies asynchronously.
+    """
+
+    def __init__(self, block, device=None):
+        self.device = torch.device(device) if device is not None else None
+        pin_memory = self.device is not None and self.device.type == "cpu" and torch.cuda.is_available()
+        self.params = {}
+        self.buffers = {}
+        for n, m in block.named_modules():
+            if hasattr(m, "orig_layer"):
+                self.params[n] = m.params
+                self.buffers[n] = {
+                    key: torch.empty(value.shape, dtype=value.dtype, device=self.device or value.device,
+                                     pin_memory=pin_memory and value.device.type != "cpu")
+                    for key, value in m.params.items()
+                }
+        ## False before the first snapshot, a boolean tensor after conditional updates on the device
+        self.valid = False
+
+    @torch.no_grad()
+    def update(self, condition=None):
+        """Snapshots the parameters if condition, a boolean tensor, is True or None."""
+        if self.device is not None:
+            if condition is not None and not bool(condition):
+                return
+            condition = None
+        for n, params in self.params.items():
+            for key, value in params.items():
+                buffer = self.buffers[n][key]
+                if condition is None:
+                    buffer.copy_(value.data, non_blocking=buffer.is_pinned())
+                else:
+                    torch.where(condition.to(buffer.device), value.data, buffer, out=buffer)
+        self.valid = True if condition is None else condition | self.valid
+
+    def keys(self):
+        return self.buffers.keys() if bool(self.valid) else {}.keys()
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.buffers[name]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+
 @torch.no_grad()
+def gather_samples(samples, indices, dim=0, slot=0):
+    """Concatenates the cached samples at the given indices.
+
+    Args:
+    samples: The list of cached samples, or a ContiguousTensorList/DiskTensorList.
+    indices: The indices to sample.
+    dim: The dimension to concatenate the samples along.
+    slot: The gather buffer to use for a ContiguousTensorList.
+
+    Returns:
+    The concatenated samples.
+    """
+    if isinstance(samples, ContiguousTensorList):
+        return samples.gather(indices, dim, slot=slot)
+    if isinstance(samples, DiskTensorList):
+        return samples.gather(indices, dim)
+    return torch.cat([samples[i] for i in indices], dim=dim)
+
+
 def sampling_inputs(input_ids, input_others, indices, seqlen,
-                    batch_dim=0):
+                    batch_dim=0, slot=0):
     """Samples inputs based on the given indices and sequence length.
 
+    Tensors of the shareable keywords, e.g. position ids, are shared by all the samples and passed through as they are.
+
     Args:
     input_ids: The list of input tensor containing  input_ids.
     input_others: A dictionary containing other input data.
     indices: The indices to sample from the input.
     seqlen: The sequence length.
+    batch_dim: The batch dimension of input_ids.
+    slot: The gather buffer to use, mini-batches in different slots could be alive at the same time.
 
     Returns:
     current_input_ids: The sampled input IDs.
     current_input_others: The sampled other input data.
     """
-    current_input_ids = [input_ids[i] for i in indices]
-
-    current_input_ids = torch.cat(current_input_ids, dim=batch_dim)
+    current_input_ids = gather_samples(input_ids, indices, dim=batch_dim, slot=slot)
 
     current_input_others = {"positional_inputs": input_others["positional_inputs"]}
     for key in input_others.keys():
@@ -457,13 +552,13 @@ def sampling_inputs(input_ids, input_others, indices, seqlen,
                 and not isinstance(input_others[key], (str, bool, type(None))):
             current_input_others[key] = None
             if input_others[key] is not None:
-                current_input_others[key] = [input_others[key][i] for i in indices]
                 if len(indices) == 1:
-                    current_input_others[key] = current_input_others[key][0]
+                    current_input_others[key] = input_others[key][indices[0]]
                 else:
                     try:
-                        current_input_others[key] = torch.cat(current_input_others[key], dim=0)
+                        current_input_others[key] = gather_samples(input_others[key], indices, dim=0, slot=slot)
                     except TypeError as err:
+                        current_input_others[key] = [input_others[key][i] for i in indices]
                         logger.warning_once("Please check the model cache inputs or try setting batch_size to 1.")
         else:
             current_input_others[key] = input_others[key]
@@ -591,6 +686,176 @@ def detect_device(device=None):
     return device
 
 
+class BatchPrefetcher(object):
+    """Double-buffered prefetcher which stages the next mini-batch on the tuning device.
+
+    On CUDA the copies are issued on a side stream, so they overlap with the forward/backward of the current
+    mini-batch. The mini-batches are loaded into two alternating gather slots, a slot is only reused once the copy
+    from it has finished.
+
+    Args:
+        load_func: A function mapping (indices, slot) to the mini-batch on the cache device.
+        device: The device to stage the mini-batches on.
+    """
+
+    def __init__(self, load_func, device):
+        self.load_func = load_func
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        self.events = [None, None]
+        self.slot = 0
+        self.staged = None
+
+    def prefetch(self, indices):
+        """Starts loading the mini-batch of the given indices."""
+        slot = self.slot
+        self.slot ^= 1
+        if self.events[slot] is not None:
+            self.events[slot].synchronize()
+        batch = self.load_func(indices, slot)
+        if self.stream is None:
+            batch = to_device(batch, self.device)
+        else:
+            with torch.cuda.stream(self.stream):
+                batch = to_device(batch, self.device, non_blocking=True)
+                self.events[slot] = torch.cuda.Event()
+                self.events[slot].record(self.stream)
+        self.staged = (indices, batch)
+
+    def _record_stream(self, input):
+        if isinstance(input, torch.Tensor):
+            if input.device.type == "cuda":
+                input.record_stream(torch.cuda.current_stream(self.device))
+        elif isinstance(input, (list, tuple)):
+            for inp in input:
+                self._record_stream(inp)
+        elif isinstance(input, dict):
+            for inp in input.values():
+                self._record_stream(inp)
+
+    def get(self, indices):
+        """Returns the mini-batch of the given indices, which is loaded right now if it has not been staged."""
+        if self.staged is None or not torch.equal(self.staged[0], indices):
+            self.prefetch(indices)
+        batch = self.staged[1]
+        self.staged = None
+        if self.stream is not None:
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+            self._record_stream(batch)
+        return batch
+
+
+def get_data_parallel_info():
+    """Returns the (rank, world_size) of the initialized torch.distributed process group, or None."""
+    if not torch.distributed.is_available() or not torch.distributed.is_initialized():
+        return None
+    return torch.distributed.get_rank(), torch.distributed.get_world_size()
+
+
+def shard_indices(indices, rank, world_size):
+    """Returns the shard of the sample indices processed by the given data-parallel rank."""
+    return torch.tensor_split(indices, world_size)[rank]
+
+
+def all_reduce_value(value, world_size, average=True, device="cpu"):
+    """Sums or averages a python number or a scalar tensor across the data-parallel processes.
+
+    A tensor is reduced on its own device and returned as a tensor, without synchronizing with the host.
+    """
+    if isinstance(value, torch.Tensor):
+        tensor = value.detach().clone()
+        torch.distributed.all_reduce(tensor)
+        return tensor / world_size if average else tensor
+    tensor = torch.tensor([value], dtype=torch.float64, device=device)
+    torch.distributed.all_reduce(tensor)
+    return tensor.item() / world_size if average else tensor.item()
+
+
+def all_reduce_grads(params, world_size, average=True):
+    """Sums or averages the gradients of the parameters across the data-parallel processes in one all-reduce.
+
+    Parameters without a gradient, e.g. on a process with an empty shard, contribute zeros.
+    """
+    grads = [p.grad if p.grad is not None else torch.zeros_like(p) for p in params]
+    if len(grads) == 0:
+        return
+    flat_grads = torch.cat([grad.reshape(-1).to(torch.float32) for grad in grads])
+    torch.distributed.all_reduce(flat_grads)
+    if average:
+        flat_grads /= world_size
+    offset = 0
+    for p, grad in zip(params, grads):
+        numel = grad.numel()
+        p.grad = flat_grads[offset: offset + numel].view_as(grad).to(grad.dtype)
+        offset += numel
+
+
+BROADCAST_MODULE_ATTRS = ("scale", "zp", "act_max", "q_scale_thresh", "data_type", "act_data_type", "act_quant_func")
+
+
+@torch.no_grad()
+def broadcast_module(module, src):
+    """Copies the tuned module of the src process into the same module of all the other processes in place.
+
+    The quantization attributes set by the unwrapper and the activation wrappers are sent as one small object,
+    then the parameters, buffers and quantized tensors are flattened by dtype and sent with one broadcast each,
+    as all_reduce_grads does for the gradients.
+    """
+    from .quantizer import WrapperWALayer
+
+    is_src = torch.distributed.get_rank() == src
+    info = [None]
+    if is_src:
+        wrapped, attrs = [], {}
+        for n, m in module.named_modules():
+            if isinstance(m, WrapperWALayer):
+                wrapped.append(n)
+            for key in BROADCAST_MODULE_ATTRS:
+                if key not in m.__dict__:
+                    continue
+                value = m.__dict__[key]
+                if isinstance(value, torch.Tensor):
+                    value = (value.shape, value.dtype, str(value.device))
+                attrs.setdefault(n, {})[key] = value
+        info = [{"wrapped": wrapped, "attrs": attrs}]
+    torch.distributed.broadcast_object_list(info, src=src)
+    wrapped, attrs = info[0]["wrapped"], info[0]["attrs"]
+
+    if not is_src:
+        for n in wrapped:
+            layer = get_module(module, n)
+            layer.act_quant_func = attrs[f"{n}.orig_layer"]["act_quant_func"]
+            set_module(module, n, WrapperWALayer(layer))
+    tensors = list(module.state_dict().values())
+    for n, m in module.named_modules():
+        for key, value in attrs.get(n, {}).items():
+            if isinstance(value, tuple):
+                if not is_src:
+                    shape, dtype, device = value
+                    setattr(m, key, torch.empty(shape, dtype=dtype, device=device))
+                tensors.append(getattr(m, key))
+            elif not is_src:
+                setattr(m, key, value)
+
+    device = torch.device("cpu")
+    if torch.distributed.get_backend() == "nccl":
+        device = torch.device("cuda", torch.cuda.current_device())
+    by_dtype = {}
+    for tensor in tensors:
+        by_dtype.setdefault(tensor.dtype, []).append(tensor)
+    for group in by_dtype.values():
+        flat = torch.cat([tensor.reshape(-1).to(device) for tensor in group])
+        torch.distributed.broadcast(flat, src=src)
+        if is_src:
+            continue
+        offset = 0
+        for tensor in group:
+            numel = tensor.numel()
+            tensor.copy_(flat[offset: offset + numel].view_as(tensor))
+            offset += numel
+    return module
+
+
 class CpuInfo(object):
     """Get CPU Info."""
 
@@ -947,6 +1212,10 @@ def _clear_memory_for_cpu_and_cuda(tensor=None):
     if isinstance(tensor, list):
         for i in range(len(tensor)):
             tensor[i] = None
+    if isinstance(tensor, DiskTensorList):
+        tensor.close()
+    if isinstance(tensor, ContiguousTensorList):
+        tensor.clear()
     if tensor is not None:
         del tensor
     gc.collect()
@@ -961,6 +1230,17 @@ def clear_memory(tensor=None):
         _clear_memory_for_cpu_and_cuda(tensor)
 
 
+def is_oom_error(e):
+    """Returns whether the exception is an out-of-memory error raised by a device or host allocator."""
+    if hasattr(torch.cuda, "OutOfMemoryError") and isinstance(e, torch.cuda.OutOfMemoryError):
+        return True
+    if not isinstance(e, RuntimeError):
+        return False
+    message = str(e)
+    return ("CUDA out of memory" in message or "CUDA error: out of memory" in message
+            or "MODULE:PT_DEVMEM" in message or "DefaultCPUAllocator: can't allocate memory" in message)
+
+
 def compare_versions(v1, v2):
     return version.parse(v1) >= version.parse(v2)
 
@@ -0,0 +1,60 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""CPU benchmarks of the tuning hot path on randomly initialized models, see `python -m benchmarks --help`."""
+
+import os
+import platform
+
+import torch
+import transformers
+
+
+def get_environment():
+    """Returns the versions and the hardware the results were measured with."""
+    from auto_round.version import __version__
+
+    return {
+        "auto_round": __version__,
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "python": platform.python_version(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Compares the medians of the results with the ones of a baseline.
+
+    Args:
+        results (dict): The results by benchmark name.
+        baseline (dict): The results of the baseline by benchmark name.
+        tolerance (float): The relative slowdown reported as a regression.
+
+    Returns:
+        dict: The baseline and current medians, their ratio and whether it regressed, for the benchmarks timed in both.
+    """
+    comparison = {}
+    for name, result in results.items():
+        if "median" not in result or "median" not in baseline.get(name, {}):
+            continue
+        ratio = result["median"] / baseline[name]["median"]
+        comparison[name] = {
+            "baseline": baseline[name]["median"],
+            "current": result["median"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance,
+        }
+    return comparison
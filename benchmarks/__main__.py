@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs the CPU benchmarks, e.g.
+
+    python -m benchmarks --sizes tiny --output results.json --baseline baseline.json
+"""
+
+import argparse
+import json
+import sys
+
+from auto_round.utils import logger
+
+from . import compare, get_environment
+from .models import FAMILIES, SIZES
+from .phases import DATA_TYPES, FORMATS, PHASES, run_phases
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CPU benchmarks of the tuning hot path on synthetic models")
+    parser.add_argument("--phases", nargs="+", default=list(PHASES), choices=list(PHASES), help="phases to time")
+    parser.add_argument("--families", nargs="+", default=FAMILIES, choices=FAMILIES, help="model architectures")
+    parser.add_argument("--sizes", nargs="+", default=["tiny"], choices=list(SIZES), help="model sizes")
+    parser.add_argument("--data_types", nargs="+", default=list(DATA_TYPES), choices=list(DATA_TYPES),
+                        help="data types of the wrapper_linear phase")
+    parser.add_argument("--formats", nargs="+", default=FORMATS, help="export formats of the save_quantized phase")
+    parser.add_argument("--iters", default=10, type=int, help="iterations of the quant_block phase")
+    parser.add_argument("--seqlen", default=128, type=int, help="sequence length of the calibration samples")
+    parser.add_argument("--nsamples", default=16, type=int, help="number of calibration samples")
+    parser.add_argument("--batch_size", default=8, type=int, help="tuning batch size")
+    parser.add_argument("--device", default="cpu", type=str, help="device of the tuning, e.g. cuda:0")
+    parser.add_argument("--pipeline_device", default=None, type=str,
+                        help="second device of the pipeline phase, e.g. cuda:1, the phase is skipped without it")
+    parser.add_argument("--repeat", default=3, type=int, help="timed repeats of each benchmark")
+    parser.add_argument("--output", default=None, type=str, help="json file to write the results to")
+    parser.add_argument("--baseline", default=None, type=str, help="results of a previous run to compare to")
+    parser.add_argument("--tolerance", default=0.1, type=float,
+                        help="relative slowdown of the median over the baseline reported as a regression")
+    parser.add_argument("--fail_on_regression", action="store_true", help="exit with 1 if a benchmark regressed")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {"environment": get_environment(), "config": vars(args), "results": run_phases(args)}
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["comparison"] = compare(report["results"], baseline["results"], args.tolerance)
+        regressions = [name for name, item in report["comparison"].items() if item["regression"]]
+        for name, item in report["comparison"].items():
+            logger.info(f"{name}: {item['baseline']:.4f}s -> {item['current']:.4f}s ({item['ratio']:.2f}x)")
+        if regressions:
+            logger.warning(f"regressions over {args.tolerance:.0%}: {regressions}")
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Randomly initialized models of the supported architectures, built from configs without any download."""
+
+import torch
+import transformers
+
+VOCAB_SIZE = 1024
+
+SIZES = {
+    "tiny": {"hidden_size": 64, "intermediate_size": 128, "num_hidden_layers": 2, "num_attention_heads": 4},
+    "medium": {"hidden_size": 512, "intermediate_size": 1376, "num_hidden_layers": 4, "num_attention_heads": 8},
+}
+
+FAMILIES = ["llama", "opt", "qwen"]
+
+
+def get_config(family, size):
+    """Returns the transformers config of a synthetic model.
+
+    Args:
+        family (str): "llama", "opt" or "qwen".
+        size (str): "tiny" or "medium".
+    """
+    shape = SIZES[size]
+    if family == "llama":
+        return transformers.LlamaConfig(
+            vocab_size=VOCAB_SIZE, hidden_size=shape["hidden_size"], intermediate_size=shape["intermediate_size"],
+            num_hidden_layers=shape["num_hidden_layers"], num_attention_heads=shape["num_attention_heads"],
+            num_key_value_heads=shape["num_attention_heads"], max_position_embeddings=2048)
+    if family == "qwen":
+        ## grouped-query attention with bias in the qkv projections
+        return transformers.Qwen2Config(
+            vocab_size=VOCAB_SIZE, hidden_size=shape["hidden_size"], intermediate_size=shape["intermediate_size"],
+            num_hidden_layers=shape["num_hidden_layers"], num_attention_heads=shape["num_attention_heads"],
+            num_key_value_heads=max(shape["num_attention_heads"] // 4, 1), max_position_embeddings=2048)
+    if family == "opt":
+        return transformers.OPTConfig(
+            vocab_size=VOCAB_SIZE, hidden_size=shape["hidden_size"], ffn_dim=shape["intermediate_size"],
+            num_hidden_layers=shape["num_hidden_layers"], num_attention_heads=shape["num_attention_heads"],
+            word_embed_proj_dim=shape["hidden_size"], max_position_embeddings=2048)
+    raise ValueError(f"unknown model family {family}, should be one of {FAMILIES}")
+
+
+def build_model(family, size, seed=0):
+    """Builds a randomly initialized causal LM in float32."""
+    torch.manual_seed(seed)
+    config = get_config(family, size)
+    model = transformers.AutoModelForCausalLM.from_config(config, torch_dtype=torch.float32)
+    return model.eval()
+
+
+class SyntheticDataLoader:
+    """Yields random token ids as the calibration dataset of AutoRound."""
+
+    def __init__(self, nsamples, seqlen, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        self.data = [torch.randint(0, VOCAB_SIZE, (1, seqlen), generator=generator) for _ in range(nsamples)]
+        self.batch_size = 1
+
+    def __iter__(self):
+        for input_ids in self.data:
+            yield input_ids
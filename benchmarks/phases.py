@@ -0,0 +1,246 @@
+# Copyright (c) 2024 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The timed phases of the tuning and the export, each a generator of (name, result) pairs."""
+
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import torch
+
+from auto_round import AutoRound
+from auto_round.quantizer import WrapperLinear
+from auto_round.utils import logger
+
+from .models import SIZES, SyntheticDataLoader, build_model
+
+DATA_TYPES = {
+    "int": {"data_type": "int", "bits": 4, "group_size": 32, "sym": True},
+    "mx_fp": {"data_type": "mx_fp", "bits": 4, "group_size": 32, "sym": True},
+    "fp8": {"data_type": "fp8", "bits": 8, "group_size": -1, "sym": True},
+}
+
+FORMATS = ["auto_round", "auto_gptq", "auto_awq", "itrex"]
+
+
+def measure(func, repeat=3, warmup=1, setup=None):
+    """Times func and returns the median and the minimum of the repeats in seconds.
+
+    Args:
+        func: The function to time, called with the outputs of setup.
+        repeat (int): The number of timed calls.
+        warmup (int): The number of calls before the timed ones.
+        setup: A function returning the arguments of func, called before each call and not timed.
+    """
+    times = []
+    for i in range(warmup + repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    return {"median": statistics.median(times), "min": min(times), "repeat": repeat}
+
+
+def get_autoround(model, args, **kwargs):
+    """Returns the AutoRound of a synthetic model with the benchmark settings."""
+    return AutoRound(
+        model,
+        None,
+        bits=4,
+        group_size=32,
+        sym=True,
+        iters=kwargs.pop("iters", args.iters),
+        seqlen=args.seqlen,
+        nsamples=args.nsamples,
+        batch_size=min(args.batch_size, args.nsamples),
+        dataset=SyntheticDataLoader(args.nsamples, args.seqlen),
+        amp=False,
+        device=args.device,
+        **kwargs,
+    )
+
+
+def get_first_block_names(autoround):
+    return [block_names[0] for block_names in autoround.quant_block_list]
+
+
+def bench_cache_inter_data(args):
+    """Times the calibration forward which caches the inputs of the first block."""
+    for family in args.families:
+        for size in args.sizes:
+            autoround = get_autoround(build_model(family, size), args)
+            block_names = get_first_block_names(autoround)
+            yield f"cache_inter_data/{family}-{size}", measure(
+                lambda: autoround.cache_inter_data(block_names, args.nsamples), args.repeat)
+
+
+def bench_quant_block(args):
+    """Times the tuning of the first block, including its unquantized and quantized outputs, at fixed iters."""
+    for family in args.families:
+        for size in args.sizes:
+            autoround = get_autoround(build_model(family, size), args)
+            block_name = get_first_block_names(autoround)[0]
+            all_inputs = autoround.cache_inter_data([block_name], args.nsamples)
+
+            def setup():
+                return (autoround.get_block_inputs({block_name: dict(all_inputs[block_name])}, block_name),)
+
+            def quant_block(inputs):
+                autoround.quant_blocks(autoround.model, inputs, [block_name], device=args.device)
+
+            yield f"quant_block/{family}-{size}/iters{args.iters}", measure(quant_block, args.repeat, setup=setup)
+
+
+def bench_pipeline(args):
+    """Times the sequential tuning of all the blocks with nblocks=1 on --device and the same tuning with
+    --pipeline_device computing the unquantized outputs of the next block, and reports the speedup.
+
+    The pipeline only overlaps work on two devices, so the phase is skipped without a --pipeline_device other than
+    --device, e.g. on CPU only.
+    """
+    devices = [torch.device(args.device), torch.device(args.pipeline_device or args.device)]
+    ## all the cpu devices share the same cores
+    same_device = devices[0] == devices[1] or all(device.type == "cpu" for device in devices)
+    for family in args.families:
+        for size in args.sizes:
+            if same_device:
+                yield f"pipeline/{family}-{size}", {"skipped": "requires a --pipeline_device other than --device"}
+                continue
+            results = {}
+            for pipeline_device in [None, args.pipeline_device]:
+                autoround = get_autoround(build_model(family, size), args, pipeline_device=pipeline_device)
+                block_names = autoround.quant_block_list[0]
+                all_inputs = autoround.cache_inter_data([block_names[0]], args.nsamples)
+
+                def setup():
+                    return (autoround.get_block_inputs({block_names[0]: dict(all_inputs[block_names[0]])},
+                                                       block_names[0]),)
+
+                def quant_blocks(inputs):
+                    autoround.quant_blocks(autoround.model, inputs, block_names, nblocks=1, device=args.device)
+
+                name = "sequential" if pipeline_device is None else "pipeline_device"
+                results[name] = measure(quant_blocks, args.repeat, setup=setup)
+                yield f"pipeline/{family}-{size}/iters{args.iters}/{name}", results[name]
+            yield f"pipeline/{family}-{size}/iters{args.iters}/speedup", {
+                "ratio": results["sequential"]["median"] / results["pipeline_device"]["median"]}
+
+
+def bench_wrapper_linear(args):
+    """Times the forward and backward of the quantize-dequantize of a wrapped linear layer per data type."""
+    for size in args.sizes:
+        shape = SIZES[size]
+        for name in args.data_types:
+            torch.manual_seed(0)
+            layer = torch.nn.Linear(shape["hidden_size"], shape["intermediate_size"])
+            for key, value in dict(DATA_TYPES[name], scale_dtype=torch.float16, act_bits=16,
+                                   act_group_size=32, act_sym=True, act_dynamic=True, act_data_type="int").items():
+                setattr(layer, key, value)
+            layer.weight.requires_grad_(False)
+            layer.bias.requires_grad_(False)
+            wrapper = WrapperLinear(layer, enable_minmax_tuning=True, device="cpu")
+            x = torch.randn(args.batch_size, args.seqlen, shape["hidden_size"])
+
+            def forward_backward():
+                wrapper(x).sum().backward()
+
+            yield f"wrapper_linear/{name}/{size}", measure(forward_backward, args.repeat * 10, warmup=2)
+
+
+def bench_sign_sgd(args):
+    """Times a SignSGD step over the rounding and min-max params of a block, with and without foreach."""
+    from auto_round.sign_sgd import SignSGD
+
+    for size in args.sizes:
+        shape = SIZES[size]
+        hidden_size, intermediate_size = shape["hidden_size"], shape["intermediate_size"]
+        expert_size = intermediate_size // 8
+        attention = [(hidden_size, hidden_size)] * 4
+        ## the linear layers of a llama block, and of a block of 64 small experts
+        blocks = {
+            "llama": attention + [(intermediate_size, hidden_size)] * 2 + [(hidden_size, intermediate_size)],
+            "moe": attention + [(expert_size, hidden_size)] * 64 * 2 + [(hidden_size, expert_size)] * 64,
+        }
+        for block, shapes in blocks.items():
+            round_params = [torch.zeros(shape, requires_grad=True) for shape in shapes]
+            minmax_params = [torch.ones(shape[0] * shape[1] // 32, requires_grad=True) for shape in shapes
+                             for _ in range(2)]
+            for p in round_params + minmax_params:
+                p.grad = torch.randn_like(p)
+            for foreach in [False, True]:
+                optimizer = SignSGD([{"params": round_params}, {"params": minmax_params}], lr=5e-3, foreach=foreach)
+                yield f"sign_sgd/{block}-{size}/foreach={foreach}", measure(optimizer.step, args.repeat * 10,
+                                                                            warmup=2)
+
+
+def bench_save_quantized(args):
+    """Times the packing and saving of a quantized model per export format, and the loading of the auto_round
+    format through AutoHfQuantizer."""
+    for family in args.families:
+        for size in args.sizes:
+            autoround = get_autoround(build_model(family, size), args, iters=2)
+            autoround.quantize()
+            output_dir = tempfile.mkdtemp(prefix="auto_round_bench_")
+            try:
+                for format in args.formats:
+                    path = os.path.join(output_dir, format)
+                    try:
+                        yield f"save_quantized/{format}/{family}-{size}", measure(
+                            lambda: autoround.save_quantized(path, format=format, inplace=False), args.repeat)
+                    except Exception as e:  # the packing of some formats requires optional packages
+                        yield f"save_quantized/{format}/{family}-{size}", {"skipped": f"{type(e).__name__}: {e}"}
+                path = os.path.join(output_dir, "auto_round")
+                if os.path.exists(path):
+                    yield f"load/auto_round/{family}-{size}", bench_load(path, args.repeat)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def bench_load(path, repeat):
+    """Times loading a model saved in the auto_round format, which converts its layers in AutoHfQuantizer."""
+    from transformers import AutoModelForCausalLM
+
+    from auto_round import AutoRoundConfig
+
+    def load():
+        AutoModelForCausalLM.from_pretrained(path, device_map="cpu", quantization_config=AutoRoundConfig(backend="cpu"))
+
+    try:
+        return measure(load, repeat)
+    except Exception as e:  # the cpu kernels of the quantized layers require optional packages
+        return {"skipped": f"{type(e).__name__}: {e}"}
+
+
+PHASES = {
+    "cache_inter_data": bench_cache_inter_data,
+    "quant_block": bench_quant_block,
+    "pipeline": bench_pipeline,
+    "wrapper_linear": bench_wrapper_linear,
+    "sign_sgd": bench_sign_sgd,
+    "save_quantized": bench_save_quantized,
+}
+
+
+def run_phases(args):
+    """Runs the selected phases and returns their results by name."""
+    results = {}
+    for phase in args.phases:
+        for name, result in PHASES[phase](args):
+            logger.info(f"{name}: {result}")
+            results[name] = result
+    return results
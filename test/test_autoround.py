@@ -1,4 +1,5 @@
 import copy
+import os
 import shutil
 import sys
 import unittest
@@ -12,14 +13,39 @@ from auto_round import AutoRound
 
 
 class LLMDataLoader:
-    def __init__(self):
+    def __init__(self, nsamples=3):
         self.batch_size = 1
+        self.nsamples = nsamples
 
     def __iter__(self):
-        for i in range(3):
+        for i in range(self.nsamples):
             yield torch.ones([1, 10], dtype=torch.long)
 
 
+def distributed_worker(rank, world_size, port, queue, kwargs):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.distributed.init_process_group("gloo", rank=rank, world_size=world_size)
+    model_name = "facebook/opt-125m"
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    autoround = AutoRound(
+        model,
+        tokenizer,
+        bits=4,
+        group_size=128,
+        sym=False,
+        iters=2,
+        seqlen=10,
+        batch_size=1,
+        dataset=LLMDataLoader(),
+        **kwargs,
+    )
+    model, _ = autoround.quantize()
+    queue.put((rank, [p.detach().float().sum().item() for p in model.parameters()]))
+    torch.distributed.destroy_process_group()
+
+
 class TestAutoRound(unittest.TestCase):
     @classmethod
     def setUpClass(self):
@@ -319,6 +345,378 @@ class TestAutoRound(unittest.TestCase):
         )
         autoround.quantize()
 
+    def test_pipeline_device(self):
+        bits, group_size, sym = 4, 128, False
+
+        def get_autoround(model, nblocks, pipeline_device=None):
+            return AutoRound(
+                model,
+                self.tokenizer,
+                bits=bits,
+                group_size=group_size,
+                sym=sym,
+                iters=2,
+                seqlen=10,
+                nblocks=nblocks,
+                dataset=self.llm_dataloader,
+                pipeline_device=pipeline_device,
+            )
+
+        for nblocks in [1, 2]:
+            expected_model, _ = get_autoround(copy.deepcopy(self.model), nblocks).quantize()
+            pipeline_model, _ = get_autoround(copy.deepcopy(self.model), nblocks, "cpu").quantize()
+            for p, expected_p in zip(pipeline_model.parameters(), expected_model.parameters()):
+                self.assertTrue(torch.equal(p, expected_p))
+
+    def test_enable_prefetch(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=2,
+            seqlen=10,
+            batch_size=1,
+            gradient_accumulate_steps=2,
+            low_gpu_mem_usage=True,
+            dataset=self.llm_dataloader,
+            enable_prefetch=True,
+        )
+        autoround.quantize()
+
+    def test_enable_fused_qdq(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            enable_fused_qdq=True,
+        )
+        autoround.quantize()
+
+    def test_convergence_policy(self):
+        bits, group_size, sym = 4, 128, False
+        for convergence_policy in ["rel_improve", "init_loss_budget"]:
+            autoround = AutoRound(
+                self.model,
+                self.tokenizer,
+                bits=bits,
+                group_size=group_size,
+                sym=sym,
+                iters=2,
+                seqlen=10,
+                dataset=self.llm_dataloader,
+                convergence_policy=convergence_policy,
+            )
+            autoround.quantize()
+
+    def test_adaptive_iters(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=4,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            adaptive_iters=True,
+        )
+        autoround.quantize()
+        block_iters = list(autoround.block_iters.values())
+        self.assertTrue(len(block_iters) > 0)
+        self.assertTrue(abs(sum(block_iters) - 4 * len(block_iters)) <= len(block_iters))
+
+    def run_distributed(self, port, **kwargs):
+        ctx = torch.multiprocessing.get_context("spawn")
+        queue = ctx.Queue()
+        processes = [ctx.Process(target=distributed_worker, args=(rank, 2, port, queue, kwargs)) for rank in range(2)]
+        for p in processes:
+            p.start()
+        results = dict(queue.get(timeout=600) for _ in processes)
+        for p in processes:
+            p.join()
+        return results
+
+    def test_data_parallel(self):
+        results = self.run_distributed(29511, enable_data_parallel=True)
+        self.assertEqual(results[0], results[1])
+
+    def test_block_parallel(self):
+        results = self.run_distributed(29512, enable_block_parallel=True, enable_quanted_input=False)
+        self.assertEqual(results[0], results[1])
+
+    def test_layer_parallel(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            enable_layer_parallel=True,
+        )
+        autoround.quantize()
+
+    def test_checkpoint_dir(self):
+        bits, group_size, sym = 4, 128, False
+        model = copy.deepcopy(self.model)
+
+        def get_autoround(model, checkpoint_dir=None):
+            return AutoRound(
+                model,
+                self.tokenizer,
+                bits=bits,
+                group_size=group_size,
+                sym=sym,
+                iters=2,
+                seqlen=10,
+                dataset=self.llm_dataloader,
+                checkpoint_dir=checkpoint_dir,
+            )
+
+        expected_model, _ = get_autoround(copy.deepcopy(model)).quantize()
+        autoround = get_autoround(copy.deepcopy(model), "./checkpoint")
+        quant_block, num_blocks = autoround.quant_block, []
+
+        def interrupted_quant_block(*args, **kwargs):
+            if len(num_blocks) == 2:
+                raise KeyboardInterrupt
+            num_blocks.append(1)
+            return quant_block(*args, **kwargs)
+
+        autoround.quant_block = interrupted_quant_block
+        with self.assertRaises(KeyboardInterrupt):
+            autoround.quantize()
+        resumed_model, _ = get_autoround(copy.deepcopy(model), "./checkpoint").quantize()
+        for p, expected_p in zip(resumed_model.parameters(), expected_model.parameters()):
+            self.assertTrue(torch.equal(p, expected_p))
+        shutil.rmtree("./checkpoint", ignore_errors=True)
+
+    def test_checkpoint_config_mismatch(self):
+        model = copy.deepcopy(self.model)
+
+        def get_autoround(model, bits, checkpoint_dir=None):
+            return AutoRound(
+                model,
+                self.tokenizer,
+                bits=bits,
+                group_size=128,
+                sym=False,
+                iters=2,
+                seqlen=10,
+                dataset=self.llm_dataloader,
+                checkpoint_dir=checkpoint_dir,
+            )
+
+        expected_model, _ = get_autoround(copy.deepcopy(model), 2).quantize()
+        autoround = get_autoround(copy.deepcopy(model), 4, "./checkpoint")
+        quant_block, num_blocks = autoround.quant_block, []
+
+        def interrupted_quant_block(*args, **kwargs):
+            if len(num_blocks) == 1:
+                raise KeyboardInterrupt
+            num_blocks.append(1)
+            return quant_block(*args, **kwargs)
+
+        autoround.quant_block = interrupted_quant_block
+        with self.assertRaises(KeyboardInterrupt):
+            autoround.quantize()
+        ## the block tuned with bits=4 is not reused
+        resumed_model, _ = get_autoround(copy.deepcopy(model), 2, "./checkpoint").quantize()
+        for p, expected_p in zip(resumed_model.parameters(), expected_model.parameters()):
+            self.assertTrue(torch.equal(p, expected_p))
+        shutil.rmtree("./checkpoint", ignore_errors=True)
+
+    def test_checkpoint_memory_plan_mismatch(self):
+        model = copy.deepcopy(self.model)
+
+        def get_autoround(model, memory_budget, checkpoint_dir=None):
+            return AutoRound(
+                model,
+                self.tokenizer,
+                bits=4,
+                group_size=128,
+                sym=False,
+                iters=2,
+                seqlen=10,
+                batch_size=2,
+                dataset=self.llm_dataloader,
+                memory_budget=memory_budget,
+                checkpoint_dir=checkpoint_dir,
+            )
+
+        autoround = get_autoround(copy.deepcopy(model), 1000, "./checkpoint")
+        self.assertEqual(autoround.batch_size, 2)
+        quant_block, num_blocks = autoround.quant_block, []
+
+        def interrupted_quant_block(*args, **kwargs):
+            if len(num_blocks) == 1:
+                raise KeyboardInterrupt
+            num_blocks.append(1)
+            return quant_block(*args, **kwargs)
+
+        autoround.quant_block = interrupted_quant_block
+        with self.assertRaises(KeyboardInterrupt):
+            autoround.quantize()
+        ## no batch fits the tiny budget, so the plan falls back to batch_size=1 and the block tuned with the planned
+        ## batch_size=2 is not reused
+        autoround = get_autoround(copy.deepcopy(model), 1e-6, "./checkpoint")
+        self.assertEqual(autoround.batch_size, 1)
+        quant_block, block_names = autoround.quant_block, []
+
+        def counted_quant_block(block_name, *args, **kwargs):
+            block_names.append(block_name)
+            return quant_block(block_name, *args, **kwargs)
+
+        autoround.quant_block = counted_quant_block
+        autoround.quantize()
+        self.assertEqual(len(block_names), len(self.model.model.decoder.layers))
+        shutil.rmtree("./checkpoint", ignore_errors=True)
+
+    def test_oom_backoff(self):
+        model = copy.deepcopy(self.model)
+
+        def get_autoround(model, batch_size, gradient_accumulate_steps):
+            return AutoRound(
+                model,
+                self.tokenizer,
+                bits=4,
+                group_size=128,
+                sym=False,
+                iters=2,
+                seqlen=10,
+                nsamples=8,
+                batch_size=batch_size,
+                gradient_accumulate_steps=gradient_accumulate_steps,
+                dataset=LLMDataLoader(nsamples=8),
+            )
+
+        def raise_oom(module, args):
+            ## the tuning runs out of memory with more than 2 samples and the inference with more than 4
+            if args[0].shape[0] > (2 if torch.is_grad_enabled() else 4):
+                raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+        expected_model, _ = get_autoround(copy.deepcopy(model), 2, 4).quantize()
+        model.model.decoder.layers[1].register_forward_pre_hook(raise_oom)
+        autoround = get_autoround(model, 8, 1)
+        model, _ = autoround.quantize()
+        self.assertIn({"stage": "inference", "batch_size": 4}, autoround.oom_adjustments)
+        self.assertIn({"stage": "tuning", "batch_size": 2, "gradient_accumulate_steps": 4,
+                       "block": "model.decoder.layers.1"}, autoround.oom_adjustments)
+        for p, expected_p in zip(model.parameters(), expected_model.parameters()):
+            self.assertTrue(torch.allclose(p, expected_p, atol=1e-3))
+
+    def test_telemetry_dir(self):
+        import json
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=4,
+            group_size=128,
+            sym=False,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            telemetry_dir="./telemetry",
+        )
+        autoround.quantize()
+        autoround.save_quantized(output_dir="./saved", inplace=False, format="itrex")
+        with open("./telemetry/telemetry.jsonl") as f:
+            records = [json.loads(line) for line in f]
+        blocks = [record for record in records if "block" in record]
+        self.assertEqual(len(blocks), len(self.model.model.decoder.layers))
+        for record in blocks:
+            self.assertGreater(record["samples_per_sec"], 0)
+            for phase in ["get_block_outputs", "forward", "backward", "step", "unwrap"]:
+                self.assertIn(phase, record["phases"])
+        self.assertEqual([record["phase"] for record in records if "phase" in record],
+                         ["calibration", "caching", "packing"])
+        with open("./telemetry/trace.json") as f:
+            events = json.load(f)["traceEvents"]
+        self.assertIn("packing", [event["name"] for event in events])
+        shutil.rmtree("./telemetry", ignore_errors=True)
+
+    def test_telemetry_pipeline_device(self):
+        import json
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=4,
+            group_size=128,
+            sym=False,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            pipeline_device="cpu",
+            telemetry_dir="./telemetry",
+        )
+        autoround.quantize()
+        with open("./telemetry/telemetry.jsonl") as f:
+            records = [json.loads(line) for line in f]
+        block_names = [f"model.decoder.layers.{i}" for i in range(len(self.model.model.decoder.layers))]
+        ## the outputs of the next blocks computed by the pipeline worker are not counted in the tuned blocks
+        self.assertEqual([record["block"] for record in records if "block" in record], block_names)
+        for record in records:
+            if "block" in record:
+                self.assertNotIn("pipeline_outputs", record["phases"])
+        for phase in ["pipeline_outputs", "get_block_outputs"]:
+            self.assertEqual([record["pipeline_block"] for record in records
+                              if record.get("phase") == phase and "pipeline_block" in record], block_names[1:])
+        shutil.rmtree("./telemetry", ignore_errors=True)
+
+    def test_torch_compile(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            enable_torch_compile=True,
+        )
+        torch._dynamo.reset()
+        counters = torch._dynamo.utils.counters
+        counters.clear()
+        autoround.quantize()
+        stats = list(autoround.compile_cache.stats.values())
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]["blocks"], len(autoround.model.model.decoder.layers))
+        ## the block forward is compiled once and its graph is reused by all the blocks, without recompiling
+        self.assertEqual(counters["frames"]["total"], 1)
+        self.assertEqual(counters["stats"]["unique_graphs"], 1)
+
+    def test_disk_cache_dir(self):
+        bits, group_size, sym = 4, 128, False
+        autoround = AutoRound(
+            self.model,
+            self.tokenizer,
+            bits=bits,
+            group_size=group_size,
+            sym=sym,
+            iters=2,
+            seqlen=10,
+            dataset=self.llm_dataloader,
+            disk_cache_dir="./disk_cache",
+        )
+        autoround.quantize()
+        self.assertEqual(len(os.listdir("./disk_cache")), 0)
+        shutil.rmtree("./disk_cache", ignore_errors=True)
+
 
     def test_fallback_layers(self):
         bits, group_size, sym = 4, 128, True
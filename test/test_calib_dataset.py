@@ -70,6 +70,63 @@ class TestLocalCalibDataset(unittest.TestCase):
         )
         autoround.quantize()
 
+    def test_calib_cache_dir(self):
+        from auto_round.calib_dataset import CachedCalibDataLoader, get_dataloader
+        cache_dir = "./saved/calib_cache"
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        dataloader = get_dataloader(self.tokenizer, 4, self.json_file, bs=2, nsamples=3, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cached_dataloader = get_dataloader(self.tokenizer, 4, self.json_file, bs=2, nsamples=3, cache_dir=cache_dir)
+        self.assertIsInstance(cached_dataloader, CachedCalibDataLoader)
+        batches, cached_batches = list(dataloader), list(cached_dataloader)
+        self.assertEqual(len(batches), len(cached_batches))
+        for batch, cached_batch in zip(batches, cached_batches):
+            self.assertTrue(torch.equal(batch["input_ids"], cached_batch["input_ids"]))
+            self.assertTrue(torch.equal(batch["attention_mask"], cached_batch["attention_mask"]))
+        get_dataloader(self.tokenizer, 5, self.json_file, bs=2, nsamples=3, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def test_txt(self):
+        from auto_round.calib_dataset import get_dataloader
+        txt_file = "./saved/tmp.txt"
+        with open(txt_file, "w") as f:
+            f.write("awefdsfsddfd\nfdfdfsdfdfdfd\ndfdsfsdfdfdfdf\n")
+        dataloader = get_dataloader(self.tokenizer, 4, txt_file, bs=2, nsamples=2)
+        input_ids = torch.cat([batch["input_ids"] for batch in dataloader])
+        self.assertEqual(list(input_ids.shape), [2, 4])
+
+    def test_repetition_filter(self):
+        from auto_round.calib_dataset import get_dataloader
+        jsonl_file = "./saved/repeat.jsonl"
+        with open(jsonl_file, "w") as f:
+            for text in ["hello " * 20, "awefdsfsddfd fdfdfsdfdfdfd dfdsfsdfdfdfdf", "hello " * 20]:
+                f.write(json.dumps({"text": text}) + "\n")
+        dataloader = get_dataloader(self.tokenizer, 6, jsonl_file, bs=4, nsamples=4)
+        input_ids = torch.cat([batch["input_ids"] for batch in dataloader])
+        self.assertEqual(input_ids.shape[0], 1)
+
+    def test_combine_local_dataset(self):
+        from auto_round.calib_dataset import get_dataloader, interleave_samples
+        self.assertEqual(interleave_samples([["a1", "a2", "a3", "a4"], ["b1", "b2"]]),
+                         ["a1", "b1", "a2", "a3", "b2", "a4"])
+        dataloader = get_dataloader(self.tokenizer, 4, f"{self.json_file}:num=1,{self.jsonl_file}", bs=8, nsamples=2)
+        input_ids = torch.cat([batch["input_ids"] for batch in dataloader])
+        self.assertEqual(input_ids.shape[0], 2)
+
+    def test_concat(self):
+        from auto_round.calib_dataset import get_dataloader
+        seqlen = 4
+        dataloader = get_dataloader(self.tokenizer, seqlen, f"{self.json_file}:concat=True", bs=8, nsamples=8)
+        input_ids = torch.cat([batch["input_ids"] for batch in dataloader])
+        self.assertEqual(input_ids.shape[-1], seqlen)
+        self.assertTrue(torch.all(input_ids[:, 0] == self.tokenizer.bos_token_id))
+        texts = ["awefdsfsddfd", "fdfdfsdfdfdfd", "dfdsfsdfdfdfdf"]
+        stream = sum([self.tokenizer(text, truncation=True, max_length=seqlen)["input_ids"][1:] for text in texts], [])
+        num = len(stream) // (seqlen - 1)
+        self.assertEqual(sorted(input_ids[:, 1:].tolist()),
+                         sorted([stream[i * (seqlen - 1):(i + 1) * (seqlen - 1)] for i in range(num)]))
+
     def test_apply_chat_template(self):
         model_name = "Qwen/Qwen2.5-0.5B-Instruct"
         model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", trust_remote_code=True)
@@ -17,3 +17,211 @@ class TestPackingWithNumba:
     @patch.object(auto_round_utils, "is_numba_available", lambda: False)
     def test_numba_not_installed(self):
         assert auto_round_utils.can_pack_with_numba() is False, "`can_pack_with_numba` should return False."
+
+
+class TestSamplingInputs:
+
+    def test_contiguous_tensor_list(self):
+        import torch
+        from auto_round.tensor_cache import ContiguousTensorList
+        samples = [torch.randn(1, 4, 8) for _ in range(5)]
+        store = ContiguousTensorList(dim=0, capacity=2)
+        store.extend(samples)
+        assert len(store) == 5
+        indices = torch.tensor([3, 0, 4])
+        expected = torch.cat([samples[i] for i in indices], dim=0)
+        assert torch.equal(auto_round_utils.gather_samples(store, indices), expected)
+        current_input_ids, current_input_others = auto_round_utils.sampling_inputs(
+            store, {"positional_inputs": [], "position_ids": torch.arange(4)}, indices, seqlen=4)
+        assert torch.equal(current_input_ids, expected)
+        assert torch.equal(current_input_others["position_ids"], torch.arange(4))
+
+    def test_contiguous_tensor_list_fallback(self):
+        import torch
+        from auto_round.tensor_cache import ContiguousTensorList
+        samples = [torch.randn(1, 4), torch.randn(1, 6), torch.randn(1, 4)]
+        store = ContiguousTensorList(dim=0)
+        store.extend(samples)
+        assert len(store) == 3
+        assert torch.equal(store[1], samples[1])
+        assert torch.equal(auto_round_utils.gather_samples(store, [0, 2]), torch.cat([samples[0], samples[2]]))
+
+    def test_disk_tensor_list(self, tmp_path):
+        import torch
+        from auto_round.tensor_cache import DiskTensorList
+        samples = [torch.randn(1, 4, 8, dtype=torch.bfloat16) for _ in range(3)]
+        store = DiskTensorList(str(tmp_path))
+        store.extend(samples)
+        store[1] = samples[1].to(torch.float16)
+        assert store[1].dtype == torch.float16
+        assert torch.equal(auto_round_utils.gather_samples(store, [2, 0]), torch.cat([samples[2], samples[0]]))
+        store.close()
+        assert len(list(tmp_path.iterdir())) == 0
+
+
+class TestFusedQDQ:
+
+    def _check(self, data_type, sym):
+        import torch
+        from auto_round.data_type import get_quant_func
+        from auto_round.data_type.fused import get_fused_quant_func
+        torch.manual_seed(0)
+        weight = torch.randn(8, 64)
+        init_v = torch.zeros(16, 32).uniform_(-0.5, 0.5)
+        quant_func, key = get_quant_func(data_type, 4, sym)
+        fused_quant_func = get_fused_quant_func(key)
+        assert fused_quant_func is not None
+        results = []
+        for func in (quant_func, fused_quant_func):
+            v = init_v.clone().requires_grad_(True)
+            min_scale = torch.ones(16).requires_grad_(True)
+            max_scale = torch.ones(16).requires_grad_(True)
+            torch.manual_seed(1)
+            qdq, scale, _ = func(weight, bits=4, group_size=32, v=v, min_scale=min_scale, max_scale=max_scale,
+                                 scale_dtype=torch.float32)
+            (qdq * torch.randn_like(qdq)).sum().backward()
+            results.append((qdq.detach(), scale, v.grad, min_scale.grad, max_scale.grad))
+        for ref, fused in zip(*results):
+            assert torch.allclose(ref, fused, atol=1e-5), "fused quantization should match the reference."
+
+    def test_int_asym(self):
+        self._check("int", False)
+
+    def test_int_sym(self):
+        self._check("int", True)
+
+
+class TestReshapedTensor:
+
+    def test_cached_reshaped_tensor(self):
+        import torch
+        from auto_round.data_type import get_quant_func
+        from auto_round.data_type.utils import reshape_pad_tensor_by_group_size
+        weight = torch.randn(8, 80)
+        reshaped_weight = reshape_pad_tensor_by_group_size(weight, 32)
+        for data_type, sym in (("int", True), ("int", False), ("mx_fp4", True)):
+            quant_func, _ = get_quant_func(data_type, 4, sym)
+            ref = quant_func(weight, bits=4, group_size=32, data_type=data_type)[0]
+            res = quant_func(weight, bits=4, group_size=32, data_type=data_type, reshaped_tensor=reshaped_weight)[0]
+            assert res.shape == weight.shape
+            assert torch.equal(ref, res), "the cached reshaped tensor should give the same result."
+
+
+class TestConvergencePolicy:
+
+    def _run(self, policy, losses):
+        policy.reset()
+        for i, loss in enumerate(losses):
+            if policy.update(loss):
+                return i + 1
+        return len(losses)
+
+    def test_plateau(self):
+        from auto_round.convergence import get_convergence_policy
+        losses = [1.0 / (i + 1) for i in range(20)] + [0.05] * 180
+        for name in ("ema", "rel_improve"):
+            policy = get_convergence_policy(name, 200)
+            used_iters = self._run(policy, losses)
+            assert 20 < used_iters < 200, f"{name} should stop on the plateau."
+            assert self._run(policy, [1.0 / (i + 1) for i in range(200)]) == 200
+
+    def test_init_loss_budget(self):
+        from auto_round.convergence import get_convergence_policy
+        policy = get_convergence_policy("init_loss_budget", 200)
+        assert self._run(policy, [1.0] * 200) == 200
+        assert self._run(policy, [0.25] * 200) == 50
+        assert self._run(policy, [10.0] * 200) == 200
+
+    def test_init_loss_budget_loss_scale(self):
+        from auto_round.convergence import get_convergence_policy
+        policy = get_convergence_policy("init_loss_budget", 200)
+
+        def run(init_loss, loss_scale):
+            policy.reset(loss_scale=loss_scale)
+            for i in range(200):
+                if policy.update(init_loss):
+                    return i + 1
+            return 200
+
+        ## the loss grows with the depth as the outputs do, the budget follows the loss relative to the outputs
+        assert run(1.0, 1.0) == 200
+        assert run(4.0, 4.0) == 200
+        assert run(2.0, 8.0) == 50
+
+        forks = [policy.fork() for _ in range(2)]
+        for fork, init_loss in zip(forks, [8.0, 1.0]):
+            fork.reset(loss_scale=1.0)
+            fork.update(init_loss)
+        assert forks[0].budget == 200 and forks[1].budget == 200
+        policy.join(forks)
+        assert policy.init_losses == [1.0, 1.0, 0.25, 8.0, 1.0]
+        assert run(1.0, 1.0) == 25
+
+
+class TestBestParamsStore:
+
+    def test_conditional_update(self):
+        import torch
+        block = torch.nn.Sequential(torch.nn.Linear(4, 4))
+        block[0].orig_layer = True
+        block[0].params = {"value": torch.nn.Parameter(torch.zeros(4, 4)),
+                           "min_scale": torch.nn.Parameter(torch.ones(4))}
+        for device in (None, "cpu"):
+            store = auto_round_utils.BestParamsStore(block, device=device)
+            assert len(store.keys()) == 0
+            store.update(torch.tensor(False))
+            assert store.get("0") is None
+            block[0].params["value"].data.fill_(0.25)
+            store.update(torch.tensor(True))
+            block[0].params["value"].data.fill_(0.5)
+            store.update(torch.tensor(False))
+            assert torch.all(store["0"]["value"] == 0.25)
+            store.update()
+            assert torch.all(store["0"]["value"] == 0.5)
+            assert torch.all(store["0"]["min_scale"] == 1.0)
+            assert block[0].params["value"].data_ptr() != store["0"]["value"].data_ptr()
+
+
+class TestSignSGD:
+
+    def test_foreach(self):
+        import torch
+        from auto_round.sign_sgd import SignSGD
+        torch.manual_seed(0)
+        init_params = [torch.randn(8, 4), torch.rand(16), torch.randn(3, 5, dtype=torch.bfloat16)]
+        grads = [[torch.randn_like(p) for p in init_params] for _ in range(3)]
+        results = []
+        for foreach in (False, True):
+            params = [p.clone().requires_grad_(True) for p in init_params]
+            optimizer = SignSGD([{"params": params[:2]}, {"params": params[2:], "lr": 0.05}],
+                                lr=0.1, momentum=0.9, foreach=foreach)
+            for step_grads in grads:
+                for p, g in zip(params, step_grads):
+                    p.grad = g.clone()
+                optimizer.step()
+            results.append(params)
+        for ref, res in zip(*results):
+            assert torch.equal(ref, res), "foreach SignSGD should match the single tensor implementation."
+
+
+class TestMemoryPlanner:
+
+    def test_plan(self):
+        import torch
+        import transformers
+        from auto_round.memory_planner import MemoryPlanner
+        config = transformers.LlamaConfig(hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+                                          num_attention_heads=4, num_key_value_heads=4, vocab_size=128)
+        model = transformers.LlamaForCausalLM(config)
+        planner = MemoryPlanner(model, [["model.layers.0", "model.layers.1"]], 32, 16, torch.float32, True,
+                                "cuda:0")
+        assert planner.estimate(4)["device"] > planner.estimate(2)["device"]
+        assert planner.estimate(4, low_gpu_mem_usage=True)["device"] < planner.estimate(4)["device"]
+
+        plan = planner.plan(planner.estimate(8)["device"], 8, 1)
+        assert plan["fits"] and plan["batch_size"] == 8 and plan["cache_device"] == "cuda:0"
+        plan = planner.plan(planner.estimate(2, low_gpu_mem_usage=True)["device"], 8, 1)
+        assert plan["fits"] and plan["low_gpu_mem_usage"] and plan["cache_device"] == "cpu"
+        assert plan["batch_size"] * plan["gradient_accumulate_steps"] == 8 and plan["batch_size"] >= 2
+        plan = planner.plan(1, 8, 2)
+        assert not plan["fits"] and plan["batch_size"] == 1 and plan["gradient_accumulate_steps"] == 16